@@ -1,26 +1,45 @@
 from __future__ import print_function
+import argparse
+import asyncio
+import bisect
+import codecs
+import collections
+import contextlib
+import contextvars
 import datetime
+import email.utils
+import functools
+import hashlib
+import json
 import os
 import pickle
+import random
 import re
+import signal
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from html.parser import HTMLParser
+from urllib.parse import urlparse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
-from openai import OpenAI
 
+# Google's client libraries, BeautifulSoup and lxml are imported by the
+# functions that use them, so a run only loads what it needs.
 load_dotenv()
 NEWSAPI_KEY = os.getenv("NEWSAPI_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not NEWSAPI_KEY or not OPENAI_API_KEY:
     raise ValueError("Please set the NEWSAPI_KEY and OPENAI_API_KEY in your .env file.")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
-from dotenv import load_dotenv
-
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-
 
 
 # -------------------------
@@ -34,612 +53,5810 @@ SCOPES = [
 
 
 # -------------------------
-# Google Docs API Functions
+# User Profiles
 # -------------------------
-def get_credentials():
-    """
-    Obtains valid user credentials from storage. If nothing has been stored,
-    or if the stored credentials are invalid, the OAuth2 flow is completed to
-    obtain new credentials.
-    """
-    creds = None
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
-    return creds
+# A profile is a directory holding one person's settings (profile.json), Google
+# token and state, so that one process can produce briefings for many people
+# (see run_batch). Without an active profile the .env settings and the working
+# directory are used.
+PROFILE_FILE = "profile.json"
+PROFILE_STATE_DIR = "state"
 
-def markdown_to_requests(markdown_text):
-    """
-    Converts simple Markdown (only headers and plain text) into Google Docs API requests.
-    This is a simple example – you can extend it for additional Markdown features.
-    """
-    requests_body = []
-    current_index = 1  # start after document start
-
-    for line in markdown_text.splitlines():
-        # Determine the style based on header markers.
-        if line.startswith("### "):
-            # Small header (e.g., Heading 3)
-            text = line.replace("### ", "")
-            text_style = {"bold": True, "fontSize": {"magnitude": 12, "unit": "PT"}}
-        elif line.startswith("## "):
-            # Medium header (e.g., Heading 2)
-            text = line.replace("## ", "")
-            text_style = {"bold": True, "fontSize": {"magnitude": 14, "unit": "PT"}}
-        elif line.startswith("# "):
-            # Large header (e.g., Heading 1)
-            text = line.replace("# ", "")
-            text_style = {"bold": True, "fontSize": {"magnitude": 16, "unit": "PT"}}
-        else:
-            text = line
-            text_style = {}  # no extra formatting
+# Settings that must come from the profile when one is active, so that one
+# person's briefing never goes to another person's chat or task list.
+PROFILE_ONLY_SETTINGS = {"ALERT_SENDERS", "TELEGRAM_CHAT_ID", "TODOIST_API_KEY"}
 
-        # Insert the text.
-        requests_body.append({
-            'insertText': {
-                'location': {'index': current_index},
-                'text': text + "\n"  # add newline after each line
-            }
-        })
+_current_profile = contextvars.ContextVar("profile", default=None)
 
-        # If there is any style, add a request to update the text style.
-        if text_style:
-            requests_body.append({
-                'updateTextStyle': {
-                    'range': {
-                        'startIndex': current_index,
-                        'endIndex': current_index + len(text)
-                    },
-                    'textStyle': text_style,
-                    'fields': 'bold,fontSize'
-                }
-            })
-
-        current_index += len(text) + 1  # update index (plus newline)
 
-    return requests_body
+def load_profile(path):
+    """
+    Reads a profile directory.
 
-def create_google_doc(activity_text):
+    Args:
+        path (str): Directory containing profile.json.
+
+    Returns:
+        profile (dict): "name", "path" and "settings" (profile.json with
+        upper-cased keys, e.g. "TELEGRAM_CHAT_ID").
     """
-    Creates a new Google Doc titled "activity for <today's date>" and inserts
-    the provided activity_text into the document, applying basic Markdown formatting.
+    with open(os.path.join(path, PROFILE_FILE), encoding="utf-8") as f:
+        settings = json.load(f)
+    return {
+        "name": os.path.basename(os.path.normpath(path)),
+        "path": path,
+        "settings": {key.upper(): value for key, value in settings.items()},
+    }
+
+
+def load_profiles(directory):
     """
-    creds = get_credentials()
-    service = build('docs', 'v1', credentials=creds)
+    Loads every profile in the subdirectories of directory.
 
-    today_str = datetime.date.today().strftime("%Y-%m-%d")
-    title = f"activity for {today_str}"
+    Returns:
+        profiles (list): Profiles sorted by name.
+    """
+    profiles = []
+    for entry in sorted(os.listdir(directory)):
+        path = os.path.join(directory, entry)
+        if os.path.isfile(os.path.join(path, PROFILE_FILE)):
+            profiles.append(load_profile(path))
+    return profiles
 
-    document_body = {'title': title}
-    doc = service.documents().create(body=document_body).execute()
-    document_id = doc.get('documentId')
-    print(f"Created document with title: '{title}', ID: {document_id}")
 
-    # Convert Markdown to API requests.
-    requests_body = markdown_to_requests(activity_text)
-    service.documents().batchUpdate(documentId=document_id, body={'requests': requests_body}).execute()
-    print("Inserted formatted text into the document.")
+@contextlib.contextmanager
+def use_profile(profile):
+    """
+    Makes profile the active profile for the current thread or task. Stages
+    started from here (threads or asyncio tasks) inherit it.
+    """
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
 
-    document_url = f"https://docs.google.com/document/d/{document_id}/edit"
-    return document_url
 
+def profile_setting(name, default=None):
+    """
+    Returns a setting from the active profile, falling back to the
+    environment unless it is one of PROFILE_ONLY_SETTINGS.
 
-# -------------------------
-# News, Email, and Calendar Functions
-# -------------------------
-USER_AGENT = "Agent (https://github.com/Heather-Herbert/Agent)"
+    Args:
+        name (str): Setting name, e.g. "TELEGRAM_BOT_TOKEN".
+        default: Returned when the setting is not set.
+    """
+    profile = _current_profile.get()
+    if profile is not None:
+        if name in profile["settings"]:
+            return profile["settings"][name]
+        if name in PROFILE_ONLY_SETTINGS:
+            return default
+    return os.getenv(name, default)
 
 
-def fetch_article_snippet(url):
+def profile_file(name, shared=False):
     """
-    Uses BeautifulSoup to fetch the first paragraph of an article.
+    Returns the path of a per-user file: inside the active profile's
+    directory, or in the working directory when there is no profile.
 
     Args:
-        url (str): The URL of the article.
-
-    Returns:
-        snippet (str): The first paragraph text, or an empty string if not found.
+        name (str): File name, e.g. "token.pickle".
+        shared (bool): Fall back to the working directory's copy if the
+            profile has none (e.g. the OAuth client in credentials.json).
     """
-    headers = {"User-Agent": USER_AGENT}
-    try:
-        response = requests.get(url, headers=headers, timeout=5)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            paragraphs = soup.find_all('p')  # Find all paragraph elements
+    profile = _current_profile.get()
+    if profile is None:
+        return name
+    path = os.path.join(profile["path"], name)
+    if shared and not os.path.exists(path):
+        return name
+    return path
 
-            all_text = ""
-            for p in paragraphs:
-                text = p.get_text(strip=True)
-                all_text += text + " "  # Add each paragraph's text with a space
 
-            return all_text.strip() # Remove any trailing space.
-        else:
-            print(f"Request to {url} returned status code: {response.status_code}") # More informative error output
-    except requests.exceptions.RequestException as e:  # Catch specific requests exceptions
-        print(f"Error fetching snippet from {url}: {e}")
-    except Exception as e: # Catch any other unexpected exceptions
-        print(f"An unexpected error occurred while processing {url}: {e}")
-    return ""
+# -------------------------
+# Tracing
+# -------------------------
+# Spans time every network or CPU-heavy call (see traced and http_request) and
+# nest through a context variable, which run_stages and submit_with_context
+# carry into worker threads. When a run's root span ends, its spans are
+# appended to TRACE_FILE as JSON lines if set (nothing rotates it), counters
+# are written to PROMETHEUS_TEXTFILE if set, and the spans are replayed to
+# OpenTelemetry when OTEL_EXPORT=1.
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+PROMETHEUS_TEXTFILE = os.getenv("PROMETHEUS_TEXTFILE", "")
+OTEL_EXPORT = os.getenv("OTEL_EXPORT", "0") == "1"
 
+_current_span = contextvars.ContextVar("span", default=None)
+_trace_lock = threading.Lock()
+_traces = {}  # trace_id -> finished spans of runs still in progress
 
-def get_news(api_key, query=None, limit=3):
+# Process-wide counters, exported in Prometheus text format.
+TRACE_METRICS = {
+    "span_seconds": collections.Counter(),   # span name -> seconds
+    "spans": collections.Counter(),          # (span name, status) -> count
+    "http_requests": collections.Counter(),  # (host, status) -> count
+    "http_bytes_in": collections.Counter(),  # host -> bytes
+    "http_bytes_out": collections.Counter(),
+    "http_retries": collections.Counter(),
+    "rate_limit_wait": collections.Counter(),  # host -> seconds spent waiting for a rate limit
+    "llm_tokens": collections.Counter(),     # "prompt"/"completion" -> tokens
+    "stage_seconds": {},                     # stage name -> seconds in the last run
+    "last_run": {},                          # "seconds", "timestamp"
+}
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
     """
-    Retrieves news articles from NewsAPI.
+    Times a block as a span, nested under the current span if there is one.
 
     Args:
-        api_key (str): Your NewsAPI key.
-        query (str): Optional query parameter (e.g. "transgender") for filtering news.
-        limit (int): Maximum number of articles to return.
+        name (str): Span name, e.g. "get_news" or "http GET".
+        **attrs: Initial attributes, e.g. host="newsapi.org".
 
-    Returns:
-        articles (list): List of articles from NewsAPI.
+    Yields:
+        record (dict): The span; attributes can be added to record["attrs"]
+        (or with set_span_attrs) until the block ends.
     """
-    url = "https://newsapi.org/v2/top-headlines"
-    params = {
-        "apiKey": api_key,
-        "language": "en",
-        "pageSize": limit
+    parent = _current_span.get()
+    record = {
+        "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex,
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent["span_id"] if parent else None,
+        "name": name,
+        "start": time.time(),
+        "seconds": None,
+        "status": "ok",
+        "attrs": attrs,
     }
-    if query:
-        params["q"] = query
-    headers = {"User-Agent": USER_AGENT}
-    response = requests.get(url, params=params, headers=headers)
-    data = response.json()
-    if data.get("status") != "ok":
-        print("Error fetching news:", data.get("message"))
-        return []
-    return data.get("articles", [])
+    if parent is None:
+        with _trace_lock:
+            _traces[record["trace_id"]] = []
+    token = _current_span.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["status"] = "error"
+        record["attrs"]["error"] = repr(e)[:200]
+        raise
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        _current_span.reset(token)
+        _finish_span(record)
 
 
-def compile_news_section(articles, section_title):
+def traced(func):
     """
-    Compiles a section of news into a text block.
+    Decorator that runs func (a function or coroutine function) in a span
+    named after it.
+    """
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with span(func.__name__):
+                return await func(*args, **kwargs)
+        return async_wrapper
 
-    Args:
-        articles (list): List of articles (each article is a dict).
-        section_title (str): Title for this section.
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
 
-    Returns:
-        section_text (str): A text block with headlines, snippets, and links.
+
+def set_span_attrs(**attrs):
     """
-    section_text = f"### {section_title}\n\n"
-    for article in articles:
-        title = article.get("title", "No Title")
-        url = article.get("url", "")
-        snippet = fetch_article_snippet(url)
-        section_text += f"**{title}**\n\n"
-        if snippet:
-            section_text += f"Snippet: {snippet}\n\n"
-        section_text += f"Link: {url}\n\n"
-    return section_text
+    Adds attributes to the current span, if any.
+    """
+    record = _current_span.get()
+    if record is not None:
+        record["attrs"].update(attrs)
 
 
-def extract_email_address(from_header):
+def submit_with_context(executor, func, *args, **kwargs):
     """
-    Extracts an email address from a 'From' header string.
+    Submits func to an executor in a copy of the caller's context, so that
+    its spans nest under the caller's (and the active profile carries over).
+    """
+    return executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
 
-    Args:
-        from_header (str): The full from header.
 
-    Returns:
-        email (str): The extracted email address.
+def trace_spans(trace_id=None):
     """
-    match = re.search(r'<(.+?)>', from_header)
-    if match:
-        return match.group(1).lower()
-    return from_header.strip().lower()
+    Returns the finished spans of a run still in progress (by default the
+    current one).
+    """
+    if trace_id is None:
+        current = _current_span.get()
+        trace_id = current and current["trace_id"]
+    with _trace_lock:
+        return list(_traces.get(trace_id, ()))
 
 
-def compile_emails_section(creds, alert_senders):
+def _finish_span(record):
     """
-    Retrieves Gmail messages from the last 24 hours, compiles them into a text block,
-    and flags any emails coming from addresses in the alert_senders list.
+    Updates the counters with a finished span and keeps it with its run;
+    when the run's root span finishes, the run is exported.
+    """
+    attrs = record["attrs"]
+    with _trace_lock:
+        metrics = TRACE_METRICS
+        metrics["span_seconds"][record["name"]] += record["seconds"]
+        metrics["spans"][(record["name"], record["status"])] += 1
+        if "host" in attrs and "status" in attrs:
+            host = attrs["host"]
+            metrics["http_requests"][(host, attrs["status"])] += 1
+            metrics["http_bytes_in"][host] += attrs.get("bytes_in") or 0
+            metrics["http_bytes_out"][host] += attrs.get("bytes_out") or 0
+            metrics["http_retries"][host] += attrs.get("retries") or 0
+            metrics["rate_limit_wait"][host] += attrs.get("rate_limit_wait") or 0
+        for kind in ("prompt", "completion"):
+            metrics["llm_tokens"][kind] += attrs.get(f"{kind}_tokens") or 0
 
-    Args:
-        creds: Google API credentials.
-        alert_senders (list): List of email addresses to alert on.
+        spans = _traces.get(record["trace_id"])
+        if spans is None:  # Finished after its run was exported, e.g. an abandoned scrape.
+            return
+        spans.append(record)
+        if record["parent_id"] is not None:
+            return
+        del _traces[record["trace_id"]]
+    export_trace(spans)
 
-    Returns:
-        emails_text (str): A text block with email details.
+
+def export_trace(spans):
+    """
+    Writes a finished run's spans to TRACE_FILE and OpenTelemetry, and the
+    counters to PROMETHEUS_TEXTFILE. Export errors are printed, not raised.
     """
-    gmail_service = build('gmail', 'v1', credentials=creds)
-    query = "newer_than:1d"
-    results = gmail_service.users().messages().list(userId='me', q=query).execute()
-    messages = results.get("messages", [])
+    try:
+        if TRACE_FILE and TRACE_FILE != "0":
+            os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+            lines = "".join(json.dumps(record, default=str) + "\n" for record in spans)
+            with _trace_lock, open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(lines)
+        if PROMETHEUS_TEXTFILE:
+            write_prometheus_textfile(PROMETHEUS_TEXTFILE)
+        if OTEL_EXPORT:
+            export_otel_spans(spans)
+    except Exception as e:
+        print(f"Error exporting trace: {e}")
 
-    emails_text = "### Emails Received in the Last 24 Hours\n\n"
 
-    if not messages:
-        emails_text += "No emails received in the last 24 hours.\n\n"
-        return emails_text
+def _prometheus_labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{key}="{escape(value)}"' for key, value in labels.items())
 
-    for msg in messages:
-        msg_id = msg.get("id")
-        msg_detail = gmail_service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-        headers = msg_detail.get("payload", {}).get("headers", [])
 
-        subject = "No Subject"
-        from_field = "Unknown"
-        date = "Unknown Date"
-        for header in headers:
-            name = header.get("name", "").lower()
-            if name == "subject":
-                subject = header.get("value")
-            elif name == "from":
-                from_field = header.get("value")
-            elif name == "date":
-                date = header.get("value")
+def prometheus_metrics():
+    """
+    Returns TRACE_METRICS in the Prometheus text exposition format.
+    """
+    with _trace_lock:
+        metrics = {key: dict(value) for key, value in TRACE_METRICS.items()}
+    lines = []
 
-        # Extract email address from the From header.
-        sender_email = extract_email_address(from_field)
-        alert = " [ALERT]" if sender_email in [x.lower() for x in alert_senders] else ""
+    def family(metric, kind, help_text, samples):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for labels, value in samples:
+            lines.append(f"{metric}{{{_prometheus_labels(**labels)}}} {value}" if labels else f"{metric} {value}")
 
-        snippet = msg_detail.get("snippet", "")
-        emails_text += f"**Subject:** {subject}{alert}\n"
-        emails_text += f"**From:** {from_field}\n"
-        emails_text += f"**Date:** {date}\n"
-        emails_text += f"Snippet: {snippet}\n\n"
-    return emails_text
+    family("agent_span_seconds_total", "counter", "Time spent in spans, by span name.",
+           [({"name": name}, round(seconds, 6)) for name, seconds in sorted(metrics["span_seconds"].items())])
+    family("agent_spans_total", "counter", "Finished spans, by name and status.",
+           [({"name": name, "status": status}, count) for (name, status), count in sorted(metrics["spans"].items())])
+    family("agent_http_requests_total", "counter", "HTTP requests, by host and final status.",
+           [({"host": host, "status": status}, count)
+            for (host, status), count in sorted(metrics["http_requests"].items(), key=str)])
+    for key, metric, help_text in (
+        ("http_bytes_in", "agent_http_received_bytes_total", "Response bytes received, by host."),
+        ("http_bytes_out", "agent_http_sent_bytes_total", "Request body bytes sent, by host."),
+        ("http_retries", "agent_http_retries_total", "HTTP retries, by host."),
+    ):
+        family(metric, "counter", help_text, [({"host": host}, value) for host, value in sorted(metrics[key].items())])
+    family("agent_rate_limit_wait_seconds_total", "counter", "Time requests waited for a rate limit, by host.",
+           [({"host": host}, round(seconds, 6)) for host, seconds in sorted(metrics["rate_limit_wait"].items())])
+    family("agent_llm_tokens_total", "counter", "OpenAI tokens used, by kind.",
+           [({"kind": kind}, count) for kind, count in sorted(metrics["llm_tokens"].items())])
+    family("agent_stage_seconds", "gauge", "Duration of each stage in the last run.",
+           [({"stage": name}, round(seconds, 6)) for name, seconds in sorted(metrics["stage_seconds"].items())])
+    if metrics["last_run"]:
+        family("agent_last_run_seconds", "gauge", "Wall clock time of the last run.",
+               [({}, round(metrics["last_run"]["seconds"], 6))])
+        family("agent_last_run_timestamp_seconds", "gauge", "When the last run finished.",
+               [({}, round(metrics["last_run"]["timestamp"], 3))])
+    return "\n".join(lines) + "\n"
 
 
-def compile_calendar_section(creds):
+def write_prometheus_textfile(path):
     """
-    Retrieves calendar events happening in the next 24 hours and compiles them into a text block.
+    Atomically writes the metrics for node_exporter's textfile collector.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_metrics())
+    os.replace(temp_path, path)
 
-    Args:
-        creds: Google API credentials.
 
-    Returns:
-        calendar_text (str): A text block with upcoming event details.
+def export_otel_spans(spans):
     """
-    calendar_service = build('calendar', 'v3', credentials=creds)
-    now = datetime.datetime.utcnow()
-    time_min = now.isoformat() + 'Z'
-    time_max = (now + datetime.timedelta(days=1)).isoformat() + 'Z'
-
-    events_result = calendar_service.events().list(
-        calendarId='primary',
-        timeMin=time_min,
-        timeMax=time_max,
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
-    events = events_result.get('items', [])
+    Replays a run's spans through the OpenTelemetry API with their original
+    timestamps. Needs the optional opentelemetry-api package; the SDK and
+    exporter are configured as usual (e.g. with opentelemetry-instrument).
+    """
+    from opentelemetry import trace
 
-    calendar_text = "### Calendar Events in the Next 24 Hours\n\n"
-    if not events:
-        calendar_text += "No upcoming events in the next 24 hours.\n\n"
-    else:
-        for event in events:
-            start = event.get('start', {}).get('dateTime', event.get('start', {}).get('date'))
-            summary = event.get('summary', 'No Title')
-            calendar_text += f"**{summary}** at {start}\n\n"
-    return calendar_text
+    tracer = trace.get_tracer("agent")
+    started = {}
+    for record in sorted(spans, key=lambda record: record["start"]):
+        parent = started.get(record["parent_id"])
+        context = trace.set_span_in_context(parent) if parent is not None else None
+        start_ns = int(record["start"] * 1e9)
+        otel_span = tracer.start_span(record["name"], context=context, start_time=start_ns,
+                                      attributes={key: value for key, value in record["attrs"].items()
+                                                  if isinstance(value, (str, bool, int, float))})
+        if record["status"] != "ok":
+            otel_span.set_status(trace.Status(trace.StatusCode.ERROR))
+        started[record["span_id"]] = otel_span
+    for record in spans:
+        started[record["span_id"]].end(end_time=int((record["start"] + record["seconds"]) * 1e9))
 
 
-def summarize_text(prompt_text, summary_prompt):
+def critical_path(stages, timings):
     """
-    Uses OpenAI's API to summarize the given text.
+    Returns the chain of stages that determined the run's wall clock time:
+    from the last stage to finish, repeatedly the dependency that finished
+    last.
 
     Args:
-        prompt_text (str): The text to summarize.
-        summary_prompt (str): Instructions to the AI for how to summarize.
+        stages (list): The Stage tuples that ran.
+        timings (dict): Timings as returned by run_stages.
 
     Returns:
-        summary (str): The summary generated by OpenAI.
+        path (list): Stage names, first to last.
     """
+    if not timings:
+        return []
+    deps = {stage.name: stage.deps for stage in stages}
+    name = max(timings, key=lambda stage_name: timings[stage_name]["end"])
+    path = [name]
+    while deps.get(name):
+        name = max(deps[name], key=lambda dep: timings[dep]["end"])
+        path.append(name)
+    return path[::-1]
 
-    url = "https://api.openai.com/v1/chat/completions"  # Correct URL for chat completions
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "User-Agent": USER_AGENT,  # Set the User-Agent header
-    }
 
-    full_prompt = f"{summary_prompt}\n\n{prompt_text}\n\nSummary:"
+def _slowest_leaf(span_id, children):
+    """
+    Follows the longest child span down from span_id to a leaf.
+    """
+    leaf = None
+    while children.get(span_id):
+        leaf = max(children[span_id], key=lambda record: record["seconds"])
+        span_id = leaf["span_id"]
+    return leaf
 
-    data = {
-        "model": "o3-mini-2025-01-31",  # or gpt-3.5-turbo if that is what you intended
-        "messages": [
-            {"role": "system", "content": "You are a helpful AI Agent."},
-            {"role": "user", "content": full_prompt}
-        ]
-    }
 
-    try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+def print_critical_path(stages, timings):
+    """
+    Prints the critical path of a run with, for each stage, the slowest
+    innermost span (e.g. one HTTP request) inside it. Also records the stage
+    durations for the Prometheus metrics.
 
-        json_response = response.json()
-        return json_response["choices"][0]["message"]["content"].strip()  # Access the content correctly
+    Args:
+        stages (list): The Stage tuples that ran.
+        timings (dict): Timings as returned by run_stages.
+    """
+    path = critical_path(stages, timings)
+    if not path:
+        return
+    wall = timings[path[-1]]["end"]
+    with _trace_lock:
+        TRACE_METRICS["stage_seconds"].update((name, timing["seconds"]) for name, timing in timings.items())
+        TRACE_METRICS["last_run"] = {"seconds": wall, "timestamp": time.time()}
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling OpenAI (requests): {e}")
-        if response.status_code != 200:
-            try:
-                error_message = response.json()
-                print(f"OpenAI API Error details: {error_message}")
-            except:
-                print(f"OpenAI API Error details: Status Code: {response.status_code}")
-        return ""
-    except (KeyError, IndexError) as e:  # Handle potential JSON parsing errors
-        print(f"Error parsing OpenAI response: {e}")
-        print(f"Raw response: {response.text}")  # print the raw response to help with debugging
-        return ""
-    except Exception as e:  # Catch any other exceptions
-        print(f"An unexpected error occurred: {e}")
-        return ""
+    children = collections.defaultdict(list)
+    for record in trace_spans():
+        children[record["parent_id"]].append(record)
+    print(f"\nCritical path (wall clock {wall:.2f}s):")
+    for name in path:
+        timing = timings[name]
+        share = 100 * timing["seconds"] / wall if wall else 0
+        detail = ""
+        leaf = _slowest_leaf(timing.get("span_id"), children)
+        if leaf is not None:
+            where = leaf["attrs"].get("host", "")
+            detail = f"  slowest: {leaf['name']} {where} {leaf['seconds']:.2f}s".rstrip()
+        print(f"  {name:<22} {timing['seconds']:7.2f}s {share:5.1f}%{detail}")
 
 
 # -------------------------
-# Telegram Integration Function
+# Google Docs API Functions
 # -------------------------
-def summarise_for_telegram(text, google_doc_url):
+# In incremental mode each run updates today's document in place instead of
+# creating a new one; sections are tracked by named ranges with this prefix.
+DOC_INCREMENTAL = os.getenv("DOC_INCREMENTAL", "1") != "0"
+DOC_STATE_FILE = "doc_snapshot.json"
+DOC_RANGE_PREFIX = "briefing:"
+
+# Service objects are built from discovery documents read once per process:
+# the copies bundled with google-api-python-client, or ones downloaded before
+# and kept in the cache. httplib2 connections are not thread-safe, so each
+# thread keeps its own services (and with them its keep-alive connections).
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/{api}/{version}/rest"
+DISCOVERY_CACHE_TTL = 7 * 24 * 60 * 60
+
+_credentials = {}  # token path -> credentials
+_credentials_lock = threading.Lock()
+_discovery_documents = {}
+_discovery_lock = threading.Lock()
+_thread_services = threading.local()
+
+
+@traced
+def get_credentials():
     """
-    Uses OpenAI to summarize the provided text, appends a link for more details,
-    and posts the final message to a Telegram bot.
+    Obtains valid user credentials from storage. If nothing has been stored,
+    or if the stored credentials are invalid, the OAuth2 flow is completed to
+    obtain new credentials.
 
-    Args:
-        text (str): The text to summarize.
-        google_doc_url (str): The URL of the Google Doc to be shared.
+    token.pickle (of the active profile) is read once per process; later
+    calls return the same credentials, refreshed if they have expired.
     """
-    # Create a summary using OpenAI.
-    telegram_summary_prompt = "Summarize the following content for a quick Telegram update:"
-    full_prompt = f"{telegram_summary_prompt}\n\n{text}\n\nSummary:"
+    token_path = profile_file('token.pickle')
+    with _credentials_lock:
+        creds = _credentials.get(token_path)
+        if creds is None and os.path.exists(token_path):
+            with open(token_path, 'rb') as token:
+                creds = pickle.load(token)
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                from google.auth.transport.requests import Request
+                creds.refresh(Request())
+            else:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+                flow = InstalledAppFlow.from_client_secrets_file(profile_file('credentials.json', shared=True),
+                                                                 SCOPES)
+                creds = flow.run_local_server(port=0)
+            with open(token_path, 'wb') as token:
+                pickle.dump(creds, token)
+        _credentials[token_path] = creds
+    return creds
 
-    url = "https://api.openai.com/v1/chat/completions"  # Correct URL for chat completions
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "User-Agent": USER_AGENT,  # Set the User-Agent header
-    }
 
-    data = {
-        "model": "o3-mini-2025-01-31",  # or gpt-3.5-turbo if that is what you intended
-        "messages": [
-            {"role": "system", "content": "You are a helpful AI Agent."},
-            {"role": "user", "content": full_prompt}
-        ]
-    }
+def discovery_document(name, version):
+    """
+    Returns the discovery document (JSON text) of a Google API, reading it
+    on first use.
 
-    try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+    Args:
+        name (str): API name, e.g. "docs".
+        version (str): API version, e.g. "v1".
 
-        json_response = response.json()
-        summary = json_response["choices"][0]["message"]["content"].strip()  # Access the content correctly
+    Returns:
+        document (str): The discovery document.
+    """
+    key = f"{name}.{version}"
+    with _discovery_lock:
+        document = _discovery_documents.get(key)
+        if document is None:
+            from googleapiclient.discovery_cache import get_static_doc
+            document = get_static_doc(name, version)
+            if document is None:
+                cached = cache_get("discovery", key, ttl=DISCOVERY_CACHE_TTL)
+                if cached:
+                    document = cached["value"]
+                else:
+                    response = http_request("GET", DISCOVERY_URL.format(api=name, version=version))
+                    response.raise_for_status()
+                    document = response.text
+                    cache_put("discovery", key, document)
+            _discovery_documents[key] = document
+    return document
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling OpenAI (requests): {e}")
-        if response.status_code != 200:
-            try:
-                error_message = response.json()
-                print(f"OpenAI API Error details: {error_message}")
-            except:
-                print(f"OpenAI API Error details: Status Code: {response.status_code}")
-        return ""
-    except (KeyError, IndexError) as e:  # Handle potential JSON parsing errors
-        print(f"Error parsing OpenAI response: {e}")
-        print(f"Raw response: {response.text}")  # print the raw response to help with debugging
-        return ""
-    except Exception as e:  # Catch any other exceptions
-        print(f"An unexpected error occurred: {e}")
-        return ""
 
+def google_service(name, version, creds):
+    """
+    Returns the current thread's service object for a Google API, building
+    it on first use. Its requests go through TRANSPORT_HOOKS["google"] when
+    one is set.
 
-    # Append the link to the Google Doc.
+    Args:
+        name (str): API name, e.g. "docs".
+        version (str): API version, e.g. "v1".
+        creds: Google API credentials.
 
-    TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-    telegram_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getUpdates"
+    Returns:
+        service: The service object.
+    """
+    from googleapiclient.discovery import build_from_document
 
-    try:
-        r = requests.get(telegram_url)
-        if r.status_code == 200:
-            updates = r.json()
-            if updates['ok']:
-                # Find the latest message from the user
-                for update in reversed(updates['result']):  # Reverse to get the latest first
-                    if 'message' in update and 'chat' in update['message']:
-                        chat_id = update['message']['chat']['id']
-                        print(f"Chat ID: {chat_id}")
-                        break  # Found it, no need to continue
-            else:
-                print("Error getting updates:", updates['description'])
+    hook = TRANSPORT_HOOKS["google"]
+    services = getattr(_thread_services, "services", None)
+    if services is None:
+        services = _thread_services.services = {}
+    key = (name, version, id(creds), id(hook))
+    entry = services.get(key)
+    if entry is None or entry[0] is not creds or entry[1] is not hook:
+        document = discovery_document(name, version)
+        if hook is not None:
+            service = build_from_document(document, http=hook(creds))
         else:
-            print("Error getting updates. Status code:", r.status_code)
+            service = build_from_document(document, credentials=creds)
+        entry = services[key] = (creds, hook, service)
+    return entry[2]
+
+
+# Markdown heading markers and the Docs named paragraph styles they map to.
+HEADING_STYLES = (
+    ("### ", "HEADING_3"),
+    ("## ", "HEADING_2"),
+    ("# ", "HEADING_1"),
+)
+# Inline Markdown: **bold**, [text](url) and bare http(s) URLs.
+INLINE_MARKDOWN = re.compile(r"\*\*(?P<bold>.+?)\*\*"
+                             r"|\[(?P<label>[^\]]+)\]\((?P<href>[^)\s]+)\)"
+                             r"|(?P<url>https?://[^\s<>()]+[^\s<>().,;:!?'\"])")
+
+
+def utf16_len(text):
+    """
+    Returns the length of text in UTF-16 code units, which is how the Google
+    Docs API counts indexes (emoji and other non-BMP characters count as two).
+    """
+    if text.isascii():
+        return len(text)
+    return len(text.encode("utf-16-le")) // 2
+
+
+class DocRequestBuilder:
+    """
+    Converts simple Markdown (headers, **bold**, links and plain text) into
+    Google Docs API requests one line at a time, so a document's requests can
+    be built while its text is still streaming in.
+
+    The output is a single insertText followed by range-based paragraph and
+    text style requests, with indexes counted in UTF-16 code units.
+    """
+
+    def __init__(self):
+        self.length = 0  # Document index units taken up by the complete lines.
+        self.text_parts = []
+        self.paragraph_ranges = []  # (start, end, namedStyleType), relative to 0
+        self.text_ranges = []  # (start, end, field, value), relative to 0, e.g. field "link" and a URL
+        self._pending = ""
+        self._fed = []
+
+    def feed(self, text):
+        """
+        Adds text; every line completed by it is converted straight away.
+        """
+        self._fed.append(text)
+        *complete, self._pending = (self._pending + text).split("\n")
+        for line in complete:
+            self._add_line(line)
+
+    def close(self):
+        """
+        Converts the final line if the text did not end with a newline.
+        """
+        if self._pending:
+            self._add_line(self._pending)
+            self._pending = ""
+
+    def source(self):
+        """
+        Returns all the Markdown fed so far.
+        """
+        return "".join(self._fed)
+
+    def _add_line(self, line):
+        line = line.rstrip("\r")
+        named_style = None
+        if line.startswith("#"):
+            for marker, style in HEADING_STYLES:
+                if line.startswith(marker):
+                    line = line[len(marker):]
+                    named_style = style
+                    break
+
+        line_start = self.length
+        if not named_style and "*" not in line and "]" not in line and "/" not in line:
+            # Plain text, e.g. blank lines and snippets: without these characters
+            # there is no bold, link or URL (single characters are found fastest).
+            self.text_parts.append(line + "\n")
+            self.length = line_start + utf16_len(line) + 1
+            return
+
+        position = line_start
+        pieces = []
+        last = 0
+        for match in INLINE_MARKDOWN.finditer(line):
+            if match.start() > last:
+                plain = line[last:match.start()]
+                pieces.append(plain)
+                position += utf16_len(plain)
+            if match.group("bold") is not None:
+                text = match.group("bold")
+                field, value = "bold", True
+            elif match.group("label") is not None:
+                text = match.group("label")
+                field, value = "link", match.group("href")
+            else:
+                text = match.group("url")
+                field, value = "link", text
+            size = utf16_len(text)
+            pieces.append(text)
+            self.text_ranges.append((position, position + size, field, value))
+            position += size
+            last = match.end()
+        pieces.append(line[last:])
+        pieces.append("\n")
+        self.text_parts.extend(pieces)
+        self.length = position + utf16_len(line[last:]) + 1  # plus newline
+
+        if named_style:
+            # A paragraph style range covers the paragraph's own newline.
+            self.paragraph_ranges.append((line_start, self.length, named_style))
+
+    def requests(self, start_index=1):
+        """
+        Returns the API requests for the converted lines, inserting at start_index.
+        """
+        return assemble_requests([self], start_index)
+
+
+def markdown_to_requests(markdown_text):
+    """
+    Converts simple Markdown (headers, **bold**, links and plain text) into
+    Google Docs API requests: one insertText plus the style ranges.
+    """
+    builder = DocRequestBuilder()
+    builder.feed(markdown_text)
+    builder.close()
+    return builder.requests(1)  # start after document start
+
+
+def _merge_ranges(ranges):
+    """
+    Merges touching or overlapping (start, end, key) ranges that share a
+    hashable key, in one pass over ranges ordered by start.
+    """
+    merged = []
+    latest = {}  # key -> position in merged of the key's last range
+    for start, end, key in ranges:
+        position = latest.get(key)
+        if position is not None and start <= merged[position][1]:
+            merged[position] = (merged[position][0], max(end, merged[position][1]), key)
+        else:
+            latest[key] = len(merged)
+            merged.append((start, end, key))
+    return merged
+
+
+def assemble_requests(builders, start_index=1, reset_styles=False):
+    """
+    Joins the output of several builders into a single insertText and one
+    style request per merged range. Each builder must hold whole lines, e.g.
+    one per section of the document.
+
+    Args:
+        builders (list): Closed DocRequestBuilder objects, in document order.
+        start_index (int): Where the first builder's text is inserted.
+        reset_styles (bool): Reset the inserted text to normal, unstyled
+            paragraphs first. Needed when inserting in front of existing
+            text, whose paragraph style the new text would otherwise inherit.
+
+    Returns:
+        requests_body (list): The combined API requests.
+    """
+    text_parts = []
+    paragraph_ranges = []
+    text_ranges = []
+    offset = start_index
+    for builder in builders:
+        text_parts.extend(builder.text_parts)
+        paragraph_ranges.extend((start + offset, end + offset, style)
+                                for start, end, style in builder.paragraph_ranges)
+        text_ranges.extend((start + offset, end + offset, (field, value))
+                           for start, end, field, value in builder.text_ranges)
+        offset += builder.length
+    if not text_parts:
+        return []
+
+    requests_body = [{
+        'insertText': {
+            'location': {'index': start_index},
+            'text': "".join(text_parts)
+        }
+    }]
+    if reset_styles:
+        whole = {'startIndex': start_index, 'endIndex': offset}
+        requests_body.append({
+            'updateParagraphStyle': {
+                'range': whole,
+                'paragraphStyle': {'namedStyleType': 'NORMAL_TEXT'},
+                'fields': 'namedStyleType'
+            }
+        })
+        requests_body.append({
+            'updateTextStyle': {'range': whole, 'textStyle': {}, 'fields': 'bold,link'}
+        })
+    for start, end, named_style in _merge_ranges(paragraph_ranges):
+        requests_body.append({
+            'updateParagraphStyle': {
+                'range': {'startIndex': start, 'endIndex': end},
+                'paragraphStyle': {'namedStyleType': named_style},
+                'fields': 'namedStyleType'
+            }
+        })
+    for start, end, (field, value) in _merge_ranges(text_ranges):
+        if start == end:
+            continue
+        requests_body.append({
+            'updateTextStyle': {
+                'range': {'startIndex': start, 'endIndex': end},
+                'textStyle': {'link': {'url': value}} if field == 'link' else {field: value},
+                'fields': field
+            }
+        })
+    return requests_body
+
+
+@traced
+def create_document_shell(creds):
+    """
+    Creates an empty Google Doc titled "activity for <today's date>".
+
+    Args:
+        creds: Google API credentials.
+
+    Returns:
+        document_id (str): The new document's ID.
+    """
+    service = google_service('docs', 'v1', creds)
+
+    today_str = datetime.date.today().strftime("%Y-%m-%d")
+    title = f"activity for {today_str}"
+
+    document_body = {'title': title}
+    doc = service.documents().create(body=document_body).execute()
+    document_id = doc.get('documentId')
+    print(f"Created document with title: '{title}', ID: {document_id}")
+    return document_id
+
+
+@traced
+def write_google_doc(creds, document_id, requests_body):
+    """
+    Sends prepared requests to a document and returns its URL.
+
+    Args:
+        creds: Google API credentials.
+        document_id (str): The document to update.
+        requests_body (list): Docs API requests, e.g. from markdown_to_requests.
+
+    Returns:
+        document_url (str): The document's edit URL.
+    """
+    service = google_service('docs', 'v1', creds)
+    service.documents().batchUpdate(documentId=document_id, body={'requests': requests_body}).execute()
+    print("Inserted formatted text into the document.")
+
+    document_url = f"https://docs.google.com/document/d/{document_id}/edit"
+    return document_url
+
+
+@traced
+def open_daily_document(creds):
+    """
+    Returns today's document: the one recorded in the DOC_STATE_FILE snapshot
+    if it still exists, or a newly created one.
+
+    Args:
+        creds: Google API credentials.
+
+    Returns:
+        document_id (str): The ID of today's document.
+    """
+    from googleapiclient.errors import HttpError
+
+    today_str = datetime.date.today().isoformat()
+    snapshot = load_state(DOC_STATE_FILE, {})
+    document_id = snapshot.get("document_id")
+    if snapshot.get("date") == today_str and document_id:
+        service = google_service('docs', 'v1', creds)
+        try:
+            service.documents().get(documentId=document_id, fields='documentId').execute()
+            print(f"Updating today's document, ID: {document_id}")
+            return document_id
+        except HttpError as e:
+            print(f"Today's document {document_id} is no longer available ({e}); creating a new one.")
+
+    document_id = create_document_shell(creds)
+    save_state(DOC_STATE_FILE, {"date": today_str, "document_id": document_id, "sections": {}})
+    return document_id
+
+
+@traced
+def publish_sections(creds, document_id, sections):
+    """
+    Brings a document up to date section by section. Each section lives in a
+    named range; only sections whose text changed since the last publish
+    (per the local DOC_STATE_FILE snapshot) are replaced in place.
+
+    A document without the expected named ranges, e.g. a new one, has its
+    whole body rewritten.
+
+    Args:
+        creds: Google API credentials.
+        document_id (str): The document to update.
+        sections (list): (key, DocRequestBuilder) pairs in document order.
+
+    Returns:
+        document_url (str): The document's edit URL.
+    """
+    service = google_service('docs', 'v1', creds)
+    document_url = f"https://docs.google.com/document/d/{document_id}/edit"
+    snapshot = load_state(DOC_STATE_FILE, {})
+    if snapshot.get("document_id") != document_id:
+        snapshot = {"date": datetime.date.today().isoformat(), "document_id": document_id, "sections": {}}
+    published = snapshot.get("sections", {})
+    hashes = {key: hashlib.sha256(builder.source().encode("utf-8")).hexdigest() for key, builder in sections}
+
+    doc = service.documents().get(
+        documentId=document_id, fields='namedRanges,body/content/endIndex'
+    ).execute()
+    ranges = {}  # Only our own ranges; others belong to the user or other tools.
+    for name, named in doc.get('namedRanges', {}).items():
+        extents = named.get('namedRanges', [{}])[0].get('ranges', [])
+        if extents and name.startswith(DOC_RANGE_PREFIX):
+            ranges[name] = (extents[0].get('startIndex', 1), extents[-1]['endIndex'])
+
+    requests_body = []
+    if all(DOC_RANGE_PREFIX + key in ranges for key, _ in sections) and published:
+        # Replace changed sections from last to first, so the indexes of the
+        # sections before each one are still valid.
+        changed = [(key, builder) for key, builder in sections if published.get(key) != hashes[key]]
+        if not changed:
+            print("Document is already up to date.")
+            return document_url
+        print(f"Updating {len(changed)} changed sections: {', '.join(key for key, _ in changed)}")
+        for key, builder in sorted(changed, key=lambda item: ranges[DOC_RANGE_PREFIX + item[0]][0],
+                                   reverse=True):
+            start, end = ranges[DOC_RANGE_PREFIX + key]
+            requests_body.append({'deleteContentRange': {'range': {'startIndex': start, 'endIndex': end}}})
+            requests_body.extend(assemble_requests([builder], start, reset_styles=True))
+    else:
+        # Rewrite the whole body.
+        body_end = max([element.get('endIndex', 1) for element in doc.get('body', {}).get('content', [])] or [1])
+        if body_end > 2:
+            requests_body.append({'deleteContentRange': {'range': {'startIndex': 1, 'endIndex': body_end - 1}}})
+        requests_body.extend(assemble_requests([builder for _, builder in sections], 1, reset_styles=True))
+
+    # Re-create every named range from the new section lengths rather than
+    # relying on how the edits above stretched or shrank the old ones.
+    for name in ranges:
+        requests_body.append({'deleteNamedRange': {'name': name}})
+    index = 1
+    for key, builder in sections:
+        requests_body.append({'createNamedRange': {
+            'name': DOC_RANGE_PREFIX + key, 'range': {'startIndex': index, 'endIndex': index + builder.length}
+        }})
+        index += builder.length
+
+    service.documents().batchUpdate(documentId=document_id, body={'requests': requests_body}).execute()
+    snapshot["sections"] = hashes
+    save_state(DOC_STATE_FILE, snapshot)
+    print("Inserted formatted text into the document.")
+    return document_url
+
+
+def create_google_doc(activity_text):
+    """
+    Creates a new Google Doc titled "activity for <today's date>" and inserts
+    the provided activity_text into the document, applying basic Markdown formatting.
+    """
+    creds = get_credentials()
+    document_id = create_document_shell(creds)
+    # Convert Markdown to API requests.
+    return write_google_doc(creds, document_id, markdown_to_requests(activity_text))
+
+
+# -------------------------
+# Shared HTTP Client
+# -------------------------
+USER_AGENT = "Agent (https://github.com/Heather-Herbert/Agent)"
+
+# Connection pooling and retry settings shared by every outbound integration.
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+
+# Hosts whose completions can take much longer than a normal API call.
+HOST_TIMEOUTS = {
+    "api.openai.com": 300,
+}
+# POST is only retried where a repeat is harmless (Todoist requests carry an
+# X-Request-Id, so the API drops duplicates).
+RETRY_POST_HOSTS = {"api.openai.com", "api.todoist.com"}
+# Server errors are retried by urllib3. A 429 is retried by http_request
+# instead, after pausing every request to that upstream (see Rate Limiting).
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# Replacements for the network transports, e.g. the record/replay transports
+# of benchmarks/replay.py. Each is None or a function:
+#   "requests": HTTPAdapter -> adapter mounted on each host's session
+#   "httpx": AsyncHTTPTransport -> transport of each event loop's client
+#   "google": credentials -> httplib2.Http-like object for Google API calls
+TRANSPORT_HOOKS = {"requests": None, "httpx": None, "google": None}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter that applies a default timeout to every request that does
+    not set one explicitly.
+    """
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def get_session(url):
+    """
+    Returns the shared keep-alive session for the host of the given URL,
+    creating it on first use.
+
+    Args:
+        url (str): Any URL on the upstream host.
+
+    Returns:
+        session (requests.Session): A pooled session with default timeouts and
+        retry/backoff for that host.
+    """
+    host = urlparse(url).netloc.lower()
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            allowed_methods = set(Retry.DEFAULT_ALLOWED_METHODS)
+            if host in RETRY_POST_HOSTS:
+                allowed_methods.add("POST")
+            retry = Retry(
+                total=HTTP_RETRIES,
+                backoff_factor=HTTP_BACKOFF,
+                backoff_jitter=HTTP_BACKOFF,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=frozenset(allowed_methods),
+                raise_on_status=False,
+            )
+            adapter = TimeoutHTTPAdapter(
+                timeout=HOST_TIMEOUTS.get(host, HTTP_TIMEOUT),
+                pool_connections=1,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=retry,
+            )
+            if TRANSPORT_HOOKS["requests"] is not None:
+                adapter = TRANSPORT_HOOKS["requests"](adapter)
+            session = requests.Session()
+            session.headers["User-Agent"] = USER_AGENT
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host] = session
+    return session
+
+
+def http_request(method, url, **kwargs):
+    """
+    Sends a request through the shared session for the URL's host, paced by
+    the host's rate limits. A 429 response is retried (whatever the method,
+    as the request was refused rather than processed) after Retry-After or
+    a jittered backoff, during which other requests to the host wait too.
+
+    Args:
+        method (str): HTTP method, e.g. "GET" or "POST".
+        url (str): The URL to call.
+        **kwargs: Passed through to requests.Session.request.
+
+    Returns:
+        response (requests.Response): The response.
+    """
+    host = urlparse(url).netloc.lower()
+    with span(f"http {method}", host=host) as record:
+        waited = 0.0
+        for attempt in range(HTTP_RETRIES + 1):
+            waited += wait_for_rate_limit(host, request_costs(host, kwargs))
+            response = get_session(url).request(method, url, **kwargs)
+            observe_rate_limits(host, response.headers)
+            if response.status_code != 429 or attempt == HTTP_RETRIES:
+                break
+            rate_limit_pause(host, retry_delay(response.headers, attempt))
+            response.close()
+        attrs = response_attrs(response, kwargs.get("stream"))
+        record["attrs"].update(attrs, retries=attrs["retries"] + attempt, rate_limit_wait=round(waited, 6))
+        return response
+
+
+def response_attrs(response, stream=False):
+    """
+    Returns span attributes for a requests response: status, request and
+    response sizes and the number of retries urllib3 made. A streamed body
+    is not read, so its size is taken from Content-Length.
+    """
+    body = response.request.body
+    retries = getattr(response.raw, "retries", None)
+    if stream:
+        bytes_in = int(response.headers.get("Content-Length") or 0)
+    else:
+        bytes_in = len(response.content)
+    return {
+        "status": response.status_code,
+        "bytes_out": len(body) if isinstance(body, (bytes, str)) else 0,
+        "bytes_in": bytes_in,
+        "retries": len(retries.history) if retries is not None else 0,
+    }
+
+
+def close_sessions():
+    """
+    Closes every pooled session. Safe to call more than once.
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+# -------------------------
+# Rate Limiting
+# -------------------------
+# Requests to each upstream are paced with token buckets, so concurrent
+# stages and batch runs stay inside the API quotas rather than running into
+# 429s. A bucket holds `limit` tokens, refilled evenly over `period` seconds.
+# Rate limit headers in responses (OpenAI's x-ratelimit-*) correct the
+# buckets, and a 429 pauses its upstream for Retry-After seconds or a
+# jittered backoff.
+NEWSAPI_RPM = int(os.getenv("NEWSAPI_RPM", "60"))
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "200000"))
+TODOIST_RPM = int(os.getenv("TODOIST_RPM", "30"))
+GMAIL_HOST = "gmail.googleapis.com"
+
+# Upstream host -> {bucket: (limit, period in seconds)}.
+RATE_LIMITS = {
+    "newsapi.org": {"requests": (NEWSAPI_RPM, 60)},
+    "api.openai.com": {"requests": (OPENAI_RPM, 60), "tokens": (OPENAI_TPM, 60)},
+    "api.telegram.org": {"requests": (30, 1)},
+    "api.todoist.com": {"requests": (TODOIST_RPM, 60)},
+    GMAIL_HOST: {"units": (250, 1)},
+}
+# Quotas that apply per user rather than per API key; each profile gets its own buckets.
+PER_USER_RATE_LIMITS = {GMAIL_HOST, "api.todoist.com"}
+# Gmail quota units used by each method.
+GMAIL_QUOTA_UNITS = {"getProfile": 1, "history.list": 2, "messages.list": 5, "messages.get": 5}
+
+# Response headers: (bucket, limit header, remaining header, reset header).
+RATE_LIMIT_HEADERS = (
+    ("requests", "x-ratelimit-limit-requests", "x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+    ("tokens", "x-ratelimit-limit-tokens", "x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens"),
+    ("requests", "x-ratelimit-limit", "x-ratelimit-remaining", "x-ratelimit-reset"),
+)
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    A token bucket that callers reserve tokens from ahead of time: a request
+    that finds the bucket empty is told how long to wait for its tokens
+    instead of being refused, so bursts are spread out evenly.
+    """
+
+    def __init__(self, limit, period):
+        self.capacity = float(limit)
+        self.rate = limit / period
+        self.tokens = float(limit)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost=1):
+        """
+        Takes cost tokens, going into debt if there are too few.
+
+        Returns:
+            delay (float): Seconds to wait before sending the request.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # A request bigger than the whole bucket waits for a full one.
+            self.tokens -= min(cost, self.capacity)
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(delay, self.paused_until - now)
+
+    def observe(self, limit=None, remaining=None, reset=None):
+        """
+        Corrects the bucket with the upstream's own count: its limit, the
+        tokens it has left, and the seconds until it is full again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if limit and limit != self.capacity:
+                self.rate *= limit / self.capacity
+                self.capacity = float(limit)
+            # The quota may be shared with other processes, so trust a lower count.
+            if remaining is not None and remaining < self.tokens:
+                self.tokens = float(remaining)
+                if remaining <= 0 and reset:
+                    self.paused_until = max(self.paused_until, now + reset)
+
+    def pause(self, seconds):
+        """
+        Holds every request for the given number of seconds, e.g. after a 429.
+        """
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def rate_limit_buckets(host):
+    """
+    Returns the host's buckets (those of the active profile for per-user
+    quotas), creating them on first use.
+
+    Returns:
+        buckets (dict): Bucket name -> TokenBucket; empty for unlimited hosts.
+    """
+    limits = RATE_LIMITS.get(host)
+    if not limits:
+        return {}
+    profile = _current_profile.get() if host in PER_USER_RATE_LIMITS else None
+    key = (host, profile["path"] if profile else None)
+    with _buckets_lock:
+        buckets = _buckets.get(key)
+        if buckets is None:
+            buckets = _buckets[key] = {name: TokenBucket(limit, period) for name, (limit, period) in limits.items()}
+    return buckets
+
+
+def reserve_rate_limit(host, costs=None):
+    """
+    Reserves a request's costs from the host's buckets.
+
+    Args:
+        host (str): The upstream host.
+        costs (dict): Bucket name -> tokens; by default one request.
+
+    Returns:
+        delay (float): Seconds to wait before sending the request.
+    """
+    costs = costs or {"requests": 1}
+    delays = [bucket.reserve(costs[name]) for name, bucket in rate_limit_buckets(host).items() if name in costs]
+    return max(delays, default=0.0)
+
+
+def wait_for_rate_limit(host, costs=None):
+    """
+    Blocks until the host's rate limits allow a request.
+
+    Returns:
+        waited (float): Seconds waited.
+    """
+    delay = reserve_rate_limit(host, costs)
+    if delay > 0:
+        time.sleep(delay)
+    return delay
+
+
+async def async_wait_for_rate_limit(host, costs=None):
+    """
+    Async variant of wait_for_rate_limit.
+    """
+    delay = reserve_rate_limit(host, costs)
+    if delay > 0:
+        await asyncio.sleep(delay)
+    return delay
+
+
+def gmail_quota(method, count=1):
+    """
+    Waits until the active user's Gmail quota allows count calls of method.
+    """
+    return wait_for_rate_limit(GMAIL_HOST, {"units": GMAIL_QUOTA_UNITS[method] * count})
+
+
+def request_costs(host, kwargs):
+    """
+    Returns what a request costs against the host's buckets: one request,
+    plus the estimated prompt tokens of an OpenAI request.
+    """
+    costs = {"requests": 1}
+    body = kwargs.get("json")
+    if host == urlparse(OPENAI_URL).netloc and isinstance(body, dict):
+        costs["tokens"] = sum(estimate_tokens(message.get("content") or "") for message in body.get("messages", []))
+    return costs
+
+
+def parse_duration(value):
+    """
+    Parses a rate limit reset time: plain seconds ("20") or a duration like
+    "6m0s" or "250ms".
+
+    Returns:
+        seconds (float): The duration, or None if it can't be parsed.
+    """
+    value = (value or "").strip()
+    try:
+        return float(value)
+    except ValueError:
+        parts = DURATION_PART.findall(value)
+        if not parts:
+            return None
+        return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+def observe_rate_limits(host, headers):
+    """
+    Updates the host's buckets from the rate limit headers of a response.
+    """
+    buckets = rate_limit_buckets(host)
+    if not buckets:
+        return
+    for name, limit_header, remaining_header, reset_header in RATE_LIMIT_HEADERS:
+        bucket = buckets.get(name)
+        remaining = headers.get(remaining_header)
+        if bucket is None or remaining is None:
+            continue
+        limit = headers.get(limit_header)
+        reset = parse_duration(headers.get(reset_header))
+        if reset is not None and reset > 1e9:  # An epoch time rather than seconds.
+            reset -= time.time()
+        try:
+            bucket.observe(int(limit) if limit else None, int(remaining), reset)
+        except ValueError:
+            continue
+
+
+def rate_limit_pause(host, seconds):
+    """
+    Holds every request to the host (for the active profile, where its
+    quota is per user) for the given number of seconds.
+    """
+    for bucket in rate_limit_buckets(host).values():
+        bucket.pause(seconds)
+
+
+def backoff_delay(attempt):
+    """
+    Returns exponential backoff for the given attempt, plus up to
+    HTTP_BACKOFF of jitter (as urllib3 adds) so parallel callers don't retry
+    in step.
+    """
+    return HTTP_BACKOFF * (2 ** attempt) + random.uniform(0, HTTP_BACKOFF)
+
+
+def retry_delay(headers, attempt):
+    """
+    Returns how long to wait before retrying: the response's Retry-After
+    (seconds or an HTTP date) if given, otherwise backoff_delay.
+    """
+    retry_after = (headers.get("Retry-After") or "").strip()
+    if retry_after.isdigit():
+        return float(retry_after)
+    if retry_after:
+        try:
+            when = email.utils.parsedate_to_datetime(retry_after)
+            return max(0.0, when.timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return backoff_delay(attempt)
+
+
+# -------------------------
+# Persistent Cache
+# -------------------------
+# Responses are kept in a small SQLite database so that runs close together
+# (or the same story in two sections) skip the network and parsing.
+CACHE_DIR = os.getenv("AGENT_CACHE_DIR", ".agent_cache")
+CACHE_ENABLED = os.getenv("AGENT_CACHE", "1") != "0"
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+ARTICLE_CACHE_TTL = float(os.getenv("ARTICLE_CACHE_TTL", str(6 * 60 * 60)))
+NEWS_CACHE_TTL = float(os.getenv("NEWS_CACHE_TTL", "600"))
+
+_cache_conn = None
+_cache_lock = threading.Lock()
+
+
+def _cache_db():
+    """
+    Opens the cache database on first use. Must be called with _cache_lock held.
+    """
+    global _cache_conn
+    if _cache_conn is None:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _cache_conn = sqlite3.connect(os.path.join(CACHE_DIR, "cache.sqlite3"), check_same_thread=False)
+        _cache_conn.execute("PRAGMA journal_mode=WAL")
+        _cache_conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " stored_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        _cache_conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+    return _cache_conn
+
+
+def cache_get(namespace, key, ttl=None):
+    """
+    Looks up a cached value and marks it as recently used.
+
+    Args:
+        namespace (str): Cache namespace, e.g. "article" or "news".
+        key (str): Key within the namespace.
+        ttl (float): If given, entries older than this many seconds are
+            treated as missing.
+
+    Returns:
+        entry (dict): The entry with "value", "etag", "last_modified" and
+        "stored_at", or None if there is no usable entry.
+    """
+    if not CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        db = _cache_db()
+        row = db.execute(
+            "SELECT value, etag, last_modified, stored_at FROM cache WHERE namespace = ? AND key = ?",
+            (namespace, key),
+        ).fetchone()
+        if row is None:
+            return None
+        if ttl is not None and time.time() - row[3] > ttl:
+            return None
+        db.execute(
+            "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+            (time.time(), namespace, key),
+        )
+        db.commit()
+    return {"value": json.loads(row[0]), "etag": row[1], "last_modified": row[2], "stored_at": row[3]}
+
+
+def cache_put(namespace, key, value, etag=None, last_modified=None):
+    """
+    Stores a JSON-serialisable value, evicting the least recently used
+    entries once the cache grows past its size limits.
+
+    Args:
+        namespace (str): Cache namespace.
+        key (str): Key within the namespace.
+        value: The value to store.
+        etag (str): Optional ETag for conditional revalidation.
+        last_modified (str): Optional Last-Modified header for revalidation.
+    """
+    if not CACHE_ENABLED:
+        return
+    payload = json.dumps(value)
+    now = time.time()
+    with _cache_lock:
+        db = _cache_db()
+        db.execute(
+            "INSERT OR REPLACE INTO cache"
+            " (namespace, key, value, etag, last_modified, stored_at, accessed_at, size)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (namespace, key, payload, etag, last_modified, now, now, len(payload)),
+        )
+        _cache_evict(db)
+        db.commit()
+
+
+def cache_touch(namespace, key):
+    """
+    Marks an entry as freshly validated, e.g. after a 304 Not Modified.
+
+    Args:
+        namespace (str): Cache namespace.
+        key (str): Key within the namespace.
+    """
+    if not CACHE_ENABLED:
+        return
+    now = time.time()
+    with _cache_lock:
+        db = _cache_db()
+        db.execute(
+            "UPDATE cache SET stored_at = ?, accessed_at = ? WHERE namespace = ? AND key = ?",
+            (now, now, namespace, key),
+        )
+        db.commit()
+
+
+def _cache_evict(db):
+    """
+    Drops least recently used entries until the cache is within
+    CACHE_MAX_ENTRIES and CACHE_MAX_BYTES. Must be called with _cache_lock held.
+    """
+    count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+    if count <= CACHE_MAX_ENTRIES and total <= CACHE_MAX_BYTES:
+        return
+    rows = db.execute("SELECT namespace, key, size FROM cache ORDER BY accessed_at").fetchall()
+    for namespace, key, size in rows:
+        if count <= CACHE_MAX_ENTRIES and total <= CACHE_MAX_BYTES:
+            break
+        db.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+        count -= 1
+        total -= size
+
+
+# Small JSON state files (sync tokens, created tasks, ...) that must survive
+# between runs. Unlike the cache, losing them only costs a full resync.
+STATE_DIR = os.getenv("AGENT_STATE_DIR", ".agent_state")
+
+_state_lock = threading.Lock()
+
+
+def state_path(name):
+    """
+    Returns the path of a named state file.
+
+    Args:
+        name (str): File name, e.g. "todoist_created.json".
+
+    Returns:
+        path (str): The file's path inside STATE_DIR, or inside the active
+        profile's state directory.
+    """
+    profile = _current_profile.get()
+    if profile is not None:
+        return os.path.join(profile["path"], PROFILE_STATE_DIR, name)
+    return os.path.join(STATE_DIR, name)
+
+
+def load_state(name, default=None):
+    """
+    Reads a JSON state file.
+
+    Args:
+        name (str): File name inside STATE_DIR.
+        default: Returned if the file is missing or unreadable.
+
+    Returns:
+        state: The decoded JSON, or default.
+    """
+    path = state_path(name)
+    with _state_lock:
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable state file {path}: {e}")
+            return default
+
+
+def save_state(name, state):
+    """
+    Atomically writes a JSON state file.
+
+    Args:
+        name (str): File name inside STATE_DIR.
+        state: JSON-serialisable data.
+    """
+    path = state_path(name)
+    with _state_lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temp_path, path)
+
+
+# -------------------------
+# News, Email, and Calendar Functions
+# -------------------------
+
+# Article scraping limits: total worker threads, simultaneous requests per
+# site, and an overall deadline (in seconds) for scraping a whole section.
+SCRAPE_MAX_WORKERS = int(os.getenv("SCRAPE_MAX_WORKERS", "10"))
+SCRAPE_PER_HOST = int(os.getenv("SCRAPE_PER_HOST", "2"))
+SCRAPE_DEADLINE = float(os.getenv("SCRAPE_DEADLINE", "15"))
+
+
+# Article text extraction: which engine to use, how much body text to keep
+# per article, and how much of a page to download at most.
+ARTICLE_EXTRACTOR = os.getenv("ARTICLE_EXTRACTOR", "stream")
+ARTICLE_MAX_CHARS = int(os.getenv("ARTICLE_MAX_CHARS", "4000"))
+ARTICLE_MAX_BYTES = int(os.getenv("ARTICLE_MAX_BYTES", str(2 * 1024 * 1024)))
+
+
+class ParagraphExtractor(HTMLParser):
+    """
+    Incremental HTML parser that collects the text of <p> elements, skipping
+    script and style content, and flags when enough text has been collected.
+    """
+
+    SKIP_TAGS = {"script", "style", "noscript", "template", "svg"}
+
+    def __init__(self, max_chars):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.paragraphs = []
+        self.length = 0
+        self.done = False
+        self._current = None
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag == "p":
+            # <p> can't nest, so a new one implicitly closes the last.
+            self._finish_paragraph()
+            self._current = []
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag == "p":
+            self._finish_paragraph()
+
+    def handle_data(self, data):
+        if self._current is not None and not self._skip_depth:
+            self._current.append(data)
+
+    def close(self):
+        super().close()
+        self._finish_paragraph()
+
+    def _finish_paragraph(self):
+        if self._current is None:
+            return
+        text = " ".join("".join(self._current).split())
+        self._current = None
+        if text:
+            self.paragraphs.append(text)
+            self.length += len(text) + 1
+            if self.length >= self.max_chars:
+                self.done = True
+
+    def text(self):
+        return " ".join(self.paragraphs)[:self.max_chars]
+
+
+def extract_paragraphs_stream(chunks, max_chars):
+    """
+    Extracts paragraph text with an incremental html.parser, stopping as soon
+    as max_chars of text has been collected.
+
+    Args:
+        chunks (iterable): Decoded HTML text, in pieces.
+        max_chars (int): Maximum number of characters to return.
+
+    Returns:
+        text (str): The paragraphs joined by spaces.
+    """
+    extractor = ParagraphExtractor(max_chars)
+    for chunk in chunks:
+        extractor.feed(chunk)
+        if extractor.done:
+            break
+    else:
+        extractor.close()
+    return extractor.text()
+
+
+def extract_paragraphs_lxml(chunks, max_chars):
+    """
+    Extracts paragraph text with lxml's pull parser, stopping as soon as
+    max_chars of text has been collected. Requires the optional lxml package.
+
+    Args:
+        chunks (iterable): Decoded HTML text, in pieces.
+        max_chars (int): Maximum number of characters to return.
+
+    Returns:
+        text (str): The paragraphs joined by spaces.
+    """
+    from lxml import etree
+
+    parser = etree.HTMLPullParser(events=("end",), tag="p")
+    paragraphs = []
+    length = 0
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, element in parser.read_events():
+            for skipped in element.iter(*ParagraphExtractor.SKIP_TAGS):
+                skipped.text = None
+            text = " ".join("".join(element.itertext()).split())
+            element.clear(keep_tail=True)
+            if text:
+                paragraphs.append(text)
+                length += len(text) + 1
+        if length >= max_chars:
+            break
+    return " ".join(paragraphs)[:max_chars]
+
+
+def extract_paragraphs_bs4(chunks, max_chars):
+    """
+    Extracts paragraph text by building a full BeautifulSoup tree of the page.
+    Slower than the streaming engines, but the most forgiving of broken markup.
+
+    Args:
+        chunks (iterable): Decoded HTML text, in pieces.
+        max_chars (int): Maximum number of characters to return.
+
+    Returns:
+        text (str): The paragraphs joined by spaces.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup("".join(chunks), 'html.parser')
+    paragraphs = [p.get_text(" ", strip=True) for p in soup.find_all('p')]
+    return " ".join(text for text in paragraphs if text)[:max_chars]
+
+
+ARTICLE_EXTRACTORS = {
+    "stream": extract_paragraphs_stream,
+    "lxml": extract_paragraphs_lxml,
+    "bs4": extract_paragraphs_bs4,
+}
+
+
+def _body_decoder(content_type, encoding):
+    """
+    Returns an incremental decoder for a response body. Without an explicit
+    charset, HTTP clients fall back to ISO-8859-1 for text/*, which garbles the
+    UTF-8 most news sites serve, so UTF-8 is used instead.
+    """
+    if "charset" not in content_type.lower() or not encoding:
+        encoding = "utf-8"
+    try:
+        return codecs.getincrementaldecoder(encoding)(errors="replace")
+    except LookupError:
+        return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+
+def iter_response_text(response, max_bytes=ARTICLE_MAX_BYTES, chunk_size=16384):
+    """
+    Yields the decoded body of a streamed response, stopping after max_bytes.
+
+    Args:
+        response (requests.Response): A response requested with stream=True.
+        max_bytes (int): Maximum number of bytes to download.
+        chunk_size (int): Bytes read per chunk.
+
+    Yields:
+        text (str): Decoded pieces of the body.
+    """
+    decoder = _body_decoder(response.headers.get("Content-Type", ""), response.encoding)
+    received = 0
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        received += len(chunk)
+        yield decoder.decode(chunk)
+        if received >= max_bytes:
+            return
+    yield decoder.decode(b"", final=True)
+
+
+def revalidation_headers(cached):
+    """
+    Returns the request headers for fetching an article, with
+    If-None-Match/If-Modified-Since when a stale cached copy exists.
+    """
+    headers = {"User-Agent": USER_AGENT}
+    if cached:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+    return headers
+
+
+@traced
+def fetch_article_snippet(url):
+    """
+    Fetches an article and extracts its paragraph text with the
+    ARTICLE_EXTRACTOR engine, keeping at most ARTICLE_MAX_CHARS characters.
+
+    The extracted text is cached by URL. Fresh entries are returned without a
+    request; stale ones are revalidated with If-None-Match/If-Modified-Since,
+    and still returned if the site can't be reached.
+
+    Args:
+        url (str): The URL of the article.
+
+    Returns:
+        snippet (str): The paragraph text, or an empty string if not found.
+    """
+    cached = cache_get("article", url)
+    if cached and time.time() - cached["stored_at"] < ARTICLE_CACHE_TTL:
+        return cached["value"]
+
+    headers = revalidation_headers(cached)
+    extract = ARTICLE_EXTRACTORS.get(ARTICLE_EXTRACTOR, extract_paragraphs_stream)
+    try:
+        with http_request("GET", url, headers=headers, timeout=5, stream=True) as response:
+            if response.status_code == 304 and cached:
+                cache_touch("article", url)
+                return cached["value"]
+            if response.status_code == 200:
+                snippet = extract(iter_response_text(response), ARTICLE_MAX_CHARS)
+                cache_put("article", url, snippet,
+                          etag=response.headers.get("ETag"),
+                          last_modified=response.headers.get("Last-Modified"))
+                return snippet
+            else:
+                print(f"Request to {url} returned status code: {response.status_code}") # More informative error output
+    except requests.exceptions.RequestException as e:  # Catch specific requests exceptions
+        print(f"Error fetching snippet from {url}: {e}")
+    except Exception as e: # Catch any other unexpected exceptions
+        print(f"An unexpected error occurred while processing {url}: {e}")
+    return cached_article_snippet(url, cached)
+
+
+def cached_article_snippet(url, cached=None):
+    """
+    Returns the cached text of an article whose fetch failed or timed out,
+    however old, or an empty string if it was never fetched.
+    """
+    cached = cached or cache_get("article", url)
+    if not cached:
+        return ""
+    print(f"Using the cached text of {url}.")
+    return cached["value"]
+
+
+@traced
+def fetch_article_snippets(urls, max_workers=SCRAPE_MAX_WORKERS, per_host=SCRAPE_PER_HOST,
+                           deadline=SCRAPE_DEADLINE):
+    """
+    Fetches snippets for many articles in parallel.
+
+    At most per_host requests run against the same site at once, and the whole
+    batch is bounded by a single deadline, so the run time depends on the
+    slowest site rather than on the sum of all sites. Each site's other URLs
+    wait in a queue, not in a pool thread, so a site with many articles
+    doesn't hold up the rest.
+
+    Args:
+        urls (list): Article URLs.
+        max_workers (int): Maximum number of concurrent requests overall.
+        per_host (int): Maximum number of concurrent requests per host.
+        deadline (float): Seconds to wait for the whole batch.
+
+    Returns:
+        snippets (list): Snippets in the same order as urls. Articles that failed
+        or did not finish before the deadline get an empty string.
+    """
+    snippets = [""] * len(urls)
+    if not urls:
+        return snippets
+
+    queues = collections.defaultdict(collections.deque)  # host -> positions not yet started
+    for position, url in enumerate(urls):
+        if url:
+            queues[urlparse(url).netloc.lower()].append(position)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls))))
+    futures = {}  # future -> (position, host)
+
+    def submit_next(host):
+        if queues[host]:
+            position = queues[host].popleft()
+            future = submit_with_context(executor, fetch_article_snippet, urls[position])
+            futures[future] = (position, host)
+            running.add(future)
+
+    running = set()
+    for host in list(queues):
+        for _ in range(max(1, per_host)):
+            submit_next(host)
+    end = time.monotonic() + deadline if deadline is not None else None
+    while running:
+        timeout = max(0, end - time.monotonic()) if end is not None else None
+        done, running = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            position, host = futures[future]
+            try:
+                snippets[position] = future.result()
+            except Exception as e:
+                print(f"An unexpected error occurred while scraping {urls[position]}: {e}")
+            submit_next(host)
+    # Don't block on stragglers; they finish on their own request timeout.
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    given_up = [futures[future][0] for future in running]
+    given_up += [position for queue in queues.values() for position in queue]
+    for position in sorted(given_up):
+        print(f"Gave up on {urls[position]} after the {deadline}s scraping deadline.")
+        snippets[position] = cached_article_snippet(urls[position])
+    return snippets
+
+
+NEWSAPI_URL = "https://newsapi.org/v2/top-headlines"
+
+
+@traced
+def get_news(api_key, query=None, limit=3):
+    """
+    Retrieves news articles from NewsAPI.
+
+    Args:
+        api_key (str): Your NewsAPI key.
+        query (str): Optional query parameter (e.g. "transgender") for filtering news.
+        limit (int): Maximum number of articles to return.
+
+    Returns:
+        articles (list): List of articles from NewsAPI.
+    """
+    cache_key = json.dumps([query, limit])
+    cached = cache_get("news", cache_key, ttl=NEWS_CACHE_TTL)
+    if cached:
+        return cached["value"]
+
+    response = http_request("GET", NEWSAPI_URL, params=news_params(api_key, query, limit),
+                            headers={"User-Agent": USER_AGENT})
+    return _store_news(cache_key, response)
+
+
+def news_params(api_key, query, limit):
+    """
+    Returns the NewsAPI top-headlines query parameters.
+    """
+    params = {
+        "apiKey": api_key,
+        "language": "en",
+        "pageSize": limit
+    }
+    if query:
+        params["q"] = query
+    return params
+
+
+def _store_news(cache_key, response):
+    """
+    Caches and returns the articles of a NewsAPI response (from requests or
+    httpx). Errors, including ones that aren't JSON, give no articles.
+    """
+    try:
+        data = response.json()
+    except ValueError:
+        data = {"message": f"HTTP {response.status_code}"}
+    if response.status_code != 200 or data.get("status") != "ok":
+        print("Error fetching news:", data.get("message") or f"HTTP {response.status_code}")
+        return []
+    articles = data.get("articles", [])
+    cache_put("news", cache_key, articles)
+    return articles
+
+
+@traced
+def compile_news_section(articles, section_title):
+    """
+    Compiles a section of news into a text block.
+
+    Args:
+        articles (list): List of articles (each article is a dict).
+        section_title (str): Title for this section.
+
+    Returns:
+        section_text (str): A text block with headlines, snippets, and links.
+    """
+    urls = [article.get("url") or "" for article in articles]
+    return format_news_section(articles, fetch_article_snippets(urls), section_title)
+
+
+def format_news_section(articles, snippets, section_title):
+    """
+    Formats articles and their snippets as a news section.
+
+    Args:
+        articles (list): List of articles (each article is a dict).
+        snippets (list): Snippet text for each article ("" if none).
+        section_title (str): Title for this section.
+
+    Returns:
+        section_text (str): A text block with headlines, snippets, and links.
+    """
+    section_text = f"### {section_title}\n\n"
+    urls = [article.get("url") or "" for article in articles]
+    for article, url, snippet in zip(articles, urls, snippets):
+        title = article.get("title", "No Title")
+        section_text += f"**{title}**\n\n"
+        if snippet:
+            section_text += f"Snippet: {snippet}\n\n"
+        section_text += f"Link: {url}\n\n"
+        alternates = article.get("alternates")
+        if alternates:
+            sources = ", ".join(f"[{alternate['source']}]({alternate['url']})" if alternate.get("url")
+                                else alternate["source"] for alternate in alternates)
+            section_text += f"Also reported by: {sources}\n\n"
+    return section_text
+
+
+# Article de-duplication: articles with the same canonical URL, or whose
+# title and description SimHashes differ in at most NEWS_DEDUP_DISTANCE of 64
+# bits, are clustered. Only the first article of a cluster is scraped and
+# summarized; the others are listed as alternate sources.
+NEWS_DEDUP = os.getenv("NEWS_DEDUP", "1") != "0"
+NEWS_DEDUP_DISTANCE = int(os.getenv("NEWS_DEDUP_DISTANCE", "12"))
+TRACKING_PARAMS = re.compile(r"^(utm_\w+|fbclid|gclid|mc_cid|mc_eid|ocid|cmpid|ref|ref_src|smid|taid)$", re.I)
+HOST_PREFIXES = ("www.", "m.", "amp.", "mobile.")
+
+
+def canonical_url(url):
+    """
+    Normalises an article URL so that copies of the same page compare equal:
+    lower-cased host without www./m./amp. prefixes, no tracking parameters,
+    fragment, trailing slash or /amp suffix.
+
+    Args:
+        url (str): The article URL.
+
+    Returns:
+        canonical (str): The normalised URL ("" for an empty URL).
+    """
+    if not url:
+        return ""
+    parts = urlparse(url.strip())
+    host = (parts.hostname or "").lower()
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    path = re.sub(r"/(amp/?)?$", "", parts.path) or "/"
+    query = "&".join(sorted(
+        param for param in parts.query.split("&")
+        if param and not TRACKING_PARAMS.match(param.split("=", 1)[0])
+    ))
+    return f"{host}{path}" + (f"?{query}" if query else "")
+
+
+def simhash(text, bits=64):
+    """
+    Computes the SimHash of text from its words and word pairs.
+
+    Returns:
+        fingerprint (int): A bits-wide fingerprint; similar texts differ in
+        few bits.
+    """
+    words = re.findall(r"\w+", text.lower())
+    features = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+    weights = [0] * bits
+    for feature in features:
+        value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=bits // 8).digest(), "big")
+        for bit in range(bits):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(bits) if weights[bit] > 0)
+
+
+def article_fingerprint_text(article):
+    """
+    Returns the text an article is compared on: its title, without the
+    " - Source" suffix NewsAPI adds, and its description.
+    """
+    title = article.get("title") or ""
+    source = (article.get("source") or {}).get("name")
+    if source and title.endswith(f" - {source}"):
+        title = title[:-len(source) - 3]
+    return f"{title} {article.get('description') or ''}"
+
+
+@traced
+def dedupe_articles(sections, max_distance=NEWS_DEDUP_DISTANCE):
+    """
+    Clusters duplicate and near-duplicate articles across news sections.
+
+    Sections are taken in order, so a story that appears in several sections
+    is kept in the first; callers pass the most specific sections first.
+
+    Args:
+        sections (dict): Section name -> list of NewsAPI articles.
+        max_distance (int): Largest SimHash distance treated as the same story.
+
+    Returns:
+        sections (dict): Section name -> one article per cluster, in the
+        original order. Articles with duplicates carry an "alternates" list
+        of {"source", "url"}.
+    """
+    clusters = []  # [representative copy, canonical URLs, fingerprint]
+    by_url = {}
+    deduped = {name: [] for name in sections}
+    total = same_url = near = 0
+    for name, articles in sections.items():
+        for article in articles:
+            total += 1
+            url = canonical_url(article.get("url"))
+            cluster = by_url.get(url) if url else None
+            # Without a title or description there is nothing to compare; every
+            # such article would hash to 0 and match all the others.
+            text = article_fingerprint_text(article)
+            fingerprint = simhash(text) if re.search(r"\w", text) else None
+            if cluster is not None:
+                same_url += 1
+            elif fingerprint is not None:
+                cluster = next((candidate for candidate in clusters
+                                if candidate[2] is not None
+                                and bin(candidate[2] ^ fingerprint).count("1") <= max_distance), None)
+                if cluster is not None:
+                    near += 1
+            if cluster is None:
+                cluster = [dict(article, alternates=[]), set(), fingerprint]
+                clusters.append(cluster)
+                deduped[name].append(cluster[0])
+            elif url not in cluster[1]:
+                cluster[0]["alternates"].append({
+                    "source": (article.get("source") or {}).get("name") or urlparse(article.get("url") or "").netloc,
+                    "url": article.get("url"),
+                })
+            if url:
+                cluster[1].add(url)
+                by_url.setdefault(url, cluster)
+    if total:
+        print(f"News de-duplication: {total} articles -> {len(clusters)} stories "
+              f"({same_url} same URL, {near} near-duplicates).")
+    return deduped
+
+
+def extract_email_address(from_header):
+    """
+    Extracts an email address from a 'From' header string.
+
+    Args:
+        from_header (str): The full from header.
+
+    Returns:
+        email (str): The extracted email address.
+    """
+    match = re.search(r'<(.+?)>', from_header)
+    if match:
+        return match.group(1).lower()
+    return from_header.strip().lower()
+
+
+# Gmail allows up to 100 calls per batch but recommends no more than 50.
+GMAIL_BATCH_SIZE = 50
+GMAIL_BATCH_ATTEMPTS = 3
+# 403 reasons Gmail uses for going over a quota (other 403s are not retried).
+GMAIL_RATE_LIMITED = re.compile(r"rate ?limit exceeded", re.I)
+EMAIL_HEADERS = ["Subject", "From", "Date"]
+
+
+@traced
+def list_message_ids(gmail_service, query):
+    """
+    Lists the IDs of all Gmail messages matching a query, following
+    nextPageToken through every page of results.
+
+    Args:
+        gmail_service: Gmail API service object.
+        query (str): Gmail search query, e.g. "newer_than:1d".
+
+    Returns:
+        message_ids (list): Message IDs, newest first.
+    """
+    message_ids = []
+    page_token = None
+    while True:
+        gmail_quota("messages.list")
+        results = gmail_service.users().messages().list(
+            userId='me', q=query, maxResults=500, pageToken=page_token
+        ).execute()
+        message_ids.extend(msg["id"] for msg in results.get("messages", []))
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            return message_ids
+
+
+@traced
+def fetch_message_metadata(gmail_service, message_ids, missing=None):
+    """
+    Fetches the Subject/From/Date headers and snippet of many messages using
+    batched Gmail requests. Only message metadata is downloaded, not bodies.
+
+    Args:
+        gmail_service: Gmail API service object.
+        message_ids (list): IDs of the messages to fetch.
+        missing (set): If given, collects the IDs of messages that no longer
+            exist (404), e.g. deleted since they were listed.
+
+    Returns:
+        messages (list): Message resources in the same order as message_ids.
+        Messages that could not be fetched are left out.
+    """
+    fetched = {}
+    pending = list(message_ids)
+
+    for attempt in range(GMAIL_BATCH_ATTEMPTS):
+        retry = []
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                fetched[request_id] = response
+                return
+            status = getattr(getattr(exception, "resp", None), "status", None)
+            if status in (429, 500, 503) or (status == 403 and GMAIL_RATE_LIMITED.search(str(exception))):
+                retry.append(request_id)
+            elif status == 404 and missing is not None:
+                missing.add(request_id)
+            else:
+                print(f"Error fetching email {request_id}: {exception}")
+
+        for start in range(0, len(pending), GMAIL_BATCH_SIZE):
+            chunk = pending[start:start + GMAIL_BATCH_SIZE]
+            gmail_quota("messages.get", len(chunk))
+            batch = gmail_service.new_batch_http_request(callback=callback)
+            for msg_id in chunk:
+                batch.add(
+                    gmail_service.users().messages().get(
+                        userId='me', id=msg_id, format='metadata', metadataHeaders=EMAIL_HEADERS
+                    ),
+                    request_id=msg_id,
+                )
+            batch.execute()
+
+        if not retry:
+            break
+        pending = retry
+        if attempt + 1 < GMAIL_BATCH_ATTEMPTS:
+            # Rate limited: hold this user's Gmail calls before asking again for the failed messages.
+            rate_limit_pause(GMAIL_HOST, backoff_delay(attempt + 1))
+    else:
+        print(f"Gave up fetching {len(pending)} emails after {GMAIL_BATCH_ATTEMPTS} attempts.")
+
+    return [fetched[msg_id] for msg_id in message_ids if msg_id in fetched]
+
+
+def format_emails_section(messages, alert_senders, omitted=0):
+    """
+    Compiles Gmail message metadata into a text block, flagging any emails
+    coming from addresses in the alert_senders list.
+
+    Args:
+        messages (list): Gmail message resources with headers and snippet.
+        alert_senders (list): List of email addresses to alert on.
+        omitted (int): Less relevant emails left out (see rank_emails).
+
+    Returns:
+        emails_text (str): A text block with email details.
+    """
+    emails_text = "### Emails Received in the Last 24 Hours\n\n"
+
+    if not messages:
+        emails_text += "No emails received in the last 24 hours.\n\n"
+        return emails_text
+
+    alert_addresses = {x.lower() for x in alert_senders}
+    for msg_detail in messages:
+        headers = msg_detail.get("payload", {}).get("headers", [])
+
+        subject = "No Subject"
+        from_field = "Unknown"
+        date = "Unknown Date"
+        for header in headers:
+            name = header.get("name", "").lower()
+            if name == "subject":
+                subject = header.get("value")
+            elif name == "from":
+                from_field = header.get("value")
+            elif name == "date":
+                date = header.get("value")
+
+        # Extract email address from the From header.
+        sender_email = extract_email_address(from_field)
+        alert = " [ALERT]" if sender_email in alert_addresses else ""
+
+        snippet = msg_detail.get("snippet", "")
+        emails_text += f"**Subject:** {subject}{alert}\n"
+        emails_text += f"**From:** {from_field}\n"
+        emails_text += f"**Date:** {date}\n"
+        emails_text += f"Snippet: {snippet}\n\n"
+    if omitted:
+        emails_text += f"{omitted} less relevant emails are not listed.\n\n"
+    return emails_text
+
+
+# Incremental Gmail sync: remember the last historyId and the metadata of
+# recent messages, so each run only fetches what arrived since the last one.
+GMAIL_INCREMENTAL = os.getenv("GMAIL_INCREMENTAL", "1") != "0"
+GMAIL_STATE_FILE = "gmail_sync.json"
+GMAIL_RETENTION = datetime.timedelta(days=2)
+GMAIL_SKIP_LABELS = {"DRAFT", "SPAM", "TRASH"}
+
+
+def list_history_changes(gmail_service, start_history_id):
+    """
+    Lists the messages added and deleted since start_history_id, following
+    every page of the history. Messages moved to one of GMAIL_SKIP_LABELS
+    (trash or spam) count as deleted.
+
+    Args:
+        gmail_service: Gmail API service object.
+        start_history_id (str): The historyId of the last sync.
+
+    Returns:
+        added (list): IDs of added messages, oldest first.
+        deleted (set): IDs of deleted, trashed or spammed messages.
+        history_id (str): The mailbox's current historyId.
+
+    Raises:
+        HttpError: With status 404 if start_history_id is too old.
+    """
+    added = []
+    deleted = set()
+    history_id = start_history_id
+    page_token = None
+    while True:
+        gmail_quota("history.list")
+        results = gmail_service.users().history().list(
+            userId='me', startHistoryId=start_history_id, pageToken=page_token,
+            historyTypes=['messageAdded', 'messageDeleted', 'labelAdded'], maxResults=500
+        ).execute()
+        for record in results.get("history", []):
+            for item in record.get("messagesAdded", []):
+                message = item.get("message", {})
+                if not GMAIL_SKIP_LABELS.intersection(message.get("labelIds", [])):
+                    added.append(message["id"])
+            for item in record.get("messagesDeleted", []):
+                deleted.add(item["message"]["id"])
+            for item in record.get("labelsAdded", []):
+                if GMAIL_SKIP_LABELS.intersection(item.get("labelIds", [])):
+                    deleted.add(item["message"]["id"])
+        history_id = results.get("historyId", history_id)
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            return added, deleted, history_id
+
+
+@traced
+def sync_gmail(gmail_service):
+    """
+    Brings the local store of recent message metadata up to date.
+
+    The first run (or one whose stored historyId has expired) lists the last
+    day's messages; later runs only fetch the messages added since the stored
+    historyId. Messages that could not be fetched are kept as pending and
+    retried by the next runs, for up to GMAIL_RETENTION, unless they no
+    longer exist.
+
+    Args:
+        gmail_service: Gmail API service object.
+
+    Returns:
+        messages (list): Stored message resources from the last 24 hours,
+        newest first.
+    """
+    from googleapiclient.errors import HttpError
+
+    state = load_state(GMAIL_STATE_FILE, {})
+    history_id = state.get("history_id")
+    messages = state.get("messages", {})
+    pending = state.get("pending", {})  # Message ID -> when it was first seen, in ms.
+    added = None
+    now_ms = time.time() * 1000
+
+    if history_id:
+        try:
+            added, deleted, history_id = list_history_changes(gmail_service, history_id)
+            print(f"Gmail history: {len(added)} new messages since the last run.")
+            added = [msg_id for msg_id in list(pending) + added if msg_id not in deleted]
+            for msg_id in deleted:
+                messages.pop(msg_id, None)
+                pending.pop(msg_id, None)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            print("Stored Gmail historyId has expired; doing a full sync.")
+
+    if added is None:
+        # Read the historyId first so nothing arriving during the listing is missed.
+        gmail_quota("getProfile")
+        history_id = gmail_service.users().getProfile(userId='me').execute().get("historyId")
+        added = list_message_ids(gmail_service, "newer_than:1d")
+        messages = {}
+        pending = {}
+
+    new_ids = list(dict.fromkeys(msg_id for msg_id in added if msg_id not in messages))
+    missing = set()
+    for message in fetch_message_metadata(gmail_service, new_ids, missing):
+        messages[message["id"]] = {
+            "id": message["id"],
+            "internalDate": message.get("internalDate", "0"),
+            "snippet": message.get("snippet", ""),
+            "payload": {"headers": message.get("payload", {}).get("headers", [])},
+        }
+
+    retention_ms = GMAIL_RETENTION.total_seconds() * 1000
+    pending = {msg_id: pending.get(msg_id, now_ms) for msg_id in new_ids
+               if msg_id not in messages and msg_id not in missing
+               and now_ms - pending.get(msg_id, now_ms) <= retention_ms}
+    if pending:
+        print(f"Gmail: {len(pending)} messages could not be fetched; retrying them next run.")
+    messages = {msg_id: message for msg_id, message in messages.items()
+                if now_ms - int(message["internalDate"]) <= retention_ms}
+    save_state(GMAIL_STATE_FILE, {"history_id": history_id, "messages": messages, "pending": pending})
+
+    day_ms = 24 * 60 * 60 * 1000
+    recent = [message for message in messages.values() if now_ms - int(message["internalDate"]) <= day_ms]
+    return sorted(recent, key=lambda message: int(message["internalDate"]), reverse=True)
+
+
+@traced
+def compile_emails_section(creds, alert_senders):
+    """
+    Retrieves Gmail messages from the last 24 hours, compiles them into a text block,
+    and flags any emails coming from addresses in the alert_senders list.
+
+    Args:
+        creds: Google API credentials.
+        alert_senders (list): List of email addresses to alert on.
+
+    Returns:
+        emails_text (str): A text block with email details.
+    """
+    gmail_service = google_service('gmail', 'v1', creds)
+    if GMAIL_INCREMENTAL:
+        messages = sync_gmail(gmail_service)
+    else:
+        message_ids = list_message_ids(gmail_service, "newer_than:1d")
+        messages = fetch_message_metadata(gmail_service, message_ids)
+    ranked = rank_emails(messages, relevance_interests(), alert_senders)
+    return format_emails_section(ranked, alert_senders, omitted=len(messages) - len(ranked))
+
+
+# Incremental calendar sync: each calendar's nextSyncToken and a local index
+# of its events are kept between runs, so repeat runs only fetch changes.
+# Only events starting within CALENDAR_HORIZON are listed and indexed;
+# open-ended recurring events would otherwise add every future instance. A
+# full sync is redone once less than half of that horizon is left.
+CALENDAR_INCREMENTAL = os.getenv("CALENDAR_INCREMENTAL", "1") != "0"
+CALENDAR_IDS = [cal.strip() for cal in os.getenv("CALENDAR_IDS", "primary").split(",") if cal.strip()]
+CALENDAR_STATE_FILE = "calendar_sync.json"
+CALENDAR_RETENTION = datetime.timedelta(days=1)
+CALENDAR_HORIZON = datetime.timedelta(days=30)
+# Calendars are fetched on long-lived threads, which keep their Calendar
+# service from run to run (see google_service).
+CALENDAR_MAX_WORKERS = 8
+
+_calendar_executor = None
+_calendar_executor_lock = threading.Lock()
+
+
+def _event_time_utc(value):
+    """
+    Converts an event's start/end ({"dateTime": ...} or {"date": ...}) to an
+    ISO string in UTC, so index entries sort and compare as plain strings.
+    All-day events start at local midnight of their date.
+    """
+    if value.get('dateTime'):
+        moment = datetime.datetime.fromisoformat(value['dateTime'].replace('Z', '+00:00'))
+    elif value.get('date'):
+        moment = datetime.datetime.fromisoformat(value['date']).astimezone()
+    else:
+        return None
+    return moment.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def calendar_index_entry(event):
+    """
+    Reduces a Calendar API event to what the briefing needs.
+
+    Args:
+        event (dict): An event resource.
+
+    Returns:
+        entry (dict): "start" as shown in the briefing, "start_utc",
+        "end_utc" and "summary".
+    """
+    start = event.get('start', {})
+    start_utc = _event_time_utc(start)
+    return {
+        "start": start.get('dateTime', start.get('date')),
+        "start_utc": start_utc,
+        "end_utc": _event_time_utc(event.get('end', {})) or start_utc,
+        "summary": event.get('summary', 'No Title'),
+    }
+
+
+@traced
+def list_calendar_events(calendar_service, calendar_id, time_min, time_max):
+    """
+    Lists the events of one calendar in a time window, following every page.
+
+    Returns:
+        entries (list): Index entries (see calendar_index_entry), by start time.
+    """
+    entries = []
+    page_token = None
+    while True:
+        events_result = calendar_service.events().list(
+            calendarId=calendar_id,
+            timeMin=time_min,
+            timeMax=time_max,
+            singleEvents=True,
+            orderBy='startTime',
+            pageToken=page_token
+        ).execute()
+        entries.extend(calendar_index_entry(event) for event in events_result.get('items', []))
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            return entries
+
+
+@traced
+def sync_calendar(calendar_service, calendar_id, calendar_state):
+    """
+    Applies the changes to one calendar since its stored sync token to the
+    local event index. Without a token (when Google reports it as expired
+    with a 410, or when the indexed horizon is running out) a full sync from
+    one day ago to CALENDAR_HORIZON ahead is done instead.
+
+    Args:
+        calendar_service: Calendar API service object.
+        calendar_id (str): The calendar to sync, e.g. "primary".
+        calendar_state (dict): {"sync_token": ..., "horizon": ...,
+            "events": {event_id: entry}}.
+
+    Returns:
+        calendar_state (dict): The updated state.
+    """
+    from googleapiclient.errors import HttpError
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    sync_token = calendar_state.get("sync_token")
+    horizon = calendar_state.get("horizon")
+    if not horizon or horizon < (now + CALENDAR_HORIZON / 2).strftime('%Y-%m-%dT%H:%M:%SZ'):
+        sync_token = None
+    events = dict(calendar_state.get("events", {})) if sync_token else {}
+    page_token = None
+    changes = 0
+    while True:
+        params = {'calendarId': calendar_id, 'singleEvents': True, 'maxResults': 2500, 'pageToken': page_token}
+        if sync_token:
+            params['syncToken'] = sync_token
+        else:
+            horizon = (now + CALENDAR_HORIZON).strftime('%Y-%m-%dT%H:%M:%SZ')
+            params['timeMin'] = (now - CALENDAR_RETENTION).strftime('%Y-%m-%dT%H:%M:%SZ')
+            params['timeMax'] = horizon
+        try:
+            events_result = calendar_service.events().list(**params).execute()
+        except HttpError as e:
+            if e.resp.status != 410 or not sync_token:
+                raise
+            print(f"Sync token for calendar {calendar_id} expired; doing a full sync.")
+            sync_token = None
+            events = {}
+            page_token = None
+            continue
+
+        for event in events_result.get('items', []):
+            changes += 1
+            if event.get('status') == 'cancelled':
+                events.pop(event['id'], None)
+            else:
+                events[event['id']] = calendar_index_entry(event)
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            next_sync_token = events_result.get('nextSyncToken')
+            break
+
+    if sync_token:
+        print(f"Calendar {calendar_id}: {changes} changed events since the last run.")
+    # Changes report events past the horizon too; the next full sync lists them.
+    cutoff = (now - CALENDAR_RETENTION).strftime('%Y-%m-%dT%H:%M:%SZ')
+    events = {event_id: entry for event_id, entry in events.items()
+              if (entry["end_utc"] or "") >= cutoff and (entry["start_utc"] or "") < horizon}
+    return {"sync_token": next_sync_token, "horizon": horizon, "events": events}
+
+
+def events_in_window(events, time_min, time_max):
+    """
+    Returns the indexed events overlapping [time_min, time_max).
+
+    Args:
+        events (dict): Event ID -> index entry.
+        time_min (str): Window start, as a UTC ISO string.
+        time_max (str): Window end, as a UTC ISO string.
+
+    Returns:
+        entries (list): Matching entries, by start time.
+    """
+    ordered = sorted((entry for entry in events.values() if entry["start_utc"]),
+                     key=lambda entry: entry["start_utc"])
+    starts = [entry["start_utc"] for entry in ordered]
+    return [entry for entry in ordered[:bisect.bisect_left(starts, time_max)] if entry["end_utc"] > time_min]
+
+
+def calendar_executor():
+    """
+    Returns the process-wide pool calendars are fetched on, starting it on
+    first use.
+    """
+    global _calendar_executor
+    with _calendar_executor_lock:
+        if _calendar_executor is None:
+            _calendar_executor = ThreadPoolExecutor(max_workers=CALENDAR_MAX_WORKERS, thread_name_prefix="calendar")
+        return _calendar_executor
+
+
+def fetch_calendar_events(creds, calendar_ids, time_min, time_max):
+    """
+    Fetches the events of several calendars concurrently and merges them. A
+    single calendar is fetched on the calling thread.
+
+    Args:
+        creds: Google API credentials.
+        calendar_ids (list): Calendars to read.
+        time_min (str): Window start, as a UTC ISO string.
+        time_max (str): Window end, as a UTC ISO string.
+
+    Returns:
+        entries (list): Index entries from all calendars, by start time.
+    """
+    state = load_state(CALENDAR_STATE_FILE, {}) if CALENDAR_INCREMENTAL else {}
+
+    def fetch(calendar_id):
+        # Service objects are not thread-safe, so each thread builds its own.
+        calendar_service = google_service('calendar', 'v3', creds)
+        if not CALENDAR_INCREMENTAL:
+            return calendar_id, None, list_calendar_events(calendar_service, calendar_id, time_min, time_max)
+        calendar_state = sync_calendar(calendar_service, calendar_id, state.get(calendar_id, {}))
+        return calendar_id, calendar_state, events_in_window(calendar_state["events"], time_min, time_max)
+
+    if len(calendar_ids) == 1:
+        future = Future()
+        try:
+            future.set_result(fetch(calendar_ids[0]))
+        except Exception as e:
+            future.set_exception(e)
+        futures = [future]
+    else:
+        futures = [submit_with_context(calendar_executor(), fetch, calendar_id) for calendar_id in calendar_ids]
+
+    entries = []
+    failures = []
+    for calendar_id, future in zip(calendar_ids, futures):
+        try:
+            _, calendar_state, calendar_entries = future.result()
+        except Exception as e:
+            print(f"Error fetching calendar {calendar_id}: {e}")
+            failures.append(e)
+            continue
+        if calendar_state is not None:
+            state[calendar_id] = calendar_state
+        entries.extend(calendar_entries)
+    if failures and len(failures) == len(calendar_ids):
+        raise failures[0]
+    if CALENDAR_INCREMENTAL:
+        save_state(CALENDAR_STATE_FILE, state)
+    return sorted(entries, key=lambda entry: entry["start_utc"] or "")
+
+
+@traced
+def compile_calendar_section(creds, calendar_ids=None):
+    """
+    Retrieves calendar events happening in the next 24 hours and compiles them into a text block.
+
+    Args:
+        creds: Google API credentials.
+        calendar_ids (list): Calendars to include; defaults to CALENDAR_IDS.
+
+    Returns:
+        calendar_text (str): A text block with upcoming event details.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    time_min = now.strftime('%Y-%m-%dT%H:%M:%SZ')
+    time_max = (now + datetime.timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    events = fetch_calendar_events(creds, calendar_ids or CALENDAR_IDS, time_min, time_max)
+
+    calendar_text = "### Calendar Events in the Next 24 Hours\n\n"
+    if not events:
+        calendar_text += "No upcoming events in the next 24 hours.\n\n"
+    else:
+        for event in events:
+            calendar_text += f"**{event['summary']}** at {event['start']}\n\n"
+    return calendar_text
+
+
+# -------------------------
+# Relevance Ranking
+# -------------------------
+# Before anything is scraped or summarized, articles (title and description)
+# and emails (subject, snippet and sender) are scored locally by TF-IDF
+# cosine similarity to the reader's INTERESTS, a comma-separated list of
+# topics. Stories reported by several outlets and emails from ALERT_SENDERS
+# get a boost. Only the NEWS_TOP_K best articles per section and the
+# EMAIL_TOP_K best emails go on; the rest keep their original order. Without
+# INTERESTS there is nothing to rank by, so every item is kept; ranking also
+# needs NumPy.
+NEWS_TOP_K = int(os.getenv("NEWS_TOP_K", "8"))
+EMAIL_TOP_K = int(os.getenv("EMAIL_TOP_K", "30"))
+RELEVANCE_SOURCE_BOOST = 0.05  # Per alternate source of a story, up to RELEVANCE_MAX_SOURCES.
+RELEVANCE_MAX_SOURCES = 5
+RELEVANCE_ALERT_BOOST = 1.0  # More than any similarity, so alerts are always kept.
+RELEVANCE_TOKEN = re.compile(r"\w+")
+
+
+def _numpy():
+    """
+    Imports NumPy on first use, or returns None if it isn't installed.
+    """
+    try:
+        import numpy
+    except ImportError:
+        print("Relevance ranking needs NumPy (pip install numpy); keeping every item.")
+        return None
+    return numpy
+
+
+def relevance_interests(profile=None):
+    """
+    Returns the INTERESTS of a profile (by default the active one), or of
+    the environment if the profile has none.
+
+    Returns:
+        interests (list): Topics, e.g. ["climate policy", "rust"].
+    """
+    profile = profile or _current_profile.get()
+    interests = profile["settings"].get("INTERESTS") if profile is not None else None
+    if interests is None:
+        interests = os.getenv("INTERESTS", "")
+    if isinstance(interests, str):  # Profiles may also give a list.
+        interests = interests.split(",")
+    return [interest.strip() for interest in interests if interest.strip()]
+
+
+def relevance_scores(texts, interests, np):
+    """
+    Scores texts by their TF-IDF cosine similarity to the closest interest.
+
+    Term frequencies are sublinear (1 + log tf) and document frequencies are
+    counted over texts. Every step works on flat arrays of (text, term)
+    pairs, so the cost grows with the number of words rather than with
+    texts times vocabulary.
+
+    Args:
+        texts (list): The texts to score.
+        interests (list): Topics to compare against.
+        np: The numpy module.
+
+    Returns:
+        scores (numpy.ndarray): A similarity in [0, 1] for each text.
+    """
+    documents = [RELEVANCE_TOKEN.findall(text.lower()) for text in texts] + \
+                [RELEVANCE_TOKEN.findall(interest.lower()) for interest in interests]
+    count = len(texts)
+    if not count or not any(documents[count:]):
+        return np.zeros(count)
+    rows = np.repeat(np.arange(len(documents)), [len(tokens) for tokens in documents])
+    vocabulary = {}
+    columns = np.fromiter((vocabulary.setdefault(token, len(vocabulary)) for tokens in documents for token in tokens),
+                          dtype=np.int64, count=len(rows))
+    size = len(vocabulary)
+    pairs, frequencies = np.unique(rows * size + columns, return_counts=True)
+    rows, columns = np.divmod(pairs, size)
+
+    in_texts = rows < count
+    document_frequency = np.bincount(columns[in_texts], minlength=size)
+    idf = np.log((1 + count) / (1 + document_frequency)) + 1
+    weights = (1 + np.log(frequencies)) * idf[columns]
+    weights /= np.sqrt(np.bincount(rows, weights ** 2, minlength=len(documents)))[rows]
+
+    # Dense weights for the few interests; each text term looks its column up.
+    interest_weights = np.zeros((len(interests), size))
+    interest_weights[rows[~in_texts] - count, columns[~in_texts]] = weights[~in_texts]
+    contributions = weights[in_texts] * interest_weights[:, columns[in_texts]]
+    similarities = np.array([np.bincount(rows[in_texts], row, minlength=count) for row in contributions])
+    return similarities.max(axis=0)
+
+
+def top_k(items, scores, k, np):
+    """
+    Returns the k highest scoring items in their original order; ties go to
+    the earlier item.
+    """
+    if k <= 0 or len(items) <= k:
+        return list(items)
+    keep = np.sort(np.argsort(-np.asarray(scores), kind="stable")[:k])
+    return [items[index] for index in keep]
+
+
+@traced
+def rank_news_sections(sections, interests, k=NEWS_TOP_K):
+    """
+    Keeps the k most relevant articles of each news section.
+
+    Args:
+        sections (dict): Section name -> articles (after dedupe_articles).
+        interests (list): Topics to rank against; without any, every article
+            is kept.
+        k (int): Articles kept per section; 0 keeps them all.
+
+    Returns:
+        sections (dict): Section name -> kept articles.
+    """
+    total = sum(len(articles) for articles in sections.values())
+    if not interests or k <= 0 or all(len(articles) <= k for articles in sections.values()):
+        return sections
+    np = _numpy()
+    if np is None:
+        return sections
+    articles = [article for section in sections.values() for article in section]
+    scores = relevance_scores([article_fingerprint_text(article) for article in articles], interests, np)
+    scores += RELEVANCE_SOURCE_BOOST * np.minimum([len(article.get("alternates") or ()) for article in articles],
+                                                  RELEVANCE_MAX_SOURCES)
+    ranked = {}
+    start = 0
+    for name, section in sections.items():
+        ranked[name] = top_k(section, scores[start:start + len(section)], k, np)
+        start += len(section)
+    print(f"Relevance ranking: kept {sum(len(kept) for kept in ranked.values())} of {total} articles.")
+    return ranked
+
+
+def email_ranking_text(message):
+    """
+    Returns the text an email is ranked on: its subject, sender and snippet.
+    """
+    headers = {header.get("name", "").lower(): header.get("value") or ""
+               for header in message.get("payload", {}).get("headers", [])}
+    return f"{headers.get('subject', '')} {headers.get('from', '')} {message.get('snippet', '')}"
+
+
+@traced
+def rank_emails(messages, interests, alert_senders, k=EMAIL_TOP_K):
+    """
+    Keeps the k most relevant emails; ones from alert_senders come first.
+
+    Args:
+        messages (list): Gmail message resources with headers and snippet.
+        interests (list): Topics to rank against; without any, every email
+            is kept.
+        alert_senders (list): Addresses whose emails are boosted.
+        k (int): Emails kept; 0 keeps them all.
+
+    Returns:
+        messages (list): The kept messages, in their original order.
+    """
+    if not interests or k <= 0 or len(messages) <= k:
+        return messages
+    np = _numpy()
+    if np is None:
+        return messages
+    alert_addresses = {address.lower() for address in alert_senders}
+    scores = relevance_scores([email_ranking_text(message) for message in messages], interests, np)
+    senders = [next((header.get("value") or "" for header in message.get("payload", {}).get("headers", [])
+                     if header.get("name", "").lower() == "from"), "") for message in messages]
+    scores += RELEVANCE_ALERT_BOOST * np.array([extract_email_address(sender) in alert_addresses
+                                                for sender in senders])
+    kept = top_k(messages, scores, k, np)
+    print(f"Relevance ranking: kept {len(kept)} of {len(messages)} emails.")
+    return kept
+
+
+# -------------------------
+# OpenAI Completion Functions
+# -------------------------
+OPENAI_URL = "https://api.openai.com/v1/chat/completions"
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "o3-mini-2025-01-31")
+SYSTEM_PROMPT = "You are a helpful AI Agent."
+
+# Completions are cached on disk by a hash of the full request, so re-running
+# the pipeline after a downstream failure doesn't pay for them again.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 60 * 60)))
+LLM_CACHE_STATS = {"hits": 0, "misses": 0, "coalesced": 0}
+
+# Streaming: on by default so summaries can be consumed as they arrive and a
+# per-summary deadline (in seconds, 0 for none) can keep partial output.
+LLM_STREAM = os.getenv("LLM_STREAM", "1") != "0"
+SUMMARY_DEADLINE = float(os.getenv("SUMMARY_DEADLINE", "0"))
+LLM_STREAM_METRICS = collections.deque(maxlen=1000)  # The latest streamed calls; the daemon runs for days.
+
+_llm_inflight = {}
+_llm_lock = threading.Lock()
+
+
+def completion_cache_key(data):
+    """
+    Returns a content hash identifying a chat completion request.
+
+    Args:
+        data (dict): The request body (model, messages and parameters).
+
+    Returns:
+        key (str): Hex SHA-256 of the canonical JSON form of the request.
+    """
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _openai_headers():
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {OPENAI_API_KEY}",
+    }
+
+
+def _remaining_timeout(deadline):
+    """
+    Returns a (connect, read) timeout that ends at the given time.monotonic()
+    deadline, or None to use the session default when there is no deadline.
+    """
+    if deadline is None:
+        return None
+    remaining = max(0.1, deadline - time.monotonic())
+    return (min(10.0, remaining), remaining)
+
+
+def close_at_deadline(response, deadline):
+    """
+    Shuts a streamed response's socket when the deadline passes, so a stream
+    that stalls or trickles stops on time; the read timeout alone restarts
+    with every chunk.
+
+    Returns:
+        timer (threading.Timer): Cancel it once the stream is done, or None
+        without a deadline.
+    """
+    if deadline is None:
+        return None
+
+    def close():
+        sock = getattr(getattr(response.raw, "connection", None), "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        response.close()
+
+    timer = threading.Timer(max(0.0, deadline - time.monotonic()), close)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def is_stream_timeout(deadline, error):
+    """
+    Tells whether a requests error while streaming is a timeout: a connect
+    or read timeout (requests wraps one raised mid-body in ConnectionError),
+    or any error once the deadline has passed and the stream was shut.
+    """
+    if isinstance(error, requests.exceptions.Timeout):
+        return True
+    if error.args and isinstance(error.args[0], ReadTimeoutError):
+        return True
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def report_stream_timeout(deadline, error):
+    """
+    Prints why a streamed completion timed out: its deadline passed, or a
+    connect or read timed out before that (or with no deadline set).
+    """
+    if deadline is not None and time.monotonic() >= deadline:
+        print("Summary deadline reached; keeping the partial output.")
+    else:
+        print(f"OpenAI request timed out: {error}")
+
+
+def _post_chat_completion(data, deadline=None):
+    """
+    Sends a chat completion request to OpenAI.
+
+    Args:
+        data (dict): The request body.
+        deadline (float): Optional time.monotonic() value to give up at.
+
+    Returns:
+        content (str): The message content, or an empty string on any error.
+    """
+    response = None
+    try:
+        response = http_request("POST", OPENAI_URL, headers=_openai_headers(), json=data,
+                                timeout=_remaining_timeout(deadline))
+        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+
+        json_response = response.json()
+        record_llm_usage(json_response.get("usage"))
+        return json_response["choices"][0]["message"]["content"].strip()
+
+    except requests.exceptions.RequestException as e:
+        print(f"Error calling OpenAI (requests): {e}")
+        if response is not None and response.status_code != 200:
+            try:
+                error_message = response.json()
+                print(f"OpenAI API Error details: {error_message}")
+            except ValueError:
+                print(f"OpenAI API Error details: Status Code: {response.status_code}")
+        return ""
+    except (KeyError, IndexError) as e:  # Handle potential JSON parsing errors
+        print(f"Error parsing OpenAI response: {e}")
+        print(f"Raw response: {response.text}")  # print the raw response to help with debugging
+        return ""
+    except Exception as e:  # Catch any other exceptions
+        print(f"An unexpected error occurred: {e}")
+        return ""
+
+
+def parse_sse_line(line):
+    """
+    Parses one line of a streamed chat completion.
+
+    Returns:
+        finished (bool): True at the final "[DONE]" event.
+        delta (str): The content piece carried by the line, or None.
+        usage (dict): Token usage, sent in the last event before "[DONE]".
+    """
+    if not line or not line.startswith("data:"):
+        return False, None, None
+    payload = line[len("data:"):].strip()
+    if payload == "[DONE]":
+        return True, None, None
+    event = json.loads(payload)
+    choices = event.get("choices") or []
+    return False, choices[0].get("delta", {}).get("content") if choices else None, event.get("usage")
+
+
+def record_llm_usage(usage):
+    """
+    Adds a completion's token usage to the current span, which also counts
+    it in TRACE_METRICS.
+    """
+    if usage:
+        set_span_attrs(prompt_tokens=usage.get("prompt_tokens", 0),
+                       completion_tokens=usage.get("completion_tokens", 0))
+
+
+def iter_chat_completion(data, deadline=None):
+    """
+    Streams a chat completion from OpenAI (server-sent events), yielding the
+    content as it arrives and recording time-to-first-token in
+    LLM_STREAM_METRICS.
+
+    If the deadline passes, the stream is closed and whatever has arrived so
+    far is kept; the generator's return value then says the output is partial.
+
+    Args:
+        data (dict): The request body (without "stream").
+        deadline (float): Optional time.monotonic() value to stop at.
+
+    Yields:
+        delta (str): Pieces of the message content.
+    """
+    body = dict(data, stream=True, stream_options={"include_usage": True})
+    start = time.monotonic()
+    metrics = {"ttft": None, "seconds": None, "chars": 0, "complete": False}
+    response = None
+    timer = None
+    try:
+        response = http_request("POST", OPENAI_URL, headers=_openai_headers(), json=body, stream=True,
+                                timeout=_remaining_timeout(deadline))
+        response.raise_for_status()
+        response.encoding = "utf-8"
+        timer = close_at_deadline(response, deadline)
+        for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+            if deadline is not None and time.monotonic() > deadline:
+                print("Summary deadline reached; keeping the partial output.")
+                break
+            finished, delta, usage = parse_sse_line(line)
+            record_llm_usage(usage)
+            if finished:
+                metrics["complete"] = True
+                break
+            if delta:
+                if metrics["ttft"] is None:
+                    metrics["ttft"] = time.monotonic() - start
+                metrics["chars"] += len(delta)
+                yield delta
     except requests.exceptions.RequestException as e:
-        print("Error getting updates:", e)
+        if is_stream_timeout(deadline, e):
+            report_stream_timeout(deadline, e)
+        else:
+            print(f"Error calling OpenAI (requests): {e}")
+            if response is not None and response.status_code != 200:
+                try:
+                    print(f"OpenAI API Error details: {response.json()}")
+                except ValueError:
+                    print(f"OpenAI API Error details: Status Code: {response.status_code}")
+    except ValueError as e:  # Malformed event payload
+        print(f"Error parsing OpenAI stream: {e}")
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if response is not None:
+            response.close()
+        metrics["seconds"] = time.monotonic() - start
+        with _llm_lock:
+            LLM_STREAM_METRICS.append(metrics)
+    return metrics["complete"]
+
+
+def _stream_chat_completion(data, deadline=None, on_delta=None):
+    """
+    Collects a streamed completion, passing each piece to on_delta.
+    Leading whitespace is held back so that the streamed text matches the
+    stripped final content.
+
+    Returns:
+        content (str): The (possibly partial) message content.
+        complete (bool): False if the stream was cut short.
+    """
+    parts = []
+    stream = iter_chat_completion(data, deadline)
+    while True:
+        try:
+            delta = next(stream)
+        except StopIteration as stop:
+            complete = bool(stop.value)
+            break
+        if not parts:
+            delta = delta.lstrip()
+            if not delta:
+                continue
+        parts.append(delta)
+        if on_delta:
+            on_delta(delta)
+    return "".join(parts).strip(), complete
+
+
+@traced
+def chat_completion(prompt, use_cache=True, stream=False, deadline=None, on_delta=None, **params):
+    """
+    Runs a single-turn chat completion, using the on-disk completion cache.
+
+    Identical requests that are already in flight are coalesced: the second
+    caller waits for the first one's result instead of sending its own.
+
+    Args:
+        prompt (str): The user message.
+        use_cache (bool): Set to False to always call the API.
+        stream (bool): Stream the response and pass it to on_delta as it arrives.
+        deadline (float): Optional time.monotonic() value to stop at. A streamed
+            response keeps its partial text; partial text is never cached.
+        on_delta (callable): Called with each new piece of content. Cached and
+            non-streamed results are delivered in one piece.
+        **params: Extra request parameters (e.g. reasoning_effort).
+
+    Returns:
+        content (str): The completion text, or an empty string on any error.
+    """
+    data = chat_request_body(prompt, **params)
+
+    def request():
+        if stream:
+            return _stream_chat_completion(data, deadline, on_delta)
+        content = _post_chat_completion(data, deadline)
+        if content and on_delta:
+            on_delta(content)
+        return content, bool(content)
+
+    if not (use_cache and LLM_CACHE_ENABLED):
+        return request()[0]
+
+    key = completion_cache_key(data)
+    cached, future, owner = _claim_completion(key)
+    set_span_attrs(cache="miss" if owner else "hit" if cached is not None else "coalesced")
+    if not owner:
+        content = cached if cached is not None else future.result()
+        if content and on_delta:
+            on_delta(content)
+        return content
+
+    content = complete = None
+    try:
+        content, complete = request()
+    finally:
+        _release_completion(key, future, content or "", complete)
+    return content
+
+
+def chat_request_body(prompt, **params):
+    """
+    Returns the request body of a single-turn chat completion.
+    """
+    data = {
+        "model": OPENAI_MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+    }
+    data.update(params)
+    return data
+
+
+def _claim_completion(key):
+    """
+    Looks a completion up in the cache, or joins or starts the in-flight
+    request for it.
+
+    Returns:
+        cached (str): The cached content, or None.
+        future (Future): The in-flight request's future, or None on a cache hit.
+        owner (bool): True if the caller must send the request and then call
+            _release_completion.
+    """
+    cached = cache_get("llm", key, ttl=LLM_CACHE_TTL)
+    with _llm_lock:
+        if cached:
+            LLM_CACHE_STATS["hits"] += 1
+            return cached["value"], None, False
+        future = _llm_inflight.get(key)
+        if future is not None:
+            LLM_CACHE_STATS["coalesced"] += 1
+            return None, future, False
+        future = _llm_inflight[key] = Future()
+        LLM_CACHE_STATS["misses"] += 1
+        return None, future, True
+
+
+def _release_completion(key, future, content, complete):
+    """
+    Caches a finished completion and hands it to any coalesced callers.
+    Failures and partial output are never cached.
+    """
+    try:
+        if content and complete:
+            cache_put("llm", key, content)
+    finally:
+        with _llm_lock:
+            del _llm_inflight[key]
+        future.set_result(content)
+
+
+def print_llm_metrics():
+    """
+    Prints completion cache counters and time-to-first-token of streamed calls.
+    """
+    print(
+        f"LLM cache: {LLM_CACHE_STATS['hits']} hits, {LLM_CACHE_STATS['misses']} misses, "
+        f"{LLM_CACHE_STATS['coalesced']} coalesced."
+    )
+    tokens = TRACE_METRICS["llm_tokens"]
+    if tokens:
+        print(f"LLM tokens: {tokens['prompt']} prompt, {tokens['completion']} completion.")
+    ttfts = sorted(m["ttft"] for m in LLM_STREAM_METRICS if m["ttft"] is not None)
+    if ttfts:
+        partial = sum(1 for m in LLM_STREAM_METRICS if not m["complete"])
+        print(
+            f"LLM streams: {len(LLM_STREAM_METRICS)} calls, time to first token "
+            f"median {ttfts[len(ttfts) // 2]:.2f}s, max {ttfts[-1]:.2f}s, {partial} partial."
+        )
+
+
+# -------------------------
+# Token-Budgeted Summarization
+# -------------------------
+# Prompts larger than SUMMARY_TOKEN_BUDGET are split at article boundaries,
+# summarized in parallel and then reduced, so busy news days never overflow
+# the model's context window.
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "12000"))
+ARTICLE_TOKEN_LIMIT = int(os.getenv("ARTICLE_TOKEN_LIMIT", "600"))
+SUMMARY_MAX_WORKERS = int(os.getenv("SUMMARY_MAX_WORKERS", "4"))
+REDUCE_MAX_ROUNDS = 3
+
+_token_encoder = None
+
+
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens in text, using tiktoken when it is
+    installed and roughly four characters per token otherwise.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        tokens (int): Estimated token count.
+    """
+    global _token_encoder
+    if _token_encoder is None:
+        try:
+            import tiktoken
+            _token_encoder = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _token_encoder = False
+    if _token_encoder:
+        return len(_token_encoder.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def split_into_blocks(text):
+    """
+    Splits a section into blocks at article, email and heading boundaries
+    (a blank line followed by a bold title or a Markdown heading).
+
+    Args:
+        text (str): Section text as built by the compile_* functions.
+
+    Returns:
+        blocks (list): Non-empty blocks, in order.
+    """
+    return [block for block in re.split(r"\n\n+(?=\*\*|#)", text) if block.strip()]
+
+
+def truncate_block(block, token_limit=ARTICLE_TOKEN_LIMIT):
+    """
+    Shortens a block to about token_limit tokens by trimming its longest
+    lines, so titles and links survive and only long snippets are cut.
+
+    Args:
+        block (str): An article or email block.
+        token_limit (int): Maximum tokens to keep.
+
+    Returns:
+        block (str): The block, truncated if needed.
+    """
+    excess = estimate_tokens(block) - token_limit
+    if excess <= 0:
+        return block
+    lines = block.split("\n")
+    for position in sorted(range(len(lines)), key=lambda i: len(lines[i]), reverse=True):
+        if excess <= 0:
+            break
+        line = lines[position]
+        keep = max(0, len(line) - excess * 4)
+        lines[position] = line[:keep].rstrip() + "..."
+        excess -= (len(line) - keep) // 4
+    return "\n".join(lines)
+
+
+def pack_blocks(blocks, token_budget):
+    """
+    Greedily packs consecutive blocks into chunks of at most token_budget
+    tokens. A single block larger than the budget gets a chunk of its own.
+
+    Args:
+        blocks (list): Text blocks, in order.
+        token_budget (int): Maximum tokens per chunk.
+
+    Returns:
+        chunks (list): Chunk strings, in order.
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    for block in blocks:
+        tokens = estimate_tokens(block)
+        if current and current_tokens + tokens > token_budget:
+            chunks.append("\n\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(block)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def chunk_text(text, token_budget):
+    """
+    Splits text into blocks, truncates each to ARTICLE_TOKEN_LIMIT and packs
+    them into chunks within token_budget.
+    """
+    blocks = [truncate_block(block) for block in split_into_blocks(text)]
+    return pack_blocks(blocks, token_budget)
+
+
+@traced
+def map_reduce_completion(text, map_prompt, reduce_prompt=None, token_budget=SUMMARY_TOKEN_BUDGET,
+                          stream=False, deadline=None, on_delta=None):
+    """
+    Runs a completion over text that may be too large for one prompt.
+
+    The text is split into blocks, each block truncated to ARTICLE_TOKEN_LIMIT,
+    and the blocks packed into chunks within token_budget. A single chunk is
+    sent as one prompt. Otherwise every chunk is completed concurrently (map)
+    and the partial results are combined (reduce).
+
+    Args:
+        text (str): The input text.
+        map_prompt (callable): map_prompt(chunk, part, parts) -> prompt. For a
+            single chunk it is called with part=1, parts=1.
+        reduce_prompt (callable): reduce_prompt(partials_text) -> prompt. If
+            None, the partial results are simply joined with newlines.
+        token_budget (int): Maximum input tokens per prompt.
+        stream (bool): Stream each completion (see chat_completion).
+        deadline (float): Optional time.monotonic() value shared by all calls.
+        on_delta (callable): Receives the final output as it arrives.
+
+    Returns:
+        content (str): The completion text, or an empty string on error.
+    """
+    chunks = chunk_text(text, token_budget)
+    if len(chunks) <= 1:
+        return chat_completion(map_prompt(chunks[0] if chunks else "", 1, 1),
+                               stream=stream, deadline=deadline, on_delta=on_delta)
+
+    def complete_all(prompts):
+        futures = [submit_with_context(executor, chat_completion, prompt, stream=stream, deadline=deadline)
+                   for prompt in prompts]
+        return [partial for partial in (future.result() for future in futures) if partial]
+
+    print(f"Input of ~{estimate_tokens(text)} tokens split into {len(chunks)} chunks.")
+    with ThreadPoolExecutor(max_workers=SUMMARY_MAX_WORKERS) as executor:
+        partials = complete_all(map_prompt(chunk, part + 1, len(chunks)) for part, chunk in enumerate(chunks))
+        if reduce_prompt is None:
+            content = "\n".join(partials)
+            if content and on_delta:
+                on_delta(content)
+            return content
+
+        # Reduce in rounds until the partial results fit in a single prompt.
+        for _ in range(REDUCE_MAX_ROUNDS):
+            groups = pack_blocks(partials, token_budget)
+            if len(groups) <= 1:
+                break
+            partials = complete_all(reduce_prompt(group) for group in groups)
+    if not partials:
+        return ""
+    return chat_completion(reduce_prompt("\n\n".join(partials)),
+                           stream=stream, deadline=deadline, on_delta=on_delta)
+
+
+@traced
+def summarize_text(prompt_text, summary_prompt, token_budget=SUMMARY_TOKEN_BUDGET, stream=None,
+                   deadline=None, on_delta=None):
+    """
+    Uses OpenAI's API to summarize the given text. Text over token_budget is
+    summarized in chunks whose partial summaries are then combined.
+
+    Args:
+        prompt_text (str): The text to summarize.
+        summary_prompt (str): Instructions to the AI for how to summarize.
+        token_budget (int): Maximum input tokens per prompt.
+        stream (bool): Stream the summary; defaults to LLM_STREAM.
+        deadline (float): Seconds allowed for the whole summary; defaults to
+            SUMMARY_DEADLINE (0 for none). A streamed summary keeps whatever
+            text arrived before the deadline.
+        on_delta (callable): Called with each new piece of the summary.
+
+    Returns:
+        summary (str): The summary generated by OpenAI.
+    """
+    if stream is None:
+        stream = LLM_STREAM
+    if deadline is None:
+        deadline = SUMMARY_DEADLINE
+    deadline_at = time.monotonic() + deadline if deadline else None
+    map_prompt, reduce_prompt = summary_prompts(summary_prompt)
+    return map_reduce_completion(prompt_text, map_prompt, reduce_prompt, token_budget,
+                                 stream=stream, deadline=deadline_at, on_delta=on_delta)
+
+
+def summary_prompts(summary_prompt):
+    """
+    Returns the map and reduce prompt builders for summarizing with the given
+    instructions (see map_reduce_completion).
+    """
+    def map_prompt(chunk, part, parts):
+        if parts == 1:
+            return f"{summary_prompt}\n\n{chunk}\n\nSummary:"
+        return (
+            f"{summary_prompt}\n\nThis is part {part} of {parts} of the material; "
+            f"summarize only this part.\n\n{chunk}\n\nSummary:"
+        )
+
+    def reduce_prompt(partials_text):
+        return (
+            f"{summary_prompt}\n\nThe following are summaries of consecutive parts of the material. "
+            f"Combine them into a single summary.\n\n{partials_text}\n\nSummary:"
+        )
+
+    return map_prompt, reduce_prompt
+
+
+# -------------------------
+# Structured Briefs
+# -------------------------
+# With LLM_STRUCTURED=1 each summarized section (the emails, read together
+# with the calendar, and each news section) is sent in one completion with a
+# JSON schema, whose reply holds the section's summary, its part of the
+# Telegram digest and its tasks. The Telegram message and the Todoist tasks
+# are then put together from those replies, instead of two more completions
+# over the whole briefing.
+LLM_STRUCTURED = os.getenv("LLM_STRUCTURED", "0") == "1"
+BRIEF_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "digest": {"type": "string"},
+        "tasks": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["summary", "digest", "tasks"],
+    "additionalProperties": False,
+}
+BRIEF_INSTRUCTIONS = (
+    'Reply in JSON. "summary" is the summary described above. "digest" is two or three short sentences '
+    'for a quick Telegram update. "tasks" lists actionable todo tasks that can be completed today, one '
+    "task per item, or nothing if there are none."
+)
+
+
+def brief_name(summary_name):
+    """
+    Returns the name of the stage producing a summary's brief.
+    """
+    return f"{summary_name}_brief"
+
+
+def brief_request(summary_prompt, text, context=""):
+    """
+    Returns the prompt and request parameters of a structured brief.
+
+    Args:
+        summary_prompt (str): Instructions for the summary.
+        text (str): The material to summarize.
+        context (str): More material for the digest and tasks only, e.g.
+            the calendar next to the emails.
+    """
+    prompt = f"{summary_prompt}\n\n{BRIEF_INSTRUCTIONS}\n\n{text}"
+    if context:
+        prompt += f"\n\nUse the following for the digest and tasks, but not the summary:\n\n{context}"
+    params = {"response_format": {"type": "json_schema",
+                                  "json_schema": {"name": "section_brief", "strict": True, "schema": BRIEF_SCHEMA}}}
+    return prompt, params
+
+
+def parse_brief(content):
+    """
+    Parses a structured brief reply.
+
+    Returns:
+        brief (dict): "summary" and "digest" strings, a "tasks" list and
+        "structured" (True), or None if content isn't a brief.
+    """
+    try:
+        data = json.loads(content) if content else None
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or not isinstance(data.get("summary"), str):
+        return None
+    tasks = data.get("tasks") if isinstance(data.get("tasks"), list) else []
+    return {
+        "summary": data["summary"].strip(),
+        "digest": str(data.get("digest") or "").strip(),
+        "tasks": parse_tasks("\n".join(str(task) for task in tasks)),
+        "structured": True,
+    }
+
+
+def text_brief(summary):
+    """
+    Returns the brief of a section summarized as plain text, which has no
+    digest or tasks of its own.
+    """
+    return {"summary": summary, "digest": "", "tasks": [], "structured": False}
+
+
+def _brief_deadline():
+    return time.monotonic() + SUMMARY_DEADLINE if SUMMARY_DEADLINE else None
+
+
+@traced
+def summarize_brief(text, summary_prompt, context="", token_budget=SUMMARY_TOKEN_BUDGET):
+    """
+    Summarizes a section with one structured completion (see brief_request).
+    Text over token_budget is first condensed into partial summaries. If the
+    reply isn't a valid brief, the section is summarized as plain text
+    instead, without a digest or tasks.
+
+    Returns:
+        brief (dict): See parse_brief.
+    """
+    deadline = _brief_deadline()
+    if len(chunk_text(text, token_budget)) > 1:
+        map_prompt, _ = summary_prompts(summary_prompt)
+        text = map_reduce_completion(text, map_prompt, token_budget=token_budget, deadline=deadline)
+    prompt, params = brief_request(summary_prompt, text, context)
+    brief = parse_brief(chat_completion(prompt, deadline=deadline, **params))
+    if brief is None:
+        print("No structured summary; summarizing as text.")
+        return text_brief(summarize_text(text, summary_prompt, token_budget))
+    return brief
+
+
+def brief_digest(briefs):
+    """
+    Joins the digests of the briefs for Telegram, or returns "" if any
+    brief is missing, was summarized as text or has no digest.
+    """
+    digests = [brief.get("digest") if brief and brief.get("structured") else "" for brief in briefs]
+    return "\n\n".join(digests) if all(digests) else ""
+
+
+def brief_tasks(briefs):
+    """
+    Returns the tasks of the briefs without repeats, or None if any brief is
+    missing or was summarized as text, so the tasks are asked for separately.
+    """
+    if not all(brief and brief.get("structured") for brief in briefs):
+        return None
+    return list(dict.fromkeys(task for brief in briefs for task in brief["tasks"]))
+
+
+# -------------------------
+# Telegram Integration Function
+# -------------------------
+TELEGRAM_SUMMARY_PROMPT = "Summarize the following content for a quick Telegram update:"
+
+
+def summarise_for_telegram(text, google_doc_url):
+    """
+    Uses OpenAI to summarize the provided text, appends a link for more details,
+    and posts the final message to a Telegram bot.
+
+    Args:
+        text (str): The text to summarize.
+        google_doc_url (str): The URL of the Google Doc to be shared.
+    """
+    # Create a summary using OpenAI.
+    summary = summarize_text(text, TELEGRAM_SUMMARY_PROMPT)
+    if not summary:
+        return ""
+    post_telegram_summary(summary, google_doc_url)
+
+
+# Chats are taken from TELEGRAM_CHAT_ID (a comma-separated list, or a list in
+# a profile). Without it, the chat of the latest message sent to the bot is
+# looked up once with getUpdates and kept in TELEGRAM_STATE_FILE along with
+# the update offset, so sending a message takes a single request. With
+# TELEGRAM_LISTEN=1 the daemon long-polls getUpdates to keep it current.
+TELEGRAM_API_URL = "https://api.telegram.org/bot{token}/{method}"
+TELEGRAM_MAX_MESSAGE = 4096  # Characters (UTF-16 code units) per message.
+TELEGRAM_STATE_FILE = "telegram.json"
+TELEGRAM_LISTEN = os.getenv("TELEGRAM_LISTEN", "0") == "1"
+TELEGRAM_POLL_TIMEOUT = 50  # Seconds a getUpdates long poll is held open.
+TELEGRAM_MAX_WORKERS = 8
+
+_telegram_lock = threading.Lock()
+
+
+def telegram_url(token, method):
+    """
+    Returns the URL of a Bot API method.
+    """
+    return TELEGRAM_API_URL.format(token=token, method=method)
+
+
+def configured_chat_ids():
+    """
+    Returns the chats named by TELEGRAM_CHAT_ID (of the active profile, if
+    any), which may be a single ID, a comma-separated list or, in a profile,
+    a list.
+    """
+    chat_ids = profile_setting("TELEGRAM_CHAT_ID")
+    if chat_ids is None:
+        return []
+    if isinstance(chat_ids, str):
+        chat_ids = chat_ids.split(",")
+    elif not isinstance(chat_ids, list):
+        chat_ids = [chat_ids]
+    return [str(chat_id).strip() for chat_id in chat_ids if str(chat_id).strip()]
+
+
+def telegram_state(token):
+    """
+    Returns the stored chat and update offset for the bot, or an empty state
+    if they were stored for another bot.
+    """
+    bot_id = token.split(":", 1)[0]
+    state = load_state(TELEGRAM_STATE_FILE, {})
+    if state.get("bot_id") != bot_id:
+        state = {"bot_id": bot_id}
+    return state
+
+
+def record_telegram_updates(token, updates):
+    """
+    Stores the chat of the latest message in a getUpdates response and the
+    offset that acknowledges the updates it returned.
+
+    Args:
+        token (str): The bot token.
+        updates (dict): The decoded getUpdates response.
+
+    Returns:
+        chat_id: The stored chat, or None if there is none.
+    """
+    chat_id = latest_chat_id(updates)
+    with _telegram_lock:
+        state = telegram_state(token)
+        if updates.get("result"):
+            state["offset"] = updates["result"][-1]["update_id"] + 1
+        if chat_id is not None:
+            state["chat_id"] = chat_id
+        save_state(TELEGRAM_STATE_FILE, state)
+    return state.get("chat_id")
+
+
+def forget_telegram_chat(token, chat_id):
+    """
+    Drops a stored chat that can no longer be messaged, so the next run looks
+    it up again.
+    """
+    with _telegram_lock:
+        state = telegram_state(token)
+        if str(state.get("chat_id")) == str(chat_id):
+            del state["chat_id"]
+            save_state(TELEGRAM_STATE_FILE, state)
+
+
+def updates_params(token, timeout=0):
+    """
+    Returns the getUpdates query for the updates not yet acknowledged.
+    """
+    params = {"timeout": timeout, "allowed_updates": '["message"]'}
+    offset = telegram_state(token).get("offset")
+    if offset is not None:
+        params["offset"] = offset
+    return params
+
+
+def resolve_telegram_chats(token):
+    """
+    Returns the chats to message: TELEGRAM_CHAT_ID, else the stored chat,
+    else the chat of the latest message to the bot (looked up and stored).
+    Profiles must name their chats.
+
+    Args:
+        token (str): The bot token.
+
+    Returns:
+        chat_ids (list): The chats; empty if there are none.
+    """
+    chat_ids = configured_chat_ids()
+    if chat_ids or _current_profile.get() is not None:
+        return chat_ids
+    chat_id = telegram_state(token).get("chat_id")
+    if chat_id is None:
+        try:
+            r = http_request("GET", telegram_url(token, "getUpdates"), params=updates_params(token))
+            if r.status_code == 200:
+                chat_id = record_telegram_updates(token, r.json())
+            else:
+                print("Error getting updates. Status code:", r.status_code)
+        except requests.exceptions.RequestException as e:
+            print("Error getting updates:", e)
+    return [chat_id] if chat_id is not None else []
+
+
+def split_telegram_message(text, limit=TELEGRAM_MAX_MESSAGE):
+    """
+    Splits text into messages Telegram accepts, breaking at the last
+    paragraph, line or word boundary that fits.
+
+    Args:
+        text (str): The message text.
+        limit (int): Maximum length of a part in UTF-16 code units.
+
+    Returns:
+        parts (list): The parts, in order.
+    """
+    parts = []
+    while utf16_len(text) > limit:
+        # Longest prefix within the limit; characters outside the BMP count twice.
+        end = min(len(text), limit)
+        while utf16_len(text[:end]) > limit:
+            end -= (utf16_len(text[:end]) - limit + 1) // 2
+        window = text[:end]
+        cuts = (window.rfind(sep, end // 2) for sep in ("\n\n", "\n", " "))
+        cut = next((cut for cut in cuts if cut > 0), end)
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text.strip() or not parts:
+        parts.append(text)
+    return parts
+
+
+def send_telegram_message(token, chat_id, text):
+    """
+    Sends text to a chat, in as many messages as it needs.
+
+    Args:
+        token (str): The bot token.
+        chat_id: The chat.
+        text (str): The message text.
+
+    Returns:
+        sent (bool): Whether every part was delivered.
+    """
+    for part in split_telegram_message(text):
+        try:
+            r = http_request("POST", telegram_url(token, "sendMessage"), data={"chat_id": chat_id, "text": part})
+        except Exception as e:
+            print("Error posting to Telegram:", e)
+            return False
+        if r.status_code != 200:
+            print("Failed to post message to Telegram. Response:", r.text)
+            if r.status_code in (400, 403):  # Chat not found, or the bot was blocked.
+                forget_telegram_chat(token, chat_id)
+            return False
+    return True
+
+
+@traced
+def post_telegram_summary(summary, google_doc_url):
+    """
+    Posts a prepared summary to the bot's chats, with a link to the Google
+    Doc when there is one. Chats are messaged concurrently.
+
+    Args:
+        summary (str): The message text.
+        google_doc_url (str): The URL of the Google Doc, or None.
+    """
+    token = profile_setting("TELEGRAM_BOT_TOKEN")
+    chat_ids = resolve_telegram_chats(token) if token else []
+    if not token or not chat_ids:
+        print("Telegram credentials not set in .env." if not token else
+              "No Telegram chat: set TELEGRAM_CHAT_ID or send the bot a message.")
+        return
+
+    message = telegram_message(summary, google_doc_url)
+    with ThreadPoolExecutor(max_workers=min(len(chat_ids), TELEGRAM_MAX_WORKERS)) as executor:
+        futures = [submit_with_context(executor, send_telegram_message, token, chat_id, message)
+                   for chat_id in chat_ids]
+        sent = [future.result() for future in futures]
+    if all(sent):
+        print("Message posted to Telegram successfully.")
+    elif any(sent):
+        print(f"Message posted to {sum(sent)} of {len(sent)} Telegram chats.")
+
+
+def listen_for_telegram_chats(token, stop, timeout=TELEGRAM_POLL_TIMEOUT):
+    """
+    Long-polls getUpdates until stop is set, storing the latest chat and the
+    offset after each batch of updates.
+
+    Args:
+        token (str): The bot token.
+        stop (threading.Event): Ends the loop (after the poll in progress).
+        timeout (int): Seconds each poll is held open.
+    """
+    failures = 0
+    while not stop.is_set():
+        try:
+            # Sent directly rather than through http_request: a poll that mostly
+            # waits is neither worth a trace nor subject to the host's rate limit.
+            url = telegram_url(token, "getUpdates")
+            r = get_session(url).get(url, params=updates_params(token, timeout), timeout=timeout + HTTP_TIMEOUT)
+            if r.status_code == 409:  # A webhook is set, or another process is polling.
+                print("Stopped listening for Telegram chats:", r.json().get("description"))
+                return
+            r.raise_for_status()
+            record_telegram_updates(token, r.json())
+            failures = 0
+        except Exception as e:
+            print("Error getting updates:", e)
+            failures += 1
+            stop.wait(backoff_delay(min(failures, 6)))
+
+
+def start_telegram_listener(stop):
+    """
+    Starts listen_for_telegram_chats in a background thread when
+    TELEGRAM_LISTEN is set and no chat is configured.
+
+    Returns:
+        thread (threading.Thread): The listener, or None.
+    """
+    token = profile_setting("TELEGRAM_BOT_TOKEN")
+    if not TELEGRAM_LISTEN or not token or configured_chat_ids() or _current_profile.get() is not None:
+        return None
+    thread = threading.Thread(target=listen_for_telegram_chats, args=(token, stop), name="telegram", daemon=True)
+    thread.start()
+    print("Listening for Telegram chats.")
+    return thread
+
+
+def latest_chat_id(updates):
+    """
+    Returns the chat of the most recent message in a getUpdates response.
+
+    Args:
+        updates (dict): The decoded getUpdates response.
+
+    Returns:
+        chat_id (int): The chat ID, or None if there is no message.
+    """
+    if not updates['ok']:
+        print("Error getting updates:", updates['description'])
+        return None
+    # Find the latest message from the user
+    for update in reversed(updates['result']):  # Reverse to get the latest first
+        if 'message' in update and 'chat' in update['message']:
+            chat_id = update['message']['chat']['id']
+            print(f"Chat ID: {chat_id}")
+            return chat_id
+    return None
+
+
+def telegram_message(summary, google_doc_url):
+    """
+    Appends the link to the Google Doc, when there is one, to a summary.
+    """
+    message = summary
+    if google_doc_url:
+        message += f"\n\nFor more details see {google_doc_url}"
+    return message
+
+
+# -------------------------
+# Todoist Integration Function
+# -------------------------
+# Tasks are created in bulk through the Sync API unless TODOIST_BULK=0.
+TODOIST_SYNC_URL = "https://api.todoist.com/sync/v9/sync"
+TODOIST_BULK = os.getenv("TODOIST_BULK", "1") != "0"
+TODOIST_SYNC_BATCH = 100  # The Sync API accepts at most 100 commands per request.
+TODOIST_STATE_FILE = "todoist_created.json"
+
+
+@traced
+def create_todo_list(text):
+    """
+    Uses OpenAI to generate actionable todo tasks from the provided text and then
+    creates them in Todoist via their API with the due date set to today.
+
+    Args:
+        text (str): The text from which to generate todo tasks.
+    """
+    lines = map_reduce_completion(text, task_prompt)
+    if not lines:
+        return ""
+    create_tasks(parse_tasks(lines))
+
+
+def create_tasks(tasks):
+    """
+    Creates tasks in Todoist, due today, skipping those already created
+    today.
+
+    Args:
+        tasks (list): Task texts.
+    """
+    if not tasks:
+        print("No valid tasks found.")
+        return
+
+    # Get Todoist API key from environment.
+    TODOIST_API_KEY = profile_setting("TODOIST_API_KEY")
+    if not TODOIST_API_KEY:
+        print("TODOIST_API_KEY not set in .env.")
+        return
+
+    today_str = datetime.date.today().isoformat()  # e.g. "2025-02-05"
+    created_today, new_tasks = tasks_to_create(tasks, today_str)
+    if not new_tasks:
+        return
+
+    if TODOIST_BULK:
+        created = create_todoist_tasks_bulk(new_tasks, TODOIST_API_KEY, today_str)
+    else:
+        created = create_todoist_tasks_rest(new_tasks, TODOIST_API_KEY, today_str)
+    record_created_tasks(today_str, created_today, created)
+
+
+def task_prompt(chunk, part, parts):
+    """
+    Builds the task extraction prompt for one chunk of text. Large texts are
+    handled in chunks and the task lists of the chunks concatenated.
+    """
+    return (
+        "Extract actionable todo tasks from the following text. "
+        "List each task on a new line. Only include tasks that can be completed today.\n\n"
+        f"{chunk}\n\nTasks:"
+    )
+
+
+def parse_tasks(lines):
+    """
+    Parses tasks by splitting on newlines, dropping repeats across chunks.
+    """
+    tasks = [line.strip("- ").strip() for line in lines.splitlines() if line.strip()]
+    return list(dict.fromkeys(tasks))
+
+
+def tasks_to_create(tasks, day):
+    """
+    Skips tasks already created on the given day, e.g. by an earlier run.
+
+    Returns:
+        created_today (set): Hashes of the tasks already created that day.
+        new_tasks (list): The tasks still to create.
+    """
+    created_today = load_created_task_hashes(day)
+    new_tasks = []
+    for task in tasks:
+        if task_content_hash(task) in created_today:
+            print(f"Skipping task already created today: {task}")
+        else:
+            new_tasks.append(task)
+    return created_today, new_tasks
+
+
+def record_created_tasks(day, created_today, created):
+    """
+    Adds newly created tasks to the day's stored hashes.
+    """
+    if created:
+        created_today.update(task_content_hash(task) for task in created)
+        save_created_task_hashes(day, created_today)
+
+
+def task_content_hash(task):
+    """
+    Returns a short hash identifying a task by its normalised content.
+    """
+    normalised = " ".join(task.lower().split())
+    return hashlib.sha256(normalised.encode("utf-8")).hexdigest()[:16]
+
+
+def load_created_task_hashes(day):
+    """
+    Returns the content hashes of the tasks created on the given day.
+
+    Args:
+        day (str): ISO date, e.g. "2025-02-05".
+
+    Returns:
+        hashes (set): Task content hashes; empty for any other day.
+    """
+    state = load_state(TODOIST_STATE_FILE, {})
+    if state.get("date") != day:
+        return set()
+    return set(state.get("hashes", []))
+
+
+def save_created_task_hashes(day, hashes):
+    """
+    Stores the content hashes of the tasks created on the given day,
+    replacing those of any earlier day.
+    """
+    save_state(TODOIST_STATE_FILE, {"date": day, "hashes": sorted(hashes)})
+
+
+@traced
+def create_todoist_tasks_bulk(tasks, api_key, due_date):
+    """
+    Creates tasks with Todoist's Sync API, sending up to TODOIST_SYNC_BATCH
+    item_add commands per request.
+
+    Each command carries its own UUID, so a retried request is not applied
+    twice, and its result is read from the response's sync_status.
+
+    Args:
+        tasks (list): Task contents.
+        api_key (str): Todoist API token.
+        due_date (str): ISO due date for every task.
+
+    Returns:
+        created (list): The tasks that Todoist accepted.
+    """
+    headers = todoist_headers(api_key)
+    created = []
+    for start in range(0, len(tasks), TODOIST_SYNC_BATCH):
+        batch = tasks[start:start + TODOIST_SYNC_BATCH]
+        commands = todoist_commands(batch, due_date)
+        try:
+            r = http_request("POST", TODOIST_SYNC_URL, headers=headers, json={"commands": commands})
+            if r.status_code != 200:
+                print(f"Failed to create {len(batch)} tasks: {r.text}")
+                continue
+            sync_status = r.json().get("sync_status", {})
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error creating {len(batch)} tasks: {e}")
+            continue
+        created.extend(accepted_tasks(batch, commands, sync_status))
+    return created
+
+
+def todoist_headers(api_key):
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+def todoist_commands(tasks, due_date):
+    """
+    Returns an item_add Sync API command for each task.
+    """
+    return [
+        {
+            "type": "item_add",
+            "temp_id": str(uuid.uuid4()),
+            "uuid": str(uuid.uuid4()),
+            "args": {"content": task, "due": {"date": due_date}},
+        }
+        for task in tasks
+    ]
+
+
+def accepted_tasks(tasks, commands, sync_status):
+    """
+    Returns the tasks whose commands the Sync API reports as "ok".
+    """
+    accepted = []
+    for task, command in zip(tasks, commands):
+        status = sync_status.get(command["uuid"])
+        if status == "ok":
+            accepted.append(task)
+            print(f"Task created: {task}")
+        else:
+            print(f"Failed to create task '{task}': {status}")
+    return accepted
+
+
+@traced
+def create_todoist_tasks_rest(tasks, api_key, due_date):
+    """
+    Creates tasks one request at a time with Todoist's REST API.
+
+    Args:
+        tasks (list): Task contents.
+        api_key (str): Todoist API token.
+        due_date (str): ISO due date for every task.
+
+    Returns:
+        created (list): The tasks that Todoist accepted.
+    """
+    todoist_url = "https://api.todoist.com/rest/v2/tasks"
+    headers = todoist_headers(api_key)
+
+    created = []
+    for task in tasks:
+        data = {
+            "content": task,
+            "due_string": "today",
+            "due_date": due_date
+        }
+        # A unique request ID lets Todoist ignore the duplicate if this is retried.
+        task_headers = dict(headers)
+        task_headers["X-Request-Id"] = str(uuid.uuid4())
+        try:
+            r = http_request("POST", todoist_url, headers=task_headers, json=data)
+            if r.status_code in [200, 204]:
+                created.append(task)
+                print(f"Task created: {task}")
+            else:
+                print(f"Failed to create task '{task}': {r.text}")
+        except Exception as e:
+            print(f"Error creating task '{task}': {e}")
+    return created
+
+
+# -------------------------
+# Pipeline Orchestration
+# -------------------------
+PIPELINE_MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", "6"))
+
+# A pipeline stage. func is called with the results of the stages named in
+# deps as keyword arguments; if it raises, fallback is used as its result so
+# that dependent stages still run with a degraded section.
+Stage = namedtuple("Stage", ["name", "deps", "func", "fallback"])
+
+
+def _run_stage(stage, kwargs, run_start):
+    """
+    Runs one stage, catching any error, and times it relative to run_start.
+    """
+    start = time.perf_counter()
+    status = "ok"
+    with span(f"stage {stage.name}", stage=stage.name) as record:
+        try:
+            value = stage.func(**kwargs)
+        except Exception as e:
+            print(f"Stage '{stage.name}' failed: {e}")
+            value = stage.fallback
+            status = record["status"] = "failed"
+    end = time.perf_counter()
+    timing = {
+        "start": start - run_start,
+        "end": end - run_start,
+        "seconds": end - start,
+        "status": status,
+        "span_id": record["span_id"],
+    }
+    return value, timing
+
+
+def _check_stages(stages):
+    """
+    Checks that stage names are unique and every dependency exists.
+
+    Returns:
+        pending (dict): Stage name -> stage.
+    """
+    pending = {}
+    for stage in stages:
+        if stage.name in pending:
+            raise ValueError(f"Duplicate stage name: {stage.name}")
+        pending[stage.name] = stage
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in pending]
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {missing}")
+    return pending
+
+
+def run_stages(stages, max_workers=PIPELINE_MAX_WORKERS, executor=None):
+    """
+    Runs a graph of stages, starting each one as soon as all of its
+    dependencies have finished, so independent stages run concurrently.
+
+    Args:
+        stages (list): Stage tuples. Names must be unique and every dependency
+            must name another stage.
+        max_workers (int): Maximum number of stages running at once.
+        executor (ThreadPoolExecutor): Runs the stages instead of a new pool
+            of max_workers threads, e.g. one kept by the daemon so that its
+            threads' Google services stay connected between runs.
+
+    Returns:
+        results (dict): Stage name -> result (or fallback for failed stages).
+        timings (dict): Stage name -> {"start", "end", "seconds", "status"},
+        with start/end in seconds since the run began.
+    """
+    pending = _check_stages(stages)
+    results = {}
+    timings = {}
+    run_start = time.perf_counter()
+    with contextlib.nullcontext(executor) if executor else ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if all(dep in results for dep in stage.deps):
+                    del pending[name]
+                    kwargs = {dep: results[dep] for dep in stage.deps}
+                    # Each stage sees the caller's context, e.g. the active profile.
+                    running[submit_with_context(executor, _run_stage, stage, kwargs, run_start)] = stage
+            if not running:
+                raise ValueError(f"Dependency cycle between stages: {sorted(pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                results[stage.name], timings[stage.name] = future.result()
+    return results, timings
+
+
+def print_stage_timings(timings):
+    """
+    Prints a table of stage timings in the order the stages started.
+
+    Args:
+        timings (dict): Timings as returned by run_stages.
+    """
+    if not timings:
+        return
+    wall = max(timing["end"] for timing in timings.values())
+    print(f"\nStage timings (wall clock {wall:.2f}s):")
+    for name, timing in sorted(timings.items(), key=lambda item: item[1]["start"]):
+        print(f"  {name:<22} {timing['start']:7.2f}s -> {timing['end']:7.2f}s "
+              f"{timing['seconds']:7.2f}s  {timing['status']}")
+
+
+# -------------------------
+# Async Runtime
+# -------------------------
+# An asyncio variant of the integrations, so that many briefings can share one
+# process and event loop. It needs the optional httpx package. Google's client
+# library is blocking, so its calls are offloaded to worker threads.
+GOOGLE_UPSTREAM = "googleapis.com"
+ASYNC_GOOGLE_LIMIT = int(os.getenv("ASYNC_GOOGLE_LIMIT", "4"))
+
+# Requests allowed in flight per upstream host; other hosts (news sites) get
+# SCRAPE_PER_HOST.
+ASYNC_HOST_LIMITS = {
+    "api.openai.com": int(os.getenv("ASYNC_OPENAI_LIMIT", "8")),
+    "newsapi.org": 4,
+    "api.telegram.org": 4,
+    "api.todoist.com": 2,
+    GOOGLE_UPSTREAM: ASYNC_GOOGLE_LIMIT,
+}
+
+# Per event loop: {"client": httpx.AsyncClient, "semaphores": {host: Semaphore}}.
+_async_states = weakref.WeakKeyDictionary()
+
+
+def _httpx():
+    """
+    Imports httpx on first use, so the synchronous runtime doesn't need it.
+    """
+    try:
+        import httpx
+    except ImportError:
+        raise RuntimeError("The async runtime needs httpx: pip install httpx") from None
+    return httpx
+
+
+def _async_state():
+    """
+    Returns the shared client and semaphores of the running event loop,
+    creating them on first use.
+    """
+    loop = asyncio.get_running_loop()
+    state = _async_states.get(loop)
+    if state is None:
+        httpx = _httpx()
+        transport = httpx.AsyncHTTPTransport(
+            retries=HTTP_RETRIES,  # Connection failures only; statuses are retried below.
+            limits=httpx.Limits(max_keepalive_connections=HTTP_POOL_SIZE),
+        )
+        if TRANSPORT_HOOKS["httpx"] is not None:
+            transport = TRANSPORT_HOOKS["httpx"](transport)
+        client = httpx.AsyncClient(headers={"User-Agent": USER_AGENT}, transport=transport,
+                                   follow_redirects=True)
+        state = _async_states[loop] = {"client": client, "semaphores": {}}
+    return state
+
+
+def _async_semaphore(host):
+    """
+    Returns the semaphore limiting concurrent requests to the given upstream.
+    """
+    semaphores = _async_state()["semaphores"]
+    semaphore = semaphores.get(host)
+    if semaphore is None:
+        semaphore = semaphores[host] = asyncio.Semaphore(ASYNC_HOST_LIMITS.get(host, SCRAPE_PER_HOST))
+    return semaphore
+
+
+def _async_timeout(host, timeout):
+    """
+    Converts a requests-style timeout (seconds, a (connect, read) tuple, or
+    None for the host default) to an httpx.Timeout.
+    """
+    httpx = _httpx()
+    if timeout is None:
+        return httpx.Timeout(HOST_TIMEOUTS.get(host, HTTP_TIMEOUT))
+    if isinstance(timeout, tuple):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+async def async_http_request(method, url, timeout=None, **kwargs):
+    """
+    Sends a request through the event loop's shared client. Requests to the
+    same host are limited by ASYNC_HOST_LIMITS and paced by its rate limits,
+    and 429/5xx responses are retried like http_request does.
+
+    Args:
+        method (str): HTTP method, e.g. "GET" or "POST".
+        url (str): The URL to call.
+        timeout: Seconds, a (connect, read) tuple, or None for the host default.
+        **kwargs: Passed through to httpx.AsyncClient.request.
+
+    Returns:
+        response (httpx.Response): The response, with its body read.
+    """
+    host = urlparse(url).netloc.lower()
+    client = _async_state()["client"]
+    retries = HTTP_RETRIES if method.upper() != "POST" or host in RETRY_POST_HOSTS else 0
+    with span(f"http {method}", host=host) as record:
+        waited = 0.0
+        for attempt in range(HTTP_RETRIES + 1):
+            waited += await async_wait_for_rate_limit(host, request_costs(host, kwargs))
+            async with _async_semaphore(host):
+                response = await client.request(method, url, timeout=_async_timeout(host, timeout), **kwargs)
+            observe_rate_limits(host, response.headers)
+            status = response.status_code
+            retry = status == 429 or (status in RETRY_STATUSES and attempt < retries)
+            if not retry or attempt == HTTP_RETRIES:
+                record["attrs"].update(status=status, retries=attempt, rate_limit_wait=round(waited, 6),
+                                       bytes_out=len(response.request.content), bytes_in=len(response.content))
+                return response
+            if status == 429:
+                rate_limit_pause(host, retry_delay(response.headers, attempt))
+            else:
+                await asyncio.sleep(retry_delay(response.headers, attempt))
+
+
+@contextlib.asynccontextmanager
+async def async_http_stream(method, url, timeout=None, **kwargs):
+    """
+    Opens a streamed request through the event loop's shared client, holding
+    the host's semaphore until the response is closed.
+
+    Yields:
+        response (httpx.Response): The response, with its body unread.
+    """
+    host = urlparse(url).netloc.lower()
+    with span(f"http {method}", host=host, streamed=True) as record:
+        waited = await async_wait_for_rate_limit(host, request_costs(host, kwargs))
+        async with _async_semaphore(host):
+            async with _async_state()["client"].stream(method, url, timeout=_async_timeout(host, timeout),
+                                                       **kwargs) as response:
+                observe_rate_limits(host, response.headers)
+                try:
+                    yield response
+                finally:
+                    record["attrs"].update(status=response.status_code, retries=0,
+                                           rate_limit_wait=round(waited, 6),
+                                           bytes_out=len(response.request.content),
+                                           bytes_in=response.num_bytes_downloaded)
+
+
+async def async_google_call(func, *args, **kwargs):
+    """
+    Runs a blocking Google API call in a worker thread, at most
+    ASYNC_GOOGLE_LIMIT at a time. Service objects are not thread-safe, so func
+    should build its own (as the compile_* functions do).
+    """
+    async with _async_semaphore(GOOGLE_UPSTREAM):
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+
+async def close_async_clients():
+    """
+    Closes the running event loop's HTTP client. Safe to call more than once.
+    """
+    state = _async_states.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        await state["client"].aclose()
+
+
+@traced
+async def async_get_news(api_key, query=None, limit=3):
+    """
+    Async variant of get_news.
+    """
+    cache_key = json.dumps([query, limit])
+    cached = cache_get("news", cache_key, ttl=NEWS_CACHE_TTL)
+    if cached:
+        return cached["value"]
+    response = await async_http_request("GET", NEWSAPI_URL, params=news_params(api_key, query, limit))
+    return _store_news(cache_key, response)
+
+
+async def _read_article_text(response, extract, max_bytes=ARTICLE_MAX_BYTES, chunk_size=16384):
+    """
+    Runs an extraction engine over a streamed httpx response. The stream
+    engine is fed as the body arrives and stops the download once it has
+    enough text; the other engines get the whole body in a worker thread.
+    """
+    decoder = _body_decoder(response.headers.get("Content-Type", ""), response.charset_encoding)
+    parser = ParagraphExtractor(ARTICLE_MAX_CHARS) if extract is extract_paragraphs_stream else None
+    pieces = []
+    received = 0
+    async for chunk in response.aiter_bytes(chunk_size):
+        received += len(chunk)
+        text = decoder.decode(chunk)
+        if parser is None:
+            pieces.append(text)
+        else:
+            parser.feed(text)
+            if parser.done:
+                return parser.text()
+        if received >= max_bytes:
+            break
+    tail = decoder.decode(b"", final=True) if received < max_bytes else ""
+    if parser is None:
+        return await asyncio.to_thread(extract, pieces + [tail], ARTICLE_MAX_CHARS)
+    parser.feed(tail)
+    parser.close()
+    return parser.text()
+
+
+@traced
+async def async_fetch_article_snippet(url):
+    """
+    Async variant of fetch_article_snippet.
+    """
+    cached = cache_get("article", url)
+    if cached and time.time() - cached["stored_at"] < ARTICLE_CACHE_TTL:
+        return cached["value"]
+
+    extract = ARTICLE_EXTRACTORS.get(ARTICLE_EXTRACTOR, extract_paragraphs_stream)
+    try:
+        async with async_http_stream("GET", url, headers=revalidation_headers(cached), timeout=5) as response:
+            if response.status_code == 304 and cached:
+                cache_touch("article", url)
+                return cached["value"]
+            if response.status_code == 200:
+                snippet = await _read_article_text(response, extract)
+                cache_put("article", url, snippet,
+                          etag=response.headers.get("ETag"),
+                          last_modified=response.headers.get("Last-Modified"))
+                return snippet
+            print(f"Request to {url} returned status code: {response.status_code}")
+    except _httpx().HTTPError as e:
+        print(f"Error fetching snippet from {url}: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred while processing {url}: {e}")
+    return cached_article_snippet(url, cached)
+
+
+@traced
+async def async_fetch_article_snippets(urls, deadline=SCRAPE_DEADLINE):
+    """
+    Async variant of fetch_article_snippets. Articles still loading at the
+    deadline are cancelled rather than left running.
+    """
+    snippets = [""] * len(urls)
+    tasks = {}
+    for position, url in enumerate(urls):
+        if url:
+            tasks[asyncio.ensure_future(async_fetch_article_snippet(url))] = position
+    if not tasks:
+        return snippets
+    done, not_done = await asyncio.wait(tasks, timeout=deadline)
+    for task in not_done:
+        task.cancel()
+        print(f"Gave up on {urls[tasks[task]]} after the {deadline}s scraping deadline.")
+        snippets[tasks[task]] = cached_article_snippet(urls[tasks[task]])
+    if not_done:
+        await asyncio.gather(*not_done, return_exceptions=True)
+    for task in done:
+        try:
+            snippets[tasks[task]] = task.result()
+        except Exception as e:
+            print(f"An unexpected error occurred while scraping {urls[tasks[task]]}: {e}")
+    return snippets
+
+
+@traced
+async def async_compile_news_section(articles, section_title):
+    """
+    Async variant of compile_news_section.
+    """
+    urls = [article.get("url") or "" for article in articles]
+    return format_news_section(articles, await async_fetch_article_snippets(urls), section_title)
+
+
+async def _async_post_chat_completion(data, deadline=None):
+    """
+    Async variant of _post_chat_completion.
+    """
+    httpx = _httpx()
+    response = None
+    try:
+        response = await async_http_request("POST", OPENAI_URL, headers=_openai_headers(), json=data,
+                                            timeout=_remaining_timeout(deadline))
+        response.raise_for_status()
+        json_response = response.json()
+        record_llm_usage(json_response.get("usage"))
+        return json_response["choices"][0]["message"]["content"].strip()
+    except httpx.HTTPError as e:
+        print(f"Error calling OpenAI (httpx): {e}")
+        if response is not None and response.status_code != 200:
+            print(f"OpenAI API Error details: {response.text}")
+        return ""
+    except (KeyError, IndexError, ValueError) as e:
+        print(f"Error parsing OpenAI response: {e}")
+        return ""
+
+
+async def _async_stream_chat_completion(data, deadline=None, on_delta=None):
+    """
+    Async variant of _stream_chat_completion, recording the same
+    LLM_STREAM_METRICS as iter_chat_completion.
+
+    Returns:
+        content (str): The (possibly partial) message content.
+        complete (bool): False if the stream was cut short.
+    """
+    httpx = _httpx()
+    body = dict(data, stream=True, stream_options={"include_usage": True})
+    start = time.monotonic()
+    metrics = {"ttft": None, "seconds": None, "chars": 0, "complete": False}
+    parts = []
+
+    async def read():
+        async with async_http_stream("POST", OPENAI_URL, headers=_openai_headers(), json=body,
+                                     timeout=_remaining_timeout(deadline)) as response:
+            if response.status_code != 200:
+                await response.aread()
+                print(f"Error calling OpenAI (httpx): status {response.status_code}")
+                print(f"OpenAI API Error details: {response.text}")
+                return
+            async for line in response.aiter_lines():
+                finished, delta, usage = parse_sse_line(line)
+                record_llm_usage(usage)
+                if finished:
+                    metrics["complete"] = True
+                    return
+                if not delta:
+                    continue
+                if metrics["ttft"] is None:
+                    metrics["ttft"] = time.monotonic() - start
+                metrics["chars"] += len(delta)
+                if not parts:
+                    delta = delta.lstrip()
+                    if not delta:
+                        continue
+                parts.append(delta)
+                if on_delta:
+                    on_delta(delta)
+
+    try:
+        # A wall-clock deadline for the whole stream; httpx's read timeout
+        # restarts with every chunk.
+        await asyncio.wait_for(read(), None if deadline is None else max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        print("Summary deadline reached; keeping the partial output.")
+    except httpx.TimeoutException as e:
+        report_stream_timeout(deadline, e)
+    except httpx.HTTPError as e:
+        print(f"Error calling OpenAI (httpx): {e}")
+    except ValueError as e:  # Malformed event payload
+        print(f"Error parsing OpenAI stream: {e}")
+    finally:
+        metrics["seconds"] = time.monotonic() - start
+        with _llm_lock:
+            LLM_STREAM_METRICS.append(metrics)
+    return "".join(parts).strip(), metrics["complete"]
+
+
+@traced
+async def async_chat_completion(prompt, use_cache=True, stream=False, deadline=None, on_delta=None,
+                                **params):
+    """
+    Async variant of chat_completion. It shares the completion cache and the
+    in-flight coalescing with the synchronous runtime.
+    """
+    data = chat_request_body(prompt, **params)
+
+    async def request():
+        if stream:
+            return await _async_stream_chat_completion(data, deadline, on_delta)
+        content = await _async_post_chat_completion(data, deadline)
+        if content and on_delta:
+            on_delta(content)
+        return content, bool(content)
+
+    if not (use_cache and LLM_CACHE_ENABLED):
+        return (await request())[0]
+
+    key = completion_cache_key(data)
+    cached, future, owner = _claim_completion(key)
+    set_span_attrs(cache="miss" if owner else "hit" if cached is not None else "coalesced")
+    if not owner:
+        content = cached if cached is not None else await asyncio.wrap_future(future)
+        if content and on_delta:
+            on_delta(content)
+        return content
+
+    content = complete = None
+    try:
+        content, complete = await request()
+    finally:
+        _release_completion(key, future, content or "", complete)
+    return content
+
+
+@traced
+async def async_map_reduce_completion(text, map_prompt, reduce_prompt=None, token_budget=SUMMARY_TOKEN_BUDGET,
+                                      stream=False, deadline=None, on_delta=None):
+    """
+    Async variant of map_reduce_completion. Chunks are completed concurrently,
+    bounded by the OpenAI entry in ASYNC_HOST_LIMITS.
+    """
+    chunks = chunk_text(text, token_budget)
+    if len(chunks) <= 1:
+        return await async_chat_completion(map_prompt(chunks[0] if chunks else "", 1, 1),
+                                           stream=stream, deadline=deadline, on_delta=on_delta)
+
+    async def complete_all(prompts):
+        results = await asyncio.gather(*(async_chat_completion(prompt, stream=stream, deadline=deadline)
+                                         for prompt in prompts))
+        return [result for result in results if result]
+
+    print(f"Input of ~{estimate_tokens(text)} tokens split into {len(chunks)} chunks.")
+    partials = await complete_all(map_prompt(chunk, part + 1, len(chunks)) for part, chunk in enumerate(chunks))
+    if reduce_prompt is None:
+        content = "\n".join(partials)
+        if content and on_delta:
+            on_delta(content)
+        return content
+
+    # Reduce in rounds until the partial results fit in a single prompt.
+    for _ in range(REDUCE_MAX_ROUNDS):
+        groups = pack_blocks(partials, token_budget)
+        if len(groups) <= 1:
+            break
+        partials = await complete_all(reduce_prompt(group) for group in groups)
+    if not partials:
+        return ""
+    return await async_chat_completion(reduce_prompt("\n\n".join(partials)),
+                                       stream=stream, deadline=deadline, on_delta=on_delta)
+
+
+@traced
+async def async_summarize_text(prompt_text, summary_prompt, token_budget=SUMMARY_TOKEN_BUDGET, stream=None,
+                               deadline=None, on_delta=None):
+    """
+    Async variant of summarize_text.
+    """
+    if stream is None:
+        stream = LLM_STREAM
+    if deadline is None:
+        deadline = SUMMARY_DEADLINE
+    deadline_at = time.monotonic() + deadline if deadline else None
+    map_prompt, reduce_prompt = summary_prompts(summary_prompt)
+    return await async_map_reduce_completion(prompt_text, map_prompt, reduce_prompt, token_budget,
+                                             stream=stream, deadline=deadline_at, on_delta=on_delta)
+
+
+@traced
+async def async_summarize_brief(text, summary_prompt, context="", token_budget=SUMMARY_TOKEN_BUDGET):
+    """
+    Async variant of summarize_brief.
+    """
+    deadline = _brief_deadline()
+    if len(chunk_text(text, token_budget)) > 1:
+        map_prompt, _ = summary_prompts(summary_prompt)
+        text = await async_map_reduce_completion(text, map_prompt, token_budget=token_budget, deadline=deadline)
+    prompt, params = brief_request(summary_prompt, text, context)
+    brief = parse_brief(await async_chat_completion(prompt, deadline=deadline, **params))
+    if brief is None:
+        print("No structured summary; summarizing as text.")
+        return text_brief(await async_summarize_text(text, summary_prompt, token_budget))
+    return brief
+
+
+@traced
+async def async_resolve_telegram_chats(token):
+    """
+    Async variant of resolve_telegram_chats.
+    """
+    httpx = _httpx()
+    chat_ids = configured_chat_ids()
+    if chat_ids or _current_profile.get() is not None:
+        return chat_ids
+    chat_id = telegram_state(token).get("chat_id")
+    if chat_id is None:
+        try:
+            r = await async_http_request("GET", telegram_url(token, "getUpdates"), params=updates_params(token))
+            if r.status_code == 200:
+                chat_id = record_telegram_updates(token, r.json())
+            else:
+                print("Error getting updates. Status code:", r.status_code)
+        except httpx.HTTPError as e:
+            print("Error getting updates:", e)
+    return [chat_id] if chat_id is not None else []
+
+
+async def async_send_telegram_message(token, chat_id, text):
+    """
+    Async variant of send_telegram_message.
+    """
+    for part in split_telegram_message(text):
+        try:
+            r = await async_http_request("POST", telegram_url(token, "sendMessage"),
+                                         data={"chat_id": chat_id, "text": part})
+        except Exception as e:
+            print("Error posting to Telegram:", e)
+            return False
+        if r.status_code != 200:
+            print("Failed to post message to Telegram. Response:", r.text)
+            if r.status_code in (400, 403):
+                forget_telegram_chat(token, chat_id)
+            return False
+    return True
+
+
+async def async_post_telegram_summary(summary, google_doc_url):
+    """
+    Async variant of post_telegram_summary.
+    """
+    token = profile_setting("TELEGRAM_BOT_TOKEN")
+    chat_ids = await async_resolve_telegram_chats(token) if token else []
+    if not token or not chat_ids:
+        print("Telegram credentials not set in .env." if not token else
+              "No Telegram chat: set TELEGRAM_CHAT_ID or send the bot a message.")
+        return
+
+    message = telegram_message(summary, google_doc_url)
+    sent = await asyncio.gather(*(async_send_telegram_message(token, chat_id, message) for chat_id in chat_ids))
+    if all(sent):
+        print("Message posted to Telegram successfully.")
+    elif any(sent):
+        print(f"Message posted to {sum(sent)} of {len(sent)} Telegram chats.")
+
+
+async def async_summarise_for_telegram(text, google_doc_url):
+    """
+    Async variant of summarise_for_telegram.
+    """
+    summary = await async_summarize_text(text, TELEGRAM_SUMMARY_PROMPT)
+    if not summary:
+        return ""
+    await async_post_telegram_summary(summary, google_doc_url)
+
+
+@traced
+async def async_create_todoist_tasks_bulk(tasks, api_key, due_date):
+    """
+    Async variant of create_todoist_tasks_bulk.
+    """
+    httpx = _httpx()
+    created = []
+    for start in range(0, len(tasks), TODOIST_SYNC_BATCH):
+        batch = tasks[start:start + TODOIST_SYNC_BATCH]
+        commands = todoist_commands(batch, due_date)
+        try:
+            r = await async_http_request("POST", TODOIST_SYNC_URL, headers=todoist_headers(api_key),
+                                         json={"commands": commands})
+            if r.status_code != 200:
+                print(f"Failed to create {len(batch)} tasks: {r.text}")
+                continue
+            sync_status = r.json().get("sync_status", {})
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Error creating {len(batch)} tasks: {e}")
+            continue
+        created.extend(accepted_tasks(batch, commands, sync_status))
+    return created
+
+
+@traced
+async def async_create_todo_list(text):
+    """
+    Async variant of create_todo_list. The one-request-per-task REST path
+    (TODOIST_BULK=0) runs in a worker thread.
+    """
+    lines = await async_map_reduce_completion(text, task_prompt)
+    if not lines:
+        return ""
+    await async_create_tasks(parse_tasks(lines))
+
+
+async def async_create_tasks(tasks):
+    """
+    Async variant of create_tasks.
+    """
+    if not tasks:
+        print("No valid tasks found.")
+        return
+
+    TODOIST_API_KEY = profile_setting("TODOIST_API_KEY")
+    if not TODOIST_API_KEY:
+        print("TODOIST_API_KEY not set in .env.")
+        return
+
+    today_str = datetime.date.today().isoformat()
+    created_today, new_tasks = tasks_to_create(tasks, today_str)
+    if not new_tasks:
+        return
+
+    if TODOIST_BULK:
+        created = await async_create_todoist_tasks_bulk(new_tasks, TODOIST_API_KEY, today_str)
+    else:
+        created = await asyncio.to_thread(create_todoist_tasks_rest, new_tasks, TODOIST_API_KEY, today_str)
+    record_created_tasks(today_str, created_today, created)
+
+
+async def _async_run_stage(stage, kwargs, run_start):
+    """
+    Async variant of _run_stage. Coroutine functions are awaited; plain
+    functions run in a worker thread.
+    """
+    start = time.perf_counter()
+    status = "ok"
+    with span(f"stage {stage.name}", stage=stage.name) as record:
+        try:
+            if asyncio.iscoroutinefunction(stage.func):
+                value = await stage.func(**kwargs)
+            else:
+                value = await asyncio.to_thread(stage.func, **kwargs)
+        except Exception as e:
+            print(f"Stage '{stage.name}' failed: {e}")
+            value = stage.fallback
+            status = record["status"] = "failed"
+    end = time.perf_counter()
+    timing = {
+        "start": start - run_start,
+        "end": end - run_start,
+        "seconds": end - start,
+        "status": status,
+        "span_id": record["span_id"],
+    }
+    return value, timing
+
+
+async def async_run_stages(stages):
+    """
+    Async variant of run_stages: every stage becomes a task on the running
+    event loop as soon as its dependencies have finished.
+
+    Returns:
+        results (dict): Stage name -> result (or fallback for failed stages).
+        timings (dict): Stage name -> {"start", "end", "seconds", "status"}.
+    """
+    pending = _check_stages(stages)
+    results = {}
+    timings = {}
+    run_start = time.perf_counter()
+    running = {}
+    while pending or running:
+        for name, stage in list(pending.items()):
+            if all(dep in results for dep in stage.deps):
+                del pending[name]
+                kwargs = {dep: results[dep] for dep in stage.deps}
+                running[asyncio.ensure_future(_async_run_stage(stage, kwargs, run_start))] = stage
+        if not running:
+            raise ValueError(f"Dependency cycle between stages: {sorted(pending)}")
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            stage = running.pop(task)
+            results[stage.name], timings[stage.name] = task.result()
+    return results, timings
+
+
+# -------------------------
+# Main Functionality
+# -------------------------
+TOP_SUMMARY_PROMPT = (
+    "Summarize the following top news headlines, including key points and context. "
+    "Include the links provided as references."
+)
+TRANS_SUMMARY_PROMPT = (
+    "Summarize the following transgender-related news headlines, highlighting the main themes and events. "
+    "Include the links provided as references."
+)
+EMAILS_SUMMARY_PROMPT = (
+    "Summarize the following email headlines and snippets, highlighting any alerts. "
+    "Focus on key subjects and senders."
+)
+
+# The news sections: stage name -> (title, default NewsAPI query, summary
+# stage name, summary prompt, fallback text). A profile can change the
+# queries with "news_queries", e.g. {"trans_section": "trans rights"}.
+NEWS_SECTIONS = {
+    "top_section": ("Top Stories", None, "top_summary", TOP_SUMMARY_PROMPT,
+                    "### Top Stories\n\nTop stories are unavailable.\n\n"),
+    "trans_section": ("Transgender News", "transgender", "trans_summary", TRANS_SUMMARY_PROMPT,
+                      "### Transgender News\n\nTransgender news is unavailable.\n\n"),
+}
+
+
+# Names of the briefing_parts, used for the document's named ranges.
+BRIEFING_SECTION_KEYS = (
+    "emails_heading", "emails_summary", "calendar", "top_summary", "top_stories", "trans_summary",
+    "trans_news",
+)
+
+
+def briefing_parts(emails_summary, calendar_section, top_summary, top_section,
+                   trans_summary, trans_section):
+    """
+    Splits the daily document into consecutive parts that each end with a
+    newline, so each part can be converted to Docs requests on its own
+    (see assemble_requests).
+
+    Returns:
+        parts (list): Strings that join into the full document text. The
+        summaries (each with a newline added) are at positions 1, 3 and 5.
+    """
+    return [
+        "## Email Summaries (Last 24 Hours)\n\n"
+        "### Emails Summary\n\n",
+        f"{emails_summary}\n",
+        "\n## Calendar Events (Next 24 Hours)\n\n"
+        f"{calendar_section}\n"
+        "## News Summaries\n\n"
+        "### Top Stories Summary\n\n",
+        f"{top_summary}\n",
+        "\nDetailed Top Stories:\n\n"
+        f"{top_section}\n\n"
+        "### Transgender News Summary\n\n",
+        f"{trans_summary}\n",
+        "\nDetailed Transgender News:\n\n"
+        f"{trans_section}\n\n",
+    ]
+
+
+def build_incoming_text(emails_summary, calendar_section, top_summary, top_section,
+                        trans_summary, trans_section):
+    """
+    Assembles the Markdown text of the daily document from its sections.
+
+    Returns:
+        incoming_text (str): The full document text.
+    """
+    return "".join(briefing_parts(emails_summary, calendar_section, top_summary, top_section,
+                                  trans_summary, trans_section))
+
+
+def news_queries(profile=None):
+    """
+    Returns the NewsAPI query of each news section for a profile (by
+    default the active one).
+
+    Returns:
+        queries (dict): Section stage name -> query (None for top headlines).
+    """
+    profile = profile or _current_profile.get()
+    queries = {name: section[1] for name, section in NEWS_SECTIONS.items()}
+    if profile is not None:
+        queries.update((name, query) for name, query in profile["settings"].get("NEWS_QUERIES", {}).items()
+                       if name in queries)
+    return queries
 
-    message = f"{summary}\n\nFor more details see {google_doc_url}"
 
-    # Get Telegram Bot token and chat id from environment variables.
-    TELEGRAM_CHAT_ID = chat_id
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        print("Telegram credentials not set in .env.")
-        return
+def prioritise_sections(sections, queries):
+    """
+    Orders sections for dedupe_articles: sections with a query are more
+    specific than the top headlines, so shared stories stay in them.
+    """
+    return dict(sorted(sections.items(), key=lambda item: queries[item[0]] is None))
 
-    telegram_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {
-        "chat_id": TELEGRAM_CHAT_ID,
-        "text": message
-    }
-    try:
-        r = requests.post(telegram_url, data=payload)
-        if r.status_code == 200:
-            print("Message posted to Telegram successfully.")
+
+@traced
+def fetch_news_articles(queries, interests=()):
+    """
+    Fetches the articles of every news section concurrently, clusters
+    duplicates across them (unless NEWS_DEDUP=0) and keeps the most relevant
+    (see rank_news_sections).
+
+    Args:
+        queries (dict): Section stage name -> NewsAPI query.
+        interests (list): Topics to rank the articles against.
+
+    Returns:
+        articles (dict): Section stage name -> articles.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, len(queries))) as executor:
+        futures = {name: submit_with_context(executor, get_news, NEWSAPI_KEY, query, 20)
+                   for name, query in queries.items()}
+    sections = {}
+    for name, future in futures.items():
+        try:
+            sections[name] = future.result()
+        except Exception as e:
+            print(f"Error fetching news for {name}: {e}")
+            sections[name] = []
+    if NEWS_DEDUP:
+        sections = dedupe_articles(prioritise_sections(sections, queries))
+    return rank_news_sections(sections, interests)
+
+
+@traced
+async def async_fetch_news_articles(queries, interests=()):
+    """
+    Async variant of fetch_news_articles.
+    """
+    results = await asyncio.gather(*(async_get_news(NEWSAPI_KEY, query, 20) for query in queries.values()),
+                                   return_exceptions=True)
+    sections = {}
+    for name, result in zip(queries, results):
+        if isinstance(result, Exception):
+            print(f"Error fetching news for {name}: {result}")
+            result = []
+        sections[name] = result
+    if NEWS_DEDUP:
+        sections = dedupe_articles(prioritise_sections(sections, queries))
+    return rank_news_sections(sections, interests)
+
+
+def news_stages(queries, summary_builders=None, use_async=False, suffix="", interests=()):
+    """
+    Returns the stages that fetch and de-duplicate the news ("news_articles")
+    and then compile and summarize each section.
+
+    Args:
+        queries (dict): Section stage name -> NewsAPI query.
+        summary_builders (dict): See summary_stage.
+        use_async (bool): Build coroutine stages.
+        suffix (str): Appended to every stage name, for shared stages.
+        interests (list): Topics to rank the articles against.
+
+    Returns:
+        stages (list): Stage tuples.
+    """
+    articles_stage = "news_articles" + suffix
+
+    def fetch():
+        return fetch_news_articles(queries, interests)
+
+    async def fetch_async():
+        return await async_fetch_news_articles(queries, interests)
+
+    # If the fetch fails, its empty fallback makes every section fall back too.
+    stages = [Stage(articles_stage, (), fetch_async if use_async else fetch, {})]
+    for section_name in queries:
+        title, _, summary_name, prompt, fallback = NEWS_SECTIONS[section_name]
+        stages.append(news_stage(section_name + suffix, articles_stage, section_name, title, fallback, use_async))
+        stages.extend(summary_stages(summary_name, section_name + suffix, prompt, summary_builders, use_async,
+                                     suffix=suffix))
+    return stages
+
+
+def news_stage(name, articles_stage, section_name, title, fallback, use_async=False):
+    """
+    Returns a stage that scrapes and compiles one news section from the
+    result of articles_stage.
+    """
+    def run(**articles):
+        section = compile_news_section(articles[articles_stage][section_name], title)
+        print(f"Fetched {title.lower()}.")
+        return section
+
+    async def run_async(**articles):
+        section = await async_compile_news_section(articles[articles_stage][section_name], title)
+        print(f"Fetched {title.lower()}.")
+        return section
+    return Stage(name, (articles_stage,), run_async if use_async else run, fallback)
+
+
+def summary_stage(name, section_name, prompt, builders=None, use_async=False):
+    """
+    Returns a stage that summarizes the result of section_name. If builders
+    is given, the summary is also streamed into a DocRequestBuilder stored
+    there under name.
+    """
+    def start_builder():
+        if builders is None:
+            return None
+        builder = builders[name] = DocRequestBuilder()
+        return builder
+
+    def run(**sections):
+        builder = start_builder()
+        summary = summarize_text(sections[section_name], prompt, on_delta=builder.feed if builder else None)
+        if builder is not None:
+            builder.feed("\n")  # Matches the summary's part in briefing_parts.
+        return summary
+
+    async def run_async(**sections):
+        builder = start_builder()
+        summary = await async_summarize_text(sections[section_name], prompt, on_delta=builder.feed if builder else None)
+        if builder is not None:
+            builder.feed("\n")
+        return summary
+    return Stage(name, (section_name,), run_async if use_async else run, "")
+
+
+def brief_stages(name, section_name, prompt, context_name=None, use_async=False, suffix=""):
+    """
+    Returns the stages of a structured summary (see summarize_brief): one
+    producing the brief, named brief_name(name), and one named name that
+    returns its summary, so later stages see the same results as with
+    summary_stage.
+
+    Args:
+        context_name (str): Stage whose result is also given to the brief,
+            for the digest and tasks only.
+        suffix (str): Appended to both stage names, for shared stages.
+    """
+    deps = (section_name, context_name) if context_name else (section_name,)
+    brief = brief_name(name) + suffix
+
+    def run(**sections):
+        return summarize_brief(sections[section_name], prompt, sections.get(context_name, ""))
+
+    async def run_async(**sections):
+        return await async_summarize_brief(sections[section_name], prompt, sections.get(context_name, ""))
+
+    def summary(**briefs):
+        return briefs[brief]["summary"] if briefs[brief] else ""
+    return [Stage(brief, deps, run_async if use_async else run, None),
+            Stage(name + suffix, (brief,), summary, "")]
+
+
+def summary_stages(name, section_name, prompt, builders=None, use_async=False, context_name=None, suffix=""):
+    """
+    Returns the stages summarizing section_name into the stage name (plus
+    suffix): brief_stages with LLM_STRUCTURED, otherwise summary_stage.
+    """
+    if LLM_STRUCTURED:
+        return brief_stages(name, section_name, prompt, context_name, use_async, suffix)
+    return [summary_stage(name + suffix, section_name, prompt, builders, use_async)]
+
+
+def news_stage_names(section_name):
+    """
+    Returns the names of a news section's results: the section, its summary
+    and, with LLM_STRUCTURED, the summary's brief.
+    """
+    summary_name = NEWS_SECTIONS[section_name][2]
+    if LLM_STRUCTURED:
+        return section_name, summary_name, brief_name(summary_name)
+    return section_name, summary_name
+
+
+def build_briefing_stages(alert_senders, use_async=False, shared=None, notify=True):
+    """
+    Declares the stages of the daily briefing and the dependencies between them.
+
+    News, email and calendar fetches run side by side, and today's Google Doc
+    is opened (or created) while they do. Summaries are streamed straight into Docs
+    requests, and the Telegram summary is written while the document is filled.
+
+    Args:
+        alert_senders (list): Email addresses to flag in the email section.
+        use_async (bool): Build coroutine stages for async_run_stages; the
+            Google stages are then offloaded to worker threads.
+        shared (dict): Stage name -> function (or coroutine function) without
+            arguments returning a result computed elsewhere, e.g. news
+            sections and summaries shared by many profiles (see run_batch).
+        notify (bool): Post the summary to Telegram and create Todoist
+            tasks; the daemon's updates during the day leave both out, as
+            rephrased summaries of the same emails would duplicate tasks.
+
+    Returns:
+        stages (list): Stage tuples for run_stages (or async_run_stages).
+    """
+    # Docs requests built from each summary while it streams in.
+    summary_builders = {}
+    shared = shared or {}
+
+    def google(func):
+        if not use_async:
+            return func
+
+        async def run(**kwargs):
+            return await async_google_call(func, **kwargs)
+        return run
+
+    queries = news_queries()
+    shared_names = [name for section_name in queries for name in news_stage_names(section_name)]
+    if all(name in shared for name in shared_names):
+        news = [Stage(name, (), shared[name], NEWS_SECTIONS[name][4] if name in NEWS_SECTIONS else "")
+                for name in shared_names]
+    else:
+        news = news_stages(queries, summary_builders, use_async, interests=relevance_interests())
+
+    # With LLM_STRUCTURED the Telegram digest and the tasks come from the
+    # section briefs; the whole briefing is only sent again if one is missing.
+    brief_names = [brief_name("emails_summary")] + [brief_name(NEWS_SECTIONS[name][2]) for name in queries]
+    brief_deps = tuple(brief_names) if LLM_STRUCTURED else ()
+
+    def telegram_summary(incoming_text, **briefs):
+        digest = brief_digest([briefs[name] for name in brief_names]) if briefs else ""
+        return digest or summarize_text(incoming_text, TELEGRAM_SUMMARY_PROMPT)
+
+    async def telegram_summary_async(incoming_text, **briefs):
+        digest = brief_digest([briefs[name] for name in brief_names]) if briefs else ""
+        return digest or await async_summarize_text(incoming_text, TELEGRAM_SUMMARY_PROMPT)
+
+    def todoist(incoming_text, **briefs):
+        tasks = brief_tasks([briefs[name] for name in brief_names]) if briefs else None
+        return create_todo_list(incoming_text) if tasks is None else create_tasks(tasks)
+
+    async def telegram_async(telegram_summary, google_doc_url):
+        if telegram_summary:
+            await async_post_telegram_summary(telegram_summary, google_doc_url)
+
+    async def todoist_async(incoming_text, **briefs):
+        tasks = brief_tasks([briefs[name] for name in brief_names]) if briefs else None
+        if tasks is None:
+            return await async_create_todo_list(incoming_text)
+        return await async_create_tasks(tasks)
+
+    def google_doc_url(creds, document_id, emails_summary, calendar_section, top_summary, top_section,
+                       trans_summary, trans_section):
+        parts = briefing_parts(emails_summary, calendar_section, top_summary, top_section,
+                               trans_summary, trans_section)
+        summaries = {1: "emails_summary", 3: "top_summary", 5: "trans_summary"}
+        builders = []
+        for position, text in enumerate(parts):
+            builder = summary_builders.get(summaries.get(position))
+            if builder is None or builder.source() != text:
+                # Not streamed, or streamed text that differs from the final summary.
+                builder = DocRequestBuilder()
+                builder.feed(text)
+                builder.close()
+            builders.append(builder)
+        if DOC_INCREMENTAL:
+            url = publish_sections(creds, document_id, list(zip(BRIEFING_SECTION_KEYS, builders)))
         else:
-            print("Failed to post message to Telegram. Response:", r.text)
-    except Exception as e:
-        print("Error posting to Telegram:", e)
+            url = write_google_doc(creds, document_id, assemble_requests(builders))
+        print("Google Doc created at:", url)
+        return url
+
+    stages = [
+        Stage("creds", (), google(get_credentials), None),
+        Stage("document_id", ("creds",),
+              google(open_daily_document if DOC_INCREMENTAL else create_document_shell), None),
+        *news,
+        Stage("emails_section", ("creds",),
+              google(lambda creds: compile_emails_section(creds, alert_senders)),
+              "### Emails Received in the Last 24 Hours\n\nEmails are unavailable.\n\n"),
+        *summary_stages("emails_summary", "emails_section", EMAILS_SUMMARY_PROMPT, summary_builders, use_async,
+                        context_name="calendar_section"),
+        Stage("calendar_section", ("creds",), google(compile_calendar_section),
+              "### Calendar Events in the Next 24 Hours\n\nCalendar events are unavailable.\n\n"),
+        Stage("incoming_text",
+              ("emails_summary", "calendar_section", "top_summary", "top_section", "trans_summary",
+               "trans_section"),
+              build_incoming_text, ""),
+        Stage("google_doc_url",
+              ("creds", "document_id", "emails_summary", "calendar_section", "top_summary", "top_section",
+               "trans_summary", "trans_section"),
+              google(google_doc_url), None),
+        Stage("telegram_summary", ("incoming_text",) + brief_deps,
+              telegram_summary_async if use_async else telegram_summary, ""),
+        Stage("telegram", ("telegram_summary", "google_doc_url"),
+              telegram_async if use_async else
+              lambda telegram_summary, google_doc_url:
+                  post_telegram_summary(telegram_summary, google_doc_url) if telegram_summary else None,
+              None),
+        Stage("todoist", ("incoming_text",) + brief_deps, todoist_async if use_async else todoist, None),
+    ]
+    if not notify:
+        stages = [stage for stage in stages if stage.name not in ("telegram_summary", "telegram", "todoist")]
+    return stages
+
+
+def run_briefing(shared=None, notify=True, executor=None):
+    """
+    Runs the full daily briefing and prints per-stage timings.
+
+    Args:
+        shared (dict): Results computed elsewhere (see build_briefing_stages).
+        notify (bool): Post the summary to Telegram and create Todoist tasks.
+        executor (ThreadPoolExecutor): Runs the stages (see run_stages).
+
+    Returns:
+        results (dict): Stage name -> result, as returned by run_stages.
+    """
+    profile = _current_profile.get()
+    with span("briefing", profile=profile["name"] if profile else None):
+        stages = build_briefing_stages(load_alert_senders(), shared=shared, notify=notify)
+        results, timings = run_stages(stages, executor=executor)
+
+        print_stage_timings(timings)
+        print_critical_path(stages, timings)
+        print_llm_metrics()
+    return results
+
+
+async def async_run_briefing(alert_senders=None, shared=None):
+    """
+    Runs the full daily briefing on the running event loop and prints
+    per-stage timings. Briefings run concurrently on one loop share its HTTP
+    client and per-upstream limits.
+
+    Args:
+        alert_senders (list): Email addresses to flag; defaults to ALERT_SENDERS.
+        shared (dict): Results computed elsewhere (see build_briefing_stages).
+
+    Returns:
+        results (dict): Stage name -> result, as returned by async_run_stages.
+    """
+    if alert_senders is None:
+        alert_senders = load_alert_senders()
+    profile = _current_profile.get()
+    with span("briefing", profile=profile["name"] if profile else None):
+        stages = build_briefing_stages(alert_senders, use_async=True, shared=shared)
+        results, timings = await async_run_stages(stages)
+
+        print_stage_timings(timings)
+        print_critical_path(stages, timings)
+        print_llm_metrics()
+    return results
+
+
+def load_alert_senders():
+    """
+    Returns the addresses listed in ALERT_SENDERS (of the active profile, if any).
+    """
+    # Define alert senders. My email is the first one.
+    alert_senders = profile_setting("ALERT_SENDERS", "")
+    if isinstance(alert_senders, str):  # Profiles may also give a list.
+        alert_senders = alert_senders.split(",")
+    return [email.strip() for email in alert_senders if email.strip()]
 
 
 # -------------------------
-# Todoist Integration Function
+# Batch Mode
 # -------------------------
-def create_todo_list(text):
+# Briefings for a directory of profiles, several at a time. News sections and
+# their summaries are computed once per distinct query and shared by every
+# profile that asks for it, while each profile's email, calendar and document
+# stages run as usual.
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+
+
+def shared_stage_suffix(queries, interests=()):
     """
-    Uses OpenAI to generate actionable todo tasks from the provided text and then
-    creates them in Todoist via their API with the due date set to today.
+    Returns the stage name suffix of the shared news stages for a set of
+    section queries and the interests they are ranked against, e.g.
+    "[,transgender]" or "[,transgender]{climate;rust}".
+    """
+    suffix = "[" + ",".join(query or "" for query in queries.values()) + "]"
+    return suffix + ("{" + ";".join(interests) + "}" if interests else "")
+
+
+def shared_news_stages(profiles, use_async=False):
+    """
+    Declares the news stages once per distinct set of section queries and
+    interests among the profiles (sections are de-duplicated against each
+    other, so they are shared as a set).
+
+    Returns:
+        stages (list): Stages named with shared_stage_suffix.
+    """
+    groups = {}
+    for profile in profiles:
+        queries = news_queries(profile)
+        interests = relevance_interests(profile)
+        groups.setdefault(shared_stage_suffix(queries, interests), (queries, interests))
+    stages = []
+    for suffix, (queries, interests) in sorted(groups.items()):
+        stages.extend(news_stages(queries, use_async=use_async, suffix=suffix, interests=interests))
+    return stages
+
+
+def run_shared_news(profiles):
+    """
+    Runs the shared news stages of a batch as a run (and trace) of its own.
+    """
+    with span("shared_news", profiles=len(profiles)):
+        return run_stages(shared_news_stages(profiles))
+
+
+async def async_run_shared_news(profiles):
+    """
+    Async variant of run_shared_news.
+    """
+    with span("shared_news", profiles=len(profiles)):
+        return await async_run_stages(shared_news_stages(profiles, use_async=True))
+
+
+def shared_news_results(profile, get_results):
+    """
+    Maps a profile's news stages to the shared results.
 
     Args:
-        text (str): The text from which to generate todo tasks.
+        profile (dict): The profile.
+        get_results (callable): Returns the shared stage results, blocking
+            until they are ready.
+
+    Returns:
+        shared (dict): For build_briefing_stages.
     """
-    # Create a prompt to extract tasks.
-    full_prompt = (
-        "Extract actionable todo tasks from the following text. "
-        "List each task on a new line. Only include tasks that can be completed today.\n\n"
-        f"{text}\n\nTasks:"
-    )
-    url = "https://api.openai.com/v1/chat/completions"  # Correct URL for chat completions
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "User-Agent": USER_AGENT,  # Set the User-Agent header
-    }
+    queries = news_queries(profile)
+    suffix = shared_stage_suffix(queries, relevance_interests(profile))
+    shared = {}
+    for section_name in queries:
+        for name in news_stage_names(section_name):
+            shared[name] = lambda key=name + suffix: get_results()[key]
+    return shared
 
 
-    data = {
-        "model": "o3-mini-2025-01-31",  # or gpt-3.5-turbo if that is what you intended
-        "messages": [
-            {"role": "system", "content": "You are a helpful AI Agent."},
-            {"role": "user", "content": full_prompt}
-        ]
-    }
+def briefing_news(results):
+    """
+    Returns the news sections and summaries from a briefing's results, for
+    reuse with reused_news. Sections whose stage fell back are left out, so
+    a briefing given them fetches the news again.
+    """
+    news = {}
+    for section_name, section in NEWS_SECTIONS.items():
+        if results.get(section_name) and results[section_name] != section[4]:
+            news.update((name, results.get(name, "")) for name in news_stage_names(section_name))
+    return news
 
-    try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
 
-        json_response = response.json()
-        lines = json_response["choices"][0]["message"]["content"].strip()  # Access the content correctly
+def reused_news(news):
+    """
+    Returns shared results for build_briefing_stages that answer the news
+    stages with news kept from an earlier briefing (see briefing_news).
+    """
+    return {name: (lambda value=value: value) for name, value in news.items()}
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling OpenAI (requests): {e}")
-        if response.status_code != 200:
-            try:
-                error_message = response.json()
-                print(f"OpenAI API Error details: {error_message}")
-            except:
-                print(f"OpenAI API Error details: Status Code: {response.status_code}")
-        return ""
-    except (KeyError, IndexError) as e:  # Handle potential JSON parsing errors
-        print(f"Error parsing OpenAI response: {e}")
-        print(f"Raw response: {response.text}")  # print the raw response to help with debugging
-        return ""
-    except Exception as e:  # Catch any other exceptions
-        print(f"An unexpected error occurred: {e}")
-        return ""
 
-    # Parse tasks by splitting on newlines.
-    tasks = [line.strip("- ").strip() for line in lines.splitlines() if line.strip()]
-    if not tasks:
-        print("No valid tasks found.")
-        return
+def has_google_token():
+    """
+    Checks that the active profile has authorized Google access. Batch runs
+    can't complete the interactive OAuth flow, so profiles without a token
+    are skipped.
+    """
+    profile = _current_profile.get()
+    if os.path.exists(profile_file('token.pickle')):
+        return True
+    print(f"Skipping {profile['name']}: no Google token; run with --profile {profile['path']} first.")
+    return False
 
-    # Get Todoist API key from environment.
-    TODOIST_API_KEY = os.getenv("TODOIST_API_KEY")
-    if not TODOIST_API_KEY:
-        print("TODOIST_API_KEY not set in .env.")
-        return
 
-    todoist_url = "https://api.todoist.com/rest/v2/tasks"
-    headers = {
-        "Authorization": f"Bearer {TODOIST_API_KEY}",
-        "Content-Type": "application/json"
-    }
+def run_batch(directory, max_workers=BATCH_WORKERS, notify=True, news=None, executor=None):
+    """
+    Runs the briefing for every profile in directory, max_workers at a time.
+    The shared news stages start first; each briefing runs its own stages
+    meanwhile and only waits where it needs the news.
 
-    today_str = datetime.date.today().isoformat()  # e.g. "2025-02-05"
+    Args:
+        directory (str): Directory of profile directories.
+        max_workers (int): Briefings running at once.
+        notify (bool): Post each summary to Telegram and create Todoist tasks.
+        news (dict): Profile name -> news results (see briefing_news) to
+            reuse instead of fetching the news again.
+        executor (ThreadPoolExecutor): Runs every briefing's stages (see
+            run_stages).
 
-    for task in tasks:
-        data = {
-            "content": task,
-            "due_string": "today",
-            "due_date": today_str
-        }
-        try:
-            r = requests.post(todoist_url, headers=headers, json=data)
-            if r.status_code in [200, 204]:
-                print(f"Task created: {task}")
+    Returns:
+        results (dict): Profile name -> briefing results, or None if it failed.
+    """
+    profiles = load_profiles(directory)
+    if not profiles:
+        print(f"No profiles found in {directory}.")
+        return {}
+    print(f"Running briefings for {len(profiles)} profiles.")
+    news = news or {}
+    fetching = [profile for profile in profiles if profile["name"] not in news]
+
+    def run(profile):
+        with use_profile(profile):
+            if not has_google_token():
+                return None
+            print(f"Starting briefing for {profile['name']}.")
+            if profile["name"] in news:
+                shared = reused_news(news[profile["name"]])
             else:
-                print(f"Failed to create task '{task}': {r.text}")
-        except Exception as e:
-            print(f"Error creating task '{task}': {e}")
+                shared = shared_news_results(profile, lambda: shared_news.result()[0])
+            return run_briefing(shared, notify=notify, executor=executor)
+
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers=1) as news_executor, \
+            ThreadPoolExecutor(max_workers=max(1, max_workers)) as briefing_executor:
+        if fetching:
+            shared_news = news_executor.submit(run_shared_news, fetching)
+        futures = [(profile["name"], briefing_executor.submit(run, profile)) for profile in profiles]
+        for name, future in futures:
+            try:
+                outcomes[name] = future.result()
+            except Exception as e:
+                print(f"Briefing for {name} failed: {e}")
+                outcomes[name] = None
+    return outcomes
+
+
+async def async_run_batch(directory, max_workers=BATCH_WORKERS):
+    """
+    Async variant of run_batch: every briefing runs on the running event loop,
+    max_workers at a time.
+    """
+    profiles = load_profiles(directory)
+    if not profiles:
+        print(f"No profiles found in {directory}.")
+        return {}
+    print(f"Running briefings for {len(profiles)} profiles.")
+    news = asyncio.ensure_future(async_run_shared_news(profiles))
+    limit = asyncio.Semaphore(max(1, max_workers))
+
+    def shared_for(profile):
+        shared = {}
+        for name, get in shared_news_results(profile, lambda: news.result()[0]).items():
+            async def wait_for_news(get=get):
+                await asyncio.shield(news)
+                return get()
+            shared[name] = wait_for_news
+        return shared
+
+    async def run(profile):
+        async with limit:
+            with use_profile(profile):
+                if not has_google_token():
+                    return None
+                print(f"Starting briefing for {profile['name']}.")
+                return await async_run_briefing(shared=shared_for(profile))
+
+    outcomes = await asyncio.gather(*(run(profile) for profile in profiles), return_exceptions=True)
+    results = {}
+    for profile, outcome in zip(profiles, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"Briefing for {profile['name']} failed: {outcome}")
+            outcome = None
+        results[profile["name"]] = outcome
+    return results
 
 
 # -------------------------
-# Main Functionality
+# Daemon Mode
 # -------------------------
-if __name__ == '__main__':
-    # Get Google API credentials (for Docs, Gmail, and Calendar).
-    creds = get_credentials()
+# One long-lived process instead of a cron job per run: the full briefing
+# every morning at DAEMON_BRIEFING_AT (local time), then an update every
+# DAEMON_UPDATE_INTERVAL seconds until midnight. Updates refresh the emails,
+# calendar, document and Todoist tasks, reusing the morning's news and without
+# posting to Telegram. HTTP pools, credentials, discovery documents, Google
+# services and the caches stay warm between runs, and the schedule and the
+# morning's news are kept in DAEMON_STATE_FILE so a restart carries on.
+DAEMON_BRIEFING_AT = os.getenv("DAEMON_BRIEFING_AT", "07:00")
+DAEMON_UPDATE_INTERVAL = float(os.getenv("DAEMON_UPDATE_INTERVAL", "3600"))
+DAEMON_HEALTH_ADDRESS = os.getenv("DAEMON_HEALTH_ADDRESS", "127.0.0.1:8787")
+DAEMON_STATE_FILE = "daemon.json"
+DAEMON_MAX_SLEEP = 60  # The schedule is rechecked at least this often, e.g. after a suspend.
 
-    # 1. News Section
-    top_articles = get_news(NEWSAPI_KEY, limit=20)
-    top_section = compile_news_section(top_articles, "Top Stories")
-    print("Fetched top stories.")
 
-    trans_articles = get_news(NEWSAPI_KEY, query="transgender", limit=20)
-    trans_section = compile_news_section(trans_articles, "Transgender News")
-    print("Fetched transgender news.")
+def next_daemon_run(state, now, briefing_at=DAEMON_BRIEFING_AT, interval=DAEMON_UPDATE_INTERVAL):
+    """
+    Works out the daemon's next run: today's briefing once it is due, then
+    an update every interval seconds until midnight.
 
-    top_summary_prompt = (
-        "Summarize the following top news headlines, including key points and context. "
-        "Include the links provided as references."
-    )
-    top_summary = summarize_text(top_section, top_summary_prompt)
+    Args:
+        state (dict): The daemon state, with "last_briefing" and "last_run"
+            as ISO timestamps.
+        now (datetime.datetime): The current local time.
+        briefing_at (str): Local time of the daily briefing, "HH:MM".
+        interval (float): Seconds between updates; 0 for none.
 
-    trans_summary_prompt = (
-        "Summarize the following transgender-related news headlines, highlighting the main themes and events. "
-        "Include the links provided as references."
-    )
-    trans_summary = summarize_text(trans_section, trans_summary_prompt)
+    Returns:
+        (kind, at): "briefing" or "update", and when it is due (possibly in
+        the past).
+    """
+    hour, minute = (int(part) for part in briefing_at.split(":"))
+    briefing_today = datetime.datetime.combine(now.date(), datetime.time(hour, minute))
+    last_briefing = state.get("last_briefing")
+    if not last_briefing or datetime.datetime.fromisoformat(last_briefing).date() < now.date():
+        return "briefing", briefing_today
+    tomorrow = ("briefing", briefing_today + datetime.timedelta(days=1))
+    if interval <= 0:
+        return tomorrow
+    update_at = datetime.datetime.fromisoformat(state.get("last_run") or last_briefing)
+    update_at += datetime.timedelta(seconds=interval)
+    if update_at.date() > now.date():
+        return tomorrow
+    return "update", update_at
 
-    # 2. Email Section (Last 24 Hours)
-    # Define alert senders. My email is the first one.
-    alert_senders_str = os.getenv("ALERT_SENDERS", "")
-    alert_senders = [email.strip() for email in alert_senders_str.split(",") if email.strip()]
-    emails_section = compile_emails_section(creds, alert_senders)
-    emails_summary_prompt = (
-        "Summarize the following email headlines and snippets, highlighting any alerts. "
-        "Focus on key subjects and senders."
-    )
-    emails_summary = summarize_text(emails_section, emails_summary_prompt)
 
-    # 3. Calendar Events Section (Next 24 Hours)
-    calendar_section = compile_calendar_section(creds)
+class BriefingDaemon:
+    """
+    Runs briefings on the schedule of next_daemon_run until stopped, and
+    serves GET /healthz (the schedule and the last run, as JSON; 503 if the
+    last run failed) and GET /metrics (prometheus_metrics) on health_address.
 
-    # Construct the incoming text for the Google Doc.
-    incoming_text = (
-        "## Email Summaries (Last 24 Hours)\n\n"
-        "### Emails Summary\n\n"
-        f"{emails_summary}\n\n"
-        "## Calendar Events (Next 24 Hours)\n\n"
-        f"{calendar_section}\n"
-        "## News Summaries\n\n"
-        "### Top Stories Summary\n\n"
-        f"{top_summary}\n\n"
-        "Detailed Top Stories:\n\n"
-        f"{top_section}\n\n"
-        "### Transgender News Summary\n\n"
-        f"{trans_summary}\n\n"
-        "Detailed Transgender News:\n\n"
-        f"{trans_section}\n\n"
-    )
+    Args:
+        run (callable): run(full, news) runs the briefing, or an update when
+            full is False reusing news, and returns the news to keep (see
+            run_daemon).
+        briefing_at (str): Local time of the daily briefing, "HH:MM".
+        interval (float): Seconds between updates; 0 for none.
+        health_address (str): "host:port" to listen on; "0" for none.
+    """
+
+    def __init__(self, run, briefing_at=DAEMON_BRIEFING_AT, interval=DAEMON_UPDATE_INTERVAL,
+                 health_address=DAEMON_HEALTH_ADDRESS):
+        self.run = run
+        self.briefing_at = briefing_at
+        self.interval = interval
+        self.health_address = health_address
+        self.state = load_state(DAEMON_STATE_FILE, {})
+        self.started_at = time.time()
+        self.running = None
+        self.next_run = None
+        self.stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def stop(self, *_):
+        """
+        Stops the daemon once the current run has finished. Also usable as a
+        signal handler.
+        """
+        if not self.stopping.is_set():
+            print("Stopping after the current run.")
+        self.stopping.set()
+
+    def serve_forever(self):
+        """
+        Runs briefings and updates as they fall due until stop is called.
+        """
+        self.start_health_server()
+        try:
+            while not self.stopping.is_set():
+                kind, at = next_daemon_run(self.state, datetime.datetime.now(), self.briefing_at, self.interval)
+                next_run = {"kind": kind, "at": at.isoformat(timespec="seconds")}
+                if next_run != self.next_run:
+                    print(f"Next {kind} at {at:%Y-%m-%d %H:%M}.")
+                    with self._lock:
+                        self.next_run = next_run
+                delay = (at - datetime.datetime.now()).total_seconds()
+                if delay > 0:
+                    self.stopping.wait(min(delay, DAEMON_MAX_SLEEP))
+                else:
+                    self.run_once(kind)
+        finally:
+            if self._server is not None:
+                self._server.shutdown()
+                self._server.server_close()
 
-    # Create a Google Doc with the incoming text.
-    google_doc_url = create_google_doc(incoming_text)
-    print("Google Doc created at:", google_doc_url)
+    def run_once(self, kind):
+        """
+        Runs a briefing or an update and records it in DAEMON_STATE_FILE.
 
-    # Post the summary to Telegram, including the Google Doc link.
-    summarise_for_telegram(incoming_text, google_doc_url)
+        Args:
+            kind (str): "briefing" or "update".
+        """
+        full = kind == "briefing"
+        started = datetime.datetime.now()
+        print(f"Starting the {kind} at {started:%H:%M}.")
+        with self._lock:
+            self.running = kind
+        error = None
+        try:
+            news = self.run(full, self.state.get("news", {}))
+        except Exception as e:
+            print(f"The {kind} failed: {e}")
+            news, error = {}, str(e)
+        state = dict(self.state)
+        if full:
+            # Recorded even if it failed, so it is retried by the next update rather than immediately.
+            state["last_briefing"] = started.isoformat(timespec="seconds")
+            state["news"] = news
+        else:
+            state["news"] = {**state.get("news", {}), **news}
+        state["last_run"] = datetime.datetime.now().isoformat(timespec="seconds")
+        state["last_kind"] = kind
+        state["last_error"] = error
+        with self._lock:
+            self.state = state
+            self.running = None
+        save_state(DAEMON_STATE_FILE, state)
+
+    def health(self):
+        """
+        Returns the daemon's status for /healthz.
+        """
+        with self._lock:
+            state = self.state
+            return {
+                "status": "failing" if state.get("last_error") else "ok",
+                "uptime": round(time.time() - self.started_at, 3),
+                "running": self.running,
+                "next_run": self.next_run,
+                "last_briefing": state.get("last_briefing"),
+                "last_run": state.get("last_run"),
+                "last_kind": state.get("last_kind"),
+                "last_error": state.get("last_error"),
+            }
+
+    def start_health_server(self):
+        """
+        Serves /healthz and /metrics from a background thread.
+        """
+        if self.health_address == "0":
+            return
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        daemon = self
+
+        class HealthHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == "/healthz":
+                    health = daemon.health()
+                    status = 200 if health["status"] == "ok" else 503
+                    body, content_type = json.dumps(health).encode(), "application/json"
+                elif path == "/metrics":
+                    status = 200
+                    body, content_type = prometheus_metrics().encode(), "text/plain; version=0.0.4"
+                else:
+                    status, body, content_type = 404, b"Not found\n", "text/plain"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        host, _, port = self.health_address.rpartition(":")
+        self._server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), HealthHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="health", daemon=True).start()
+        host, port = self._server.server_address[:2]
+        print(f"Serving health checks at http://{host}:{port}/healthz and metrics at /metrics.")
+
+
+def run_daemon(profile_path=None, profiles_dir=None, workers=BATCH_WORKERS):
+    """
+    Runs the daemon (see BriefingDaemon) for the briefing, one profile or a
+    directory of profiles until SIGINT or SIGTERM.
+
+    Args:
+        profile_path (str): Profile directory, as with --profile.
+        profiles_dir (str): Directory of profiles, as with --profiles.
+        workers (int): Briefings run at once with profiles_dir.
+    """
+    # One pool for the daemon's lifetime, so its threads keep their Google
+    # services (and connections) from run to run.
+    executor = ThreadPoolExecutor(max_workers=PIPELINE_MAX_WORKERS * (max(1, workers) if profiles_dir else 1))
 
-    # Create todo tasks in Todoist from the incoming text.
-    create_todo_list(incoming_text)
+    def run(full, news):
+        if profiles_dir:
+            outcomes = run_batch(profiles_dir, workers, notify=full, news=None if full else news, executor=executor)
+            return {name: briefing_news(results) for name, results in outcomes.items() if results}
+        profile = load_profile(profile_path) if profile_path else None
+        key = profile["name"] if profile else ""
+        with use_profile(profile) if profile else contextlib.nullcontext():
+            shared = None if full else reused_news(news.get(key, {}))
+            return {key: briefing_news(run_briefing(shared, notify=full, executor=executor))}
+
+    daemon = BriefingDaemon(run)
+    if not profile_path and not profiles_dir:
+        start_telegram_listener(daemon.stopping)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    try:
+        daemon.serve_forever()
+    finally:
+        executor.shutdown()
+
+
+# -------------------------
+# Command Line
+# -------------------------
+async def _async_main(args):
+    try:
+        if args.profiles:
+            return await async_run_batch(args.profiles, args.workers)
+        if args.profile:
+            with use_profile(load_profile(args.profile)):
+                return await async_run_briefing()
+        return await async_run_briefing()
+    finally:
+        await close_async_clients()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Builds the daily briefing.")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="run every integration on one asyncio event loop (needs httpx)")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="run the briefing for one profile directory (e.g. to authorize its Google account)")
+    parser.add_argument("--profiles", metavar="DIR",
+                        help="run the briefings for every profile in DIR")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS,
+                        help="briefings run at once with --profiles (default: %(default)s)")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running: the briefing every morning at DAEMON_BRIEFING_AT, "
+                             "then updates every DAEMON_UPDATE_INTERVAL seconds")
+    args = parser.parse_args(argv)
+    if args.daemon and args.use_async:
+        parser.error("--daemon runs on worker threads and can't be combined with --async")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        if args.daemon:
+            run_daemon(args.profile, args.profiles, args.workers)
+        elif args.use_async:
+            asyncio.run(_async_main(args))
+        elif args.profiles:
+            run_batch(args.profiles, args.workers)
+        elif args.profile:
+            with use_profile(load_profile(args.profile)):
+                run_briefing()
+        else:
+            run_briefing()
+    finally:
+        close_sessions()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Benchmarks markdown_to_requests against line-by-line Google Docs request
+builders: number of requests, JSON payload size and build time. "legacy" is
+the original builder (headings only, code point indexes); "per-line" gives
+the same formatting as markdown_to_requests, one insertText per line.
+
+Usage:
+    python benchmarks/bench_docs_requests.py [--articles N] [--repeat N]
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("NEWSAPI_KEY", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import Agent  # noqa: E402
+
+
+def legacy_markdown_to_requests(markdown_text):
+    """
+    The original builder: one insertText per line and one updateTextStyle per
+    heading, with indexes counted in code points.
+    """
+    requests_body = []
+    current_index = 1
+
+    for line in markdown_text.splitlines():
+        if line.startswith("### "):
+            text = line.replace("### ", "")
+            text_style = {"bold": True, "fontSize": {"magnitude": 12, "unit": "PT"}}
+        elif line.startswith("## "):
+            text = line.replace("## ", "")
+            text_style = {"bold": True, "fontSize": {"magnitude": 14, "unit": "PT"}}
+        elif line.startswith("# "):
+            text = line.replace("# ", "")
+            text_style = {"bold": True, "fontSize": {"magnitude": 16, "unit": "PT"}}
+        else:
+            text = line
+            text_style = {}
+
+        requests_body.append({
+            'insertText': {
+                'location': {'index': current_index},
+                'text': text + "\n"
+            }
+        })
+
+        if text_style:
+            requests_body.append({
+                'updateTextStyle': {
+                    'range': {
+                        'startIndex': current_index,
+                        'endIndex': current_index + len(text)
+                    },
+                    'textStyle': text_style,
+                    'fields': 'bold,fontSize'
+                }
+            })
+
+        current_index += len(text) + 1
+
+    return requests_body
+
+
+def per_line_markdown_to_requests(markdown_text):
+    """
+    The original builder's approach with markdown_to_requests' formatting:
+    one insertText per line, then a paragraph style per heading and a text
+    style per bold span or link, with UTF-16 indexes.
+    """
+    requests_body = []
+    current_index = 1
+
+    for line in markdown_text.splitlines():
+        named_style = None
+        for marker, style in Agent.HEADING_STYLES:
+            if line.startswith(marker):
+                line = line[len(marker):]
+                named_style = style
+                break
+        text = ""
+        styles = []
+        last = 0
+        has_markup = "*" in line or "]" in line or "/" in line
+        for match in Agent.INLINE_MARKDOWN.finditer(line) if has_markup else ():
+            text += line[last:match.start()]
+            shown = match.group("bold") or match.group("label") or match.group("url")
+            start = current_index + Agent.utf16_len(text)
+            if match.group("bold") is not None:
+                style, fields = {"bold": True}, "bold"
+            else:
+                style, fields = {"link": {"url": match.group("href") or match.group("url")}}, "link"
+            styles.append({'updateTextStyle': {
+                'range': {'startIndex': start, 'endIndex': start + Agent.utf16_len(shown)},
+                'textStyle': style,
+                'fields': fields
+            }})
+            text += shown
+            last = match.end()
+        text += line[last:]
+        end = current_index + Agent.utf16_len(text) + 1
+
+        requests_body.append({
+            'insertText': {
+                'location': {'index': current_index},
+                'text': text + "\n"
+            }
+        })
+        if named_style:
+            requests_body.append({'updateParagraphStyle': {
+                'range': {'startIndex': current_index, 'endIndex': end},
+                'paragraphStyle': {'namedStyleType': named_style},
+                'fields': 'namedStyleType'
+            }})
+        requests_body.extend(styles)
+        current_index = end
+
+    return requests_body
+
+
+def synthetic_briefing(articles):
+    """
+    Builds a briefing shaped like the real one: summaries, calendar, and two
+    detailed news sections with bold titles, long snippets, links and emoji.
+    """
+    def section(title):
+        text = f"### {title}\n\n"
+        for i in range(articles):
+            text += f"**Headline {i}: council approves plan 🚆**\n\n"
+            text += "Snippet: " + "The plan was approved after a long debate in the chamber. " * 40 + "\n\n"
+            text += f"Link: https://news.example.com/story/{i}\n\n"
+        return text
+
+    summary = "\n".join(f"- Point {i} about the day's news 📰, see [source](https://example.com/{i})"
+                        for i in range(12))
+    calendar = "### Calendar Events in the Next 24 Hours\n\n" + "".join(
+        f"**Meeting {i}** at 2025-02-05T{9 + i:02d}:00:00Z\n\n" for i in range(6))
+    return Agent.build_incoming_text(summary, calendar, summary, section("Top Stories"),
+                                     summary, section("Transgender News"))
+
+
+def measure(name, builder, text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        requests_body = builder(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    payload = len(json.dumps({"requests": requests_body}).encode("utf-8"))
+    print(f"{name:<8} {len(requests_body):7d} requests {payload / 1024:9.1f} KiB {best * 1000:8.2f} ms")
+    return len(requests_body), payload, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=20, help="Articles per news section.")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per builder; the best time is reported.")
+    args = parser.parse_args()
+
+    text = synthetic_briefing(args.articles)
+    print(f"Briefing of {len(text)} characters, {len(text.splitlines())} lines\n")
+    measure("legacy", legacy_markdown_to_requests, text, args.repeat)
+    per_line_count, per_line_size, per_line_time = measure("per-line", per_line_markdown_to_requests, text,
+                                                           args.repeat)
+    count, size, elapsed = measure("current", Agent.markdown_to_requests, text, args.repeat)
+    print(f"\nAgainst per-line: {per_line_count / count:.1f}x fewer requests, {per_line_size / size:.2f}x smaller "
+          f"payload, {per_line_time / elapsed:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
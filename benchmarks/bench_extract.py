@@ -0,0 +1,140 @@
+"""
+Benchmarks the article text extraction engines against the original
+BeautifulSoup implementation of fetch_article_snippet.
+
+Usage:
+    python benchmarks/bench_extract.py [--pages DIR] [--repeat N]
+    python benchmarks/bench_extract.py --save URL [URL ...]
+
+Pages are read from benchmarks/pages/*.html. If there are none, a synthetic
+corpus of ad- and script-heavy news pages is generated instead. --save
+downloads real pages into the corpus directory.
+"""
+from __future__ import print_function
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("NEWSAPI_KEY", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import Agent  # noqa: E402
+from bs4 import BeautifulSoup  # noqa: E402
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+
+
+def legacy_extract(html):
+    """
+    The original fetch_article_snippet parsing: a full html.parser tree and
+    quadratic string concatenation over every <p>.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    paragraphs = soup.find_all('p')
+
+    all_text = ""
+    for p in paragraphs:
+        text = p.get_text(strip=True)
+        all_text += text + " "
+
+    return all_text.strip()
+
+
+def synthetic_page(seed):
+    """
+    Builds a news-like page: a large head of scripts and styles, navigation,
+    ad slots and around 60 article paragraphs.
+    """
+    rng = random.Random(seed)
+    words = ["government", "minister", "report", "said", "week", "city", "council", "new",
+             "people", "election", "court", "climate", "health", "school", "market", "rights"]
+
+    def sentence():
+        return " ".join(rng.choice(words) for _ in range(rng.randint(8, 20))).capitalize() + "."
+
+    parts = ["<!DOCTYPE html><html><head><title>Story</title>"]
+    for i in range(40):
+        parts.append(f"<script>window.ads{i} = {{slot: '{i}', sizes: [[300, 250], [728, 90]]}};"
+                     + "var x = '<p>not text</p>';" * 20 + "</script>")
+        parts.append("<style>.ad{display:block} .nav a{color:#333}" * 10 + "</style>")
+    parts.append("</head><body><nav>" + "".join(f"<a href='/s{i}'>Section {i}</a>" for i in range(80)) + "</nav>")
+    for i in range(60):
+        parts.append(f"<p>{' '.join(sentence() for _ in range(4))} <a href='/l{i}'>link</a></p>")
+        if i % 5 == 0:
+            parts.append("<div class='ad'><iframe src='https://ads.example/slot'></iframe></div>")
+    parts.append("<footer>" + "<p>Copyright notice.</p>" * 5 + "</footer></body></html>")
+    return "".join(parts)
+
+
+def load_corpus(pages_dir):
+    paths = sorted(glob.glob(os.path.join(pages_dir, "*.html")))
+    if not paths:
+        print(f"No saved pages in {pages_dir}; using a synthetic corpus of 30 pages.")
+        return [synthetic_page(seed) for seed in range(30)]
+    pages = []
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            pages.append(f.read())
+    return pages
+
+
+def save_pages(urls, pages_dir):
+    os.makedirs(pages_dir, exist_ok=True)
+    for i, url in enumerate(urls):
+        response = Agent.http_request("GET", url, timeout=10)
+        path = os.path.join(pages_dir, f"page{i:03d}.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(response.text)
+        print(f"Saved {url} -> {path}")
+
+
+def chunked(html, size=16384):
+    for start in range(0, len(html), size):
+        yield html[start:start + size]
+
+
+def time_engine(name, func, pages, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for html in pages:
+            func(html)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    per_page = best / len(pages) * 1000
+    print(f"{name:<10} {best * 1000:10.1f} ms total {per_page:8.2f} ms/page")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", default=PAGES_DIR, help="Directory of saved .html pages.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per engine; the best is reported.")
+    parser.add_argument("--max-chars", type=int, default=Agent.ARTICLE_MAX_CHARS)
+    parser.add_argument("--save", nargs="+", metavar="URL", help="Download pages into the corpus and exit.")
+    args = parser.parse_args()
+
+    if args.save:
+        save_pages(args.save, args.pages)
+        return
+
+    pages = load_corpus(args.pages)
+    size = sum(len(html) for html in pages)
+    print(f"{len(pages)} pages, {size / 1024:.0f} KiB of HTML, max_chars={args.max_chars}\n")
+
+    baseline = time_engine("legacy", legacy_extract, pages, args.repeat)
+    for name, engine in Agent.ARTICLE_EXTRACTORS.items():
+        try:
+            elapsed = time_engine(name, lambda html: engine(chunked(html), args.max_chars), pages, args.repeat)
+        except ImportError as e:
+            print(f"{name:<10} skipped ({e})")
+            continue
+        print(f"{'':<10} {baseline / elapsed:10.1f}x faster than legacy")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Benchmarks the whole briefing and its main stages offline, replaying
+recorded responses (see replay.py), and reports wall time, CPU time and peak
+Python memory for each.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--fixtures DIR] [--repeat N] [--latency S] [--jitter F]
+    python benchmarks/bench_pipeline.py --json results.json
+    python benchmarks/bench_pipeline.py --baseline results.json [--tolerance 0.25]
+
+Fixtures are read from benchmarks/fixtures (recorded with
+"replay.py record benchmarks/fixtures"). If there are none, synthetic
+responses for every integration are generated instead. The full pipeline runs
+with the replay latency; the stage benchmarks run without it, as they measure
+parsing and formatting.
+
+Each benchmark runs --repeat times for timing and once more under tracemalloc
+for peak memory. With --baseline, the run fails if any CPU time or peak
+memory is more than --tolerance above the baseline's.
+"""
+from __future__ import print_function
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import replay  # noqa: E402
+
+replay.set_offline_environment()
+
+import Agent  # noqa: E402
+from bench_docs_requests import synthetic_briefing  # noqa: E402
+from bench_extract import synthetic_page  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Hosts answered by APIs rather than news sites.
+API_HOSTS = {"newsapi.org", "api.openai.com", "api.telegram.org", "api.todoist.com"}
+
+CANNED_REPLY = ("- Review the council's transport plan before Thursday\n"
+                "- Reply to Sam about the budget meeting\n"
+                "- Book train tickets for the conference")
+DOCUMENT_ID = "benchmark-document"
+HEADLINE_WORDS = ["council", "approves", "transport", "plan", "minister", "warns", "budget", "cuts", "court",
+                  "rules", "rights", "case", "storm", "floods", "coast", "school", "strike", "talks", "election",
+                  "poll", "shows", "lead", "hospital", "waiting", "times", "rise", "market", "falls", "climate",
+                  "summit", "agrees", "deal", "police", "inquiry", "report", "published"]
+PLACEHOLDER_UUIDS = [f"00000000-0000-4000-8000-{i:012d}" for i in range(200)]
+
+
+def synthetic_cassette(articles=20, emails=120, events=12):
+    """
+    Builds made-up responses for every integration, shaped like the real ones.
+
+    Args:
+        articles (int): Articles per NewsAPI response. Every fifth story of
+            the second section repeats one of the first (with tracking
+            parameters), to exercise de-duplication.
+        emails (int): Messages in the last day's Gmail listing.
+        events (int): Events in the calendar.
+
+    Returns:
+        cassette (replay.Cassette): The responses.
+    """
+    cassette = replay.Cassette()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    json_headers = {"Content-Type": "application/json; charset=UTF-8"}
+
+    def add(method, url, body, elapsed, headers=json_headers, request_body=None):
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        cassette.add(method, url, 200, headers, body, elapsed, request_body, exact=False)
+
+    def headline(seed):
+        rng = random.Random(seed)
+        return " ".join(rng.sample(HEADLINE_WORDS, 7)).capitalize()
+
+    # NewsAPI: one response per section, served in turn.
+    for section in range(2):
+        stories = []
+        for i in range(articles):
+            url = f"https://news{i % 4}.example.com/{section}/story-{i}"
+            seed = section * 1000 + i
+            if section == 1 and i % 5 == 0:
+                url = f"https://news{i % 4}.example.com/0/story-{i}?utm_source=newsapi"
+                seed = i
+            stories.append({
+                "source": {"id": None, "name": f"News {i % 4}"},
+                "title": headline(seed),
+                "description": headline(f"description {seed}"),
+                "url": url,
+                "publishedAt": (now - datetime.timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            })
+            add("GET", url, synthetic_page(section * 1000 + i), 0.12,
+                headers={"Content-Type": "text/html; charset=utf-8"})
+        add("GET", "https://newsapi.org/v2/top-headlines",
+            {"status": "ok", "totalResults": len(stories), "articles": stories}, 0.15)
+
+    # OpenAI: a plain, a streamed and a structured (LLM_STRUCTURED) completion.
+    usage = {"prompt_tokens": 2500, "completion_tokens": 60, "total_tokens": 2560}
+    add("POST", Agent.OPENAI_URL,
+        {"choices": [{"index": 0, "message": {"role": "assistant", "content": CANNED_REPLY}}], "usage": usage},
+        0.8, request_body=json.dumps({"model": "", "messages": []}))
+    words = CANNED_REPLY.split(" ")
+    events_body = "".join(
+        "data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": word + " "}}]}) + "\n\n"
+        for word in words[:-1])
+    events_body += "data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": words[-1]}}]}) + "\n\n"
+    events_body += "data: " + json.dumps({"choices": [], "usage": usage}) + "\n\ndata: [DONE]\n\n"
+    add("POST", Agent.OPENAI_URL, events_body, 0.8, headers={"Content-Type": "text/event-stream"},
+        request_body=json.dumps({"model": "", "messages": [], "stream": True, "stream_options": {}}))
+    brief = {"summary": CANNED_REPLY, "digest": "A quiet day with one plan to review.",
+             "tasks": Agent.parse_tasks(CANNED_REPLY)}
+    add("POST", Agent.OPENAI_URL,
+        {"choices": [{"index": 0, "message": {"role": "assistant", "content": json.dumps(brief)}}], "usage": usage},
+        0.9, request_body=json.dumps({"model": "", "messages": [], "response_format": {}}))
+
+    # Gmail: the profile, the listing and metadata batches of GMAIL_BATCH_SIZE.
+    add("GET", "https://gmail.googleapis.com/gmail/v1/users/me/profile", {"historyId": "100000"}, 0.1)
+    ids = [f"msg{i:05d}" for i in range(emails)]
+    add("GET", "https://gmail.googleapis.com/gmail/v1/users/me/messages",
+        {"messages": [{"id": msg_id, "threadId": msg_id} for msg_id in ids], "resultSizeEstimate": emails}, 0.2)
+    base = PLACEHOLDER_UUIDS[0]
+    for start in range(0, emails, Agent.GMAIL_BATCH_SIZE):
+        parts = []
+        for i, msg_id in enumerate(ids[start:start + Agent.GMAIL_BATCH_SIZE], start):
+            sender = "alerts@example.com" if i % 10 == 0 else f"person{i}@example.org"
+            message = {
+                "id": msg_id,
+                "internalDate": str(int((now - datetime.timedelta(minutes=5 * i)).timestamp() * 1000)),
+                "snippet": f"Hi, following up on item {i} from yesterday's meeting.",
+                "payload": {"headers": [
+                    {"name": "Subject", "value": f"Update {i} on the project"},
+                    {"name": "From", "value": f"Person {i} <{sender}>"},
+                    {"name": "Date", "value": (now - datetime.timedelta(minutes=5 * i)).strftime(
+                        "%a, %d %b %Y %H:%M:%S +0000")},
+                ]},
+            }
+            parts.append(f"--batch_benchmark\r\nContent-Type: application/http\r\n"
+                         f"Content-ID: <response-{base} + {msg_id}>\r\n\r\n"
+                         f"HTTP/1.1 200 OK\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n"
+                         f"{json.dumps(message)}\r\n")
+        add("POST", "https://gmail.googleapis.com/batch", "".join(parts) + "--batch_benchmark--\r\n",
+            0.4, headers={"Content-Type": "multipart/mixed; boundary=batch_benchmark"},
+            request_body=f"Content-ID: <{base} + msg>")
+
+    # Calendar: events over the next day.
+    items = []
+    for i in range(events):
+        start = now + datetime.timedelta(hours=2 * i - 4)
+        items.append({
+            "id": f"event{i}",
+            "status": "confirmed",
+            "summary": f"Meeting {i}",
+            "start": {"dateTime": start.strftime("%Y-%m-%dT%H:%M:%SZ")},
+            "end": {"dateTime": (start + datetime.timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")},
+        })
+    add("GET", "https://www.googleapis.com/calendar/v3/calendars/primary/events",
+        {"items": items, "nextSyncToken": "benchmark-sync-token"}, 0.15)
+
+    # Docs: create, read and update today's document.
+    document = f"https://docs.googleapis.com/v1/documents/{DOCUMENT_ID}"
+    add("POST", "https://docs.googleapis.com/v1/documents", {"documentId": DOCUMENT_ID, "title": "activity"}, 0.5,
+        request_body=json.dumps({"title": ""}))
+    add("GET", document, {"documentId": DOCUMENT_ID, "body": {"content": [{"endIndex": 1}]}}, 0.2)
+    add("POST", document + ":batchUpdate", {"documentId": DOCUMENT_ID, "replies": []}, 0.6,
+        request_body=json.dumps({"requests": []}))
+
+    # Telegram and Todoist.
+    add("POST", "https://api.telegram.org/botREDACTED/sendMessage", {"ok": True, "result": {"message_id": 1}}, 0.2)
+    tasks = Agent.parse_tasks(CANNED_REPLY)
+    commands = [{"temp_id": PLACEHOLDER_UUIDS[2 * i + 1], "uuid": PLACEHOLDER_UUIDS[2 * i + 2]}
+                for i in range(len(tasks))]
+    add("POST", Agent.TODOIST_SYNC_URL,
+        {"sync_status": {command["uuid"]: "ok" for command in commands},
+         "temp_id_mapping": {command["temp_id"]: str(i) for i, command in enumerate(commands)}},
+        0.3, request_body=json.dumps({"commands": commands}))
+    return cassette
+
+
+def load_cassette(directory):
+    if os.path.isdir(directory) and any(name.endswith(".json") for name in os.listdir(directory)):
+        print(f"Replaying fixtures from {directory}.")
+        return replay.Cassette.load(directory)
+    print(f"No fixtures in {directory}; using synthetic responses.")
+    return synthetic_cassette()
+
+
+def measure(func, repeat):
+    """
+    Runs func repeat times for wall and CPU time (medians), then once under
+    tracemalloc for its peak memory.
+    """
+    walls, cpus = [], []
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        func()
+        walls.append(time.perf_counter() - wall)
+        cpus.append(time.process_time() - cpu)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"wall": statistics.median(walls), "cpu": statistics.median(cpus), "peak": peak}
+
+
+def benchmarks(cassette):
+    """
+    Returns (name, function, replay latency wanted) for each benchmark.
+    """
+    pages = [(interaction["url"], interaction["body"]) for interaction in cassette.interactions
+             if interaction["method"] == "GET" and urlparse(interaction["url"]).netloc not in API_HOSTS
+             and "googleapis.com" not in interaction["url"]]
+    news = json.loads(next(interaction["body"] for interaction in cassette.interactions
+                           if urlparse(interaction["url"]).netloc == "newsapi.org"))["articles"]
+    briefing = synthetic_briefing(20)
+    extract = Agent.ARTICLE_EXTRACTORS[Agent.ARTICLE_EXTRACTOR]
+
+    def fresh(func):
+        def run():
+            with replay.fresh_state():
+                return func()
+        return run
+
+    def structured(func):
+        def run():
+            saved, Agent.LLM_STRUCTURED = Agent.LLM_STRUCTURED, True
+            try:
+                return func()
+            finally:
+                Agent.LLM_STRUCTURED = saved
+        return run
+
+    return [
+        ("pipeline", fresh(lambda: Agent.main([])), True),
+        ("pipeline --async", fresh(lambda: Agent.main(["--async"])), True),
+        ("pipeline structured", structured(fresh(lambda: Agent.main([]))), True),
+        ("markdown_to_requests", lambda: Agent.markdown_to_requests(briefing), False),
+        ("article parsing", lambda: [extract(iter([html]), Agent.ARTICLE_MAX_CHARS) for _, html in pages], False),
+        ("fetch_article_snippet", fresh(lambda: [Agent.fetch_article_snippet(url) for url, _ in pages]), False),
+        ("compile_news_section", fresh(lambda: Agent.compile_news_section(news, "Top Stories")), False),
+        ("compile_emails_section", fresh(lambda: Agent.compile_emails_section(None, ["alerts@example.com"])),
+         False),
+        ("compile_calendar_section", fresh(lambda: Agent.compile_calendar_section(None)), False),
+    ]
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a message for each CPU time or peak memory more than tolerance
+    above the baseline's.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in ("cpu", "peak"):
+            if base[metric] and result[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {result[metric]:.4g} vs baseline {base[metric]:.4g} "
+                                   f"(+{result[metric] / base[metric] - 1:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="Fixture directory.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark; the median is reported.")
+    parser.add_argument("--latency", type=float, help="Fixed replay latency in seconds (default: as recorded).")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Latency variation, e.g. 0.1 for +/-10%%.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the jitter.")
+    parser.add_argument("--only", metavar="NAME", nargs="+", help="Run only these benchmarks.")
+    parser.add_argument("--json", metavar="FILE", help="Write the results to FILE.")
+    parser.add_argument("--baseline", metavar="FILE", help="Fail on regressions against these results.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed increase over the baseline.")
+    parser.add_argument("--verbose", action="store_true", help="Show the briefing's own output.")
+    args = parser.parse_args()
+
+    cassette = load_cassette(args.fixtures)
+    latency = replay.Latency(args.latency, args.jitter, args.seed)
+    results = {}
+    print(f"\n{'benchmark':<26} {'wall ms':>10} {'cpu ms':>10} {'peak MiB':>10}")
+    for name, func, with_latency in benchmarks(cassette):
+        if args.only and name not in args.only:
+            continue
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output, replay.use_cassette(cassette, latency=latency if with_latency else None):
+            result = measure(func, args.repeat)
+        results[name] = result
+        print(f"{name:<26} {result['wall'] * 1000:10.1f} {result['cpu'] * 1000:10.1f} "
+              f"{result['peak'] / 1024 / 1024:10.2f}")
+
+    for miss in sorted(set(cassette.misses)):
+        print(f"No recorded response: {miss}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
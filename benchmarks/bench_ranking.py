@@ -0,0 +1,138 @@
+"""
+Benchmarks the relevance ranking on synthetic articles and emails: ranking
+time against a pure-Python TF-IDF of the same scores, and how many articles
+are left to scrape and how many email tokens are left for the prompt.
+
+Usage:
+    python benchmarks/bench_ranking.py [--items N ...] [--repeat N] [--seed N]
+"""
+from __future__ import print_function
+import argparse
+import collections
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("NEWSAPI_KEY", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import numpy  # noqa: E402
+
+import Agent  # noqa: E402
+
+INTERESTS = ["climate policy", "rust programming", "public transport", "trans rights"]
+TOPIC_WORDS = ("climate policy emissions rust programming compiler public transport rail bus trans rights "
+               "court ruling election senate market shares football transfer film premiere recipe").split()
+FILLER_WORDS = [f"word{i}" for i in range(3000)] + "the a of to in for on with said new after".split()
+
+
+def synthetic_text(rng, words):
+    return " ".join(rng.choice(TOPIC_WORDS) if rng.random() < 0.15 else rng.choice(FILLER_WORDS)
+                    for _ in range(words))
+
+
+def synthetic_articles(count, rng):
+    return [{
+        "title": synthetic_text(rng, 10),
+        "description": synthetic_text(rng, 30),
+        "url": f"https://news.example.com/story/{i}",
+        "source": {"name": "Example News"},
+        "alternates": [{"source": "Other", "url": "https://other.example.com/"}] * rng.choice((0, 0, 0, 1, 3)),
+    } for i in range(count)]
+
+
+def synthetic_emails(count, rng):
+    return [{
+        "id": str(i),
+        "internalDate": str(1700000000000 - i * 60000),
+        "snippet": synthetic_text(rng, 35),
+        "payload": {"headers": [
+            {"name": "Subject", "value": synthetic_text(rng, 8)},
+            {"name": "From", "value": f"Sender {i % 50} <sender{i % 50}@example.com>"},
+            {"name": "Date", "value": "Mon, 3 Feb 2025 09:00:00 +0000"},
+        ]},
+    } for i in range(count)]
+
+
+def python_scores(texts, interests):
+    """
+    The same TF-IDF cosine similarity as Agent.relevance_scores, with
+    dictionaries instead of arrays.
+    """
+    documents = [Agent.RELEVANCE_TOKEN.findall(text.lower()) for text in texts]
+    document_frequency = collections.Counter(token for tokens in documents for token in set(tokens))
+
+    def vector(tokens):
+        weights = {token: (1 + math.log(frequency))
+                   * (math.log((1 + len(documents)) / (1 + document_frequency[token])) + 1)
+                   for token, frequency in collections.Counter(tokens).items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1
+        return {token: weight / norm for token, weight in weights.items()}
+
+    queries = [vector(Agent.RELEVANCE_TOKEN.findall(interest.lower())) for interest in interests]
+    scores = []
+    for tokens in documents:
+        weights = vector(tokens)
+        scores.append(max(sum(weight * query.get(token, 0) for token, weight in weights.items())
+                          for query in queries))
+    return scores
+
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, nargs="+", default=[100, 1000, 5000],
+                        help="Numbers of articles and of emails to rank.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement; the best time is reported.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic data.")
+    args = parser.parse_args()
+
+    print(f"Interests: {', '.join(INTERESTS)}; NEWS_TOP_K={Agent.NEWS_TOP_K} per section, "
+          f"EMAIL_TOP_K={Agent.EMAIL_TOP_K}\n")
+    print(f"{'items':>6} {'kind':<9} {'numpy ms':>9} {'python ms':>10} {'kept':>6} {'tokens before':>14} "
+          f"{'tokens after':>13}")
+    for count in args.items:
+        rng = random.Random(args.seed)
+        articles = synthetic_articles(count, rng)
+        sections = {"top_section": articles[:count // 2], "trans_section": articles[count // 2:]}
+        emails = synthetic_emails(count, rng)
+        alert_senders = ["sender7@example.com"]
+
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                kept_articles = sum(len(kept) for kept in Agent.rank_news_sections(sections, INTERESTS).values())
+                kept_emails = Agent.rank_emails(emails, INTERESTS, alert_senders)
+                article_ms = best_time(lambda: Agent.rank_news_sections(sections, INTERESTS), args.repeat) * 1000
+                email_ms = best_time(lambda: Agent.rank_emails(emails, INTERESTS, alert_senders),
+                                     args.repeat) * 1000
+            finally:
+                sys.stdout = stdout
+        texts = [Agent.article_fingerprint_text(article) for article in articles]
+        python_ms = best_time(lambda: python_scores(texts, INTERESTS), 1) * 1000
+        difference = numpy.abs(numpy.array(python_scores(texts, INTERESTS))
+                               - Agent.relevance_scores(texts, INTERESTS, numpy)).max()
+        assert difference < 1e-9, difference
+
+        print(f"{count:6d} {'articles':<9} {article_ms:9.2f} {python_ms:10.2f} {kept_articles:6d} "
+              f"{'-':>14} {'-':>13}")
+        before = Agent.estimate_tokens(Agent.format_emails_section(emails, alert_senders))
+        after = Agent.estimate_tokens(Agent.format_emails_section(kept_emails, alert_senders,
+                                                                  omitted=count - len(kept_emails)))
+        print(f"{count:6d} {'emails':<9} {email_ms:9.2f} {'':>10} {len(kept_emails):6d} {before:14d} {after:13d}")
+
+
+if __name__ == "__main__":
+    main()
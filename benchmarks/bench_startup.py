@@ -0,0 +1,143 @@
+"""
+Benchmarks startup: how long "import Agent" takes in a fresh interpreter,
+which modules it spends that time on, what the modules it defers cost when
+they are first needed, and how long building a Google API service object
+takes the first time and once it is cached.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat N] [--top N]
+"""
+from __future__ import print_function
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("NEWSAPI_KEY", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+# Modules Agent.py imports only in the functions that use them.
+DEFERRED_MODULES = (
+    "googleapiclient.discovery",
+    "google_auth_oauthlib.flow",
+    "google.auth.transport.requests",
+    "bs4",
+    "lxml.etree",
+    "openai",
+)
+SERVICES = (("gmail", "v1"), ("calendar", "v3"), ("docs", "v1"))
+
+
+def run_python(code, *options):
+    """
+    Runs code in a fresh interpreter from the repository root.
+
+    Returns:
+        (seconds, stdout, stderr): Wall time and output of the run.
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, *options, "-c", code], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, result.stdout, result.stderr
+
+
+def median_run(code, repeat):
+    """
+    Returns the median wall time of running code in a fresh interpreter.
+    """
+    return statistics.median(run_python(code)[0] for _ in range(repeat))
+
+
+def import_times(top):
+    """
+    Returns the top modules by cumulative import time under "import Agent",
+    as (microseconds, module) pairs, from python -X importtime.
+    """
+    _, _, stderr = run_python("import Agent", "-X", "importtime")
+    times = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, module = line.split("|")
+        if cumulative.strip().isdigit():
+            times.append((int(cumulative), module.rstrip()))
+    return sorted(times, reverse=True)[:top]
+
+
+def deferred_import_cost(module):
+    """
+    Returns the seconds taken to import a deferred module after Agent, or
+    None when it is not installed.
+    """
+    code = ("import importlib, sys, time\n"
+            "import Agent\n"
+            f"assert {module!r} not in sys.modules\n"
+            "start = time.perf_counter()\n"
+            f"importlib.import_module({module!r})\n"
+            "print(time.perf_counter() - start)\n")
+    try:
+        return float(run_python(code)[1])
+    except subprocess.CalledProcessError as e:
+        if "ModuleNotFoundError" in e.stderr:
+            return None
+        raise
+
+
+def service_times():
+    """
+    Returns (first, cached) seconds to get each API in SERVICES from
+    google_service: the first call reads the discovery document and builds
+    the service, later ones return the thread's cached object.
+    """
+    import httplib2
+    import Agent
+
+    Agent.TRANSPORT_HOOKS["google"] = lambda creds: httplib2.Http()
+    creds = object()
+    times = []
+    for name, version in SERVICES:
+        start = time.perf_counter()
+        Agent.google_service(name, version, creds)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(100):
+            Agent.google_service(name, version, creds)
+        times.append((f"{name} {version}", first, (time.perf_counter() - start) / 100))
+    Agent.TRANSPORT_HOOKS["google"] = None
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Interpreter starts per measurement; the median is used.")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list.")
+    args = parser.parse_args()
+
+    interpreter = median_run("pass", args.repeat)
+    agent = median_run("import Agent", args.repeat)
+    print(f"\n{'startup':<34} {'wall ms':>10}")
+    print(f"{'python -c pass':<34} {interpreter * 1000:10.1f}")
+    print(f"{'import Agent':<34} {agent * 1000:10.1f}")
+    print(f"{'  of which Agent':<34} {(agent - interpreter) * 1000:10.1f}")
+
+    print(f"\n{'slowest imports (cumulative)':<34} {'ms':>10}")
+    for microseconds, module in import_times(args.top):
+        print(f"{module.strip():<34} {microseconds / 1000:10.1f}")
+
+    print(f"\n{'deferred import':<34} {'ms':>10}")
+    for module in DEFERRED_MODULES:
+        seconds = deferred_import_cost(module)
+        cost = "not installed" if seconds is None else f"{seconds * 1000:.1f}"
+        print(f"{module:<34} {cost:>10}")
+
+    print(f"\n{'google_service':<34} {'first ms':>10} {'cached ms':>10}")
+    for name, first, cached in service_times():
+        print(f"{name:<34} {first * 1000:10.2f} {cached * 1000:10.4f}")
+
+
+if __name__ == "__main__":
+    main()
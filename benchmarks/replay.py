@@ -0,0 +1,567 @@
+"""
+Record/replay transports for running Agent.py without network access.
+
+Recording runs the briefing against the real services and saves every
+response (NewsAPI, article pages, Gmail, Calendar, Docs, OpenAI, Telegram and
+Todoist) to a fixture directory, one JSON file per host. Replaying serves the
+saved responses instead, after the latency each one took when recorded (or a
+fixed --latency) with +/- --jitter, so the pipeline can be run and
+benchmarked without API keys.
+
+Usage:
+    python benchmarks/replay.py record FIXTURES [--async]
+    python benchmarks/replay.py replay FIXTURES [--async] [--latency S] [--jitter F]
+
+Recording makes real calls: it creates a Google Doc, posts to Telegram and
+adds Todoist tasks. Both modes run with a temporary state and cache
+directory, so every run does a full (not incremental) sync. Request headers
+are not saved, and API keys and the Telegram bot token are removed from
+URLs. Timestamps in replayed responses are moved forward by the age of the
+recording, so recorded emails and events still fall in today's window.
+"""
+from __future__ import print_function
+import argparse
+import asyncio
+import base64
+import collections
+import contextlib
+import datetime
+import hashlib
+import http.client
+import io
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qsl, unquote, urlencode, urlparse, urlunparse
+
+import httplib2
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SECRET_PARAMS = {"apikey", "key", "access_token"}
+TELEGRAM_TOKEN = re.compile(r"/bot[^/]+/")
+UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+MULTIPART_BOUNDARY = re.compile(r"={15}\d+==")
+TIMESTAMP = re.compile(r"(?<![\w-])\d{4}-\d{2}-\d{2}(?:T\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:\d{2})?)?(?!\d)")
+GMAIL_INTERNAL_DATE = re.compile(r'("internalDate":\s*")(\d+)(")')
+
+# Hop-by-hop and encoding headers: bodies are saved decoded.
+DROPPED_HEADERS = {"connection", "content-encoding", "content-length", "keep-alive", "set-cookie",
+                   "status", "transfer-encoding", "-content-encoding", "content-location"}
+
+
+def scrub_url(url):
+    """
+    Returns the URL with secrets replaced and its query parameters sorted.
+    """
+    parts = urlparse(url)
+    query = sorted((name, "REDACTED" if name.lower() in SECRET_PARAMS else value)
+                   for name, value in parse_qsl(parts.query, keep_blank_values=True))
+    path = TELEGRAM_TOKEN.sub("/botREDACTED/", parts.path)
+    return urlunparse((parts.scheme, parts.netloc.lower(), path, parts.params, urlencode(query), ""))
+
+
+def _text(body):
+    if body is None:
+        return ""
+    if isinstance(body, bytes):
+        return body.decode("utf-8", "replace")
+    if isinstance(body, str):
+        return body
+    return ""  # A generator or file object; not used by Agent.py.
+
+
+def request_keys(method, url, body):
+    """
+    Returns the keys a request is matched on.
+
+    The exact key covers the method, URL and body, with values that differ
+    on every run (UUIDs, multipart boundaries, dates and times) blanked out.
+    The loose key is used when nothing matches exactly, e.g. for an OpenAI
+    prompt that includes today's news: it covers the method, host, path and
+    the top-level fields of a JSON body, so streamed and plain completions
+    are told apart.
+    """
+    url = scrub_url(url)
+    text = _text(body)
+    normalized = TIMESTAMP.sub("<time>", MULTIPART_BOUNDARY.sub("<boundary>", UUID.sub("<uuid>", text)))
+    request = f"{method.upper()} {TIMESTAMP.sub('<time>', unquote(url))}\n{normalized}"
+    exact = hashlib.sha256(request.encode("utf-8")).hexdigest()
+    try:
+        fields = sorted(json.loads(text)) if text.startswith("{") else []
+    except ValueError:
+        fields = []
+    parts = urlparse(url)
+    loose = " ".join([method.upper(), parts.netloc, parts.path, ",".join(fields)])
+    return exact, loose
+
+
+def request_uuids(body):
+    """
+    Returns the distinct UUIDs in a request body, in order. Clients generate
+    these (Todoist command IDs, Gmail batch Content-IDs) and expect them back.
+    """
+    return list(dict.fromkeys(UUID.findall(_text(body))))
+
+
+def shift_times(text, recorded_at, now):
+    """
+    Moves the ISO dates and times and Gmail internalDate values in a response
+    body forward by the time between recorded_at and now.
+    """
+    delta = now - recorded_at
+    days = datetime.timedelta(days=(now.date() - recorded_at.date()).days)
+
+    def shift(match):
+        value = match.group(0)
+        if "T" not in value:
+            return (datetime.date.fromisoformat(value) + days).isoformat()
+        moved = datetime.datetime.fromisoformat(value.replace("Z", "+00:00")) + delta
+        if value.endswith("Z"):
+            return moved.isoformat().replace("+00:00", "Z")
+        return moved.isoformat()
+
+    text = TIMESTAMP.sub(shift, text)
+    millis = int(delta.total_seconds() * 1000)
+    return GMAIL_INTERNAL_DATE.sub(lambda m: f"{m.group(1)}{int(m.group(2)) + millis}{m.group(3)}", text)
+
+
+class Latency:
+    """
+    The delay before each replayed response: the recorded time (or a fixed
+    number of seconds), varied by +/- jitter as a fraction of it.
+    """
+
+    def __init__(self, seconds=None, jitter=0.0, seed=0):
+        self.seconds = seconds
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self, interaction):
+        seconds = interaction.get("elapsed", 0.0) if self.seconds is None else self.seconds
+        with self._lock:
+            factor = 1 + self._random.uniform(-self.jitter, self.jitter)
+        return max(0.0, seconds * factor)
+
+
+class Cassette:
+    """
+    Recorded interactions, saved as one JSON file per host in a directory.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.interactions = []
+        self.misses = []
+        self._exact = collections.defaultdict(list)
+        self._loose = collections.defaultdict(list)
+        self._served = collections.Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, directory, shift=True):
+        """
+        Loads every fixture file in a directory.
+
+        Args:
+            directory (str): The fixture directory.
+            shift (bool): Move response timestamps forward by the age of the
+                recording.
+        """
+        cassette = cls(directory)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                fixture = json.load(f)
+            recorded_at = datetime.datetime.fromisoformat(fixture["recorded_at"])
+            for interaction in fixture["interactions"]:
+                content_type = {name.lower(): value for name, value in interaction["headers"].items()}.get(
+                    "content-type", "")
+                if shift and ("json" in content_type or "multipart" in content_type):
+                    interaction["body"] = shift_times(interaction["body"], recorded_at, now)
+                cassette._index(interaction)
+        return cassette
+
+    def save(self, directory=None):
+        """
+        Writes the interactions to one file per host, e.g. newsapi.org.json.
+        """
+        directory = directory or self.directory
+        os.makedirs(directory, exist_ok=True)
+        hosts = collections.defaultdict(list)
+        for interaction in self.interactions:
+            hosts[urlparse(interaction["url"]).netloc].append(interaction)
+        recorded_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        for host, interactions in hosts.items():
+            with open(os.path.join(directory, f"{host}.json"), "w", encoding="utf-8") as f:
+                json.dump({"recorded_at": recorded_at, "interactions": interactions}, f, indent=1)
+
+    def add(self, method, url, status, headers, content, elapsed=0.0, request_body=None, exact=True):
+        """
+        Adds an interaction.
+
+        Args:
+            method (str): The request method.
+            url (str): The request URL.
+            status (int): The response status.
+            headers (dict): The response headers.
+            content (bytes or str): The (decoded) response body.
+            elapsed (float): Seconds the response took.
+            request_body: The request body; its UUIDs are mapped to the
+                replayed request's. For a made-up interaction, any body with
+                the same top-level JSON fields.
+            exact (bool): Also match on the exact request; False for made-up
+                interactions that should only match loosely.
+
+        Returns:
+            interaction (dict): The interaction.
+        """
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        try:
+            body, encoding = content.decode("utf-8"), "utf-8"
+        except UnicodeDecodeError:
+            body, encoding = base64.b64encode(content).decode("ascii"), "base64"
+        exact_key, loose_key = request_keys(method, url, request_body)
+        interaction = {
+            "method": method.upper(),
+            "url": scrub_url(url),
+            "key": exact_key if exact else None,
+            "loose_key": loose_key,
+            "uuids": request_uuids(request_body),
+            "status": status,
+            "headers": {name: value for name, value in headers.items() if name.lower() not in DROPPED_HEADERS},
+            "body": body,
+            "encoding": encoding,
+            "elapsed": round(elapsed, 4),
+        }
+        with self._lock:
+            self._index(interaction)
+        return interaction
+
+    def _index(self, interaction):
+        self.interactions.append(interaction)
+        if interaction["key"]:
+            self._exact[interaction["key"]].append(interaction)
+        self._loose[interaction["loose_key"]].append(interaction)
+
+    def match(self, method, url, body):
+        """
+        Returns (interaction, status, headers, content) for a request, or None
+        if nothing was recorded for it. Repeated requests are answered
+        with the recorded responses in turn.
+        """
+        exact_key, loose_key = request_keys(method, url, body)
+        with self._lock:
+            for key, index in ((exact_key, self._exact), (loose_key, self._loose)):
+                candidates = index.get(key)
+                if candidates:
+                    interaction = candidates[self._served[key] % len(candidates)]
+                    self._served[key] += 1
+                    break
+            else:
+                self.misses.append(f"{method.upper()} {scrub_url(url)}")
+                return None
+
+        content = interaction["body"]
+        if interaction["encoding"] == "base64":
+            content = base64.b64decode(content)
+        else:
+            for old, new in zip(interaction["uuids"], request_uuids(body)):
+                content = content.replace(old, new)
+            content = content.encode("utf-8")
+        headers = dict(interaction["headers"], **{"Content-Length": str(len(content))})
+        return interaction, interaction["status"], headers, content
+
+
+# -------------------------
+# requests
+# -------------------------
+def _urllib3_response(status, headers, content):
+    return urllib3.HTTPResponse(body=io.BytesIO(content), headers=headers, status=status,
+                                reason=http.client.responses.get(status, ""), preload_content=False,
+                                decode_content=False)
+
+
+class ReplayAdapter(HTTPAdapter):
+    """
+    A requests adapter answering from a cassette. Requests with no recorded
+    response fail with a ConnectionError.
+    """
+
+    def __init__(self, cassette, latency):
+        self.cassette = cassette
+        self.latency = latency
+        super().__init__()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        matched = self.cassette.match(request.method, request.url, request.body)
+        if matched is None:
+            raise requests.exceptions.ConnectionError(f"No recorded response for {request.method} {request.url}",
+                                                      request=request)
+        interaction, status, headers, content = matched
+        time.sleep(self.latency.delay(interaction))
+        return self.build_response(request, _urllib3_response(status, headers, content))
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    A requests adapter that sends requests through another adapter and
+    records the responses.
+    """
+
+    def __init__(self, adapter, cassette):
+        self.adapter = adapter
+        self.cassette = cassette
+        super().__init__()
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        response = self.adapter.send(request, **kwargs)
+        content = response.content  # A streamed body is read here, and kept for the caller.
+        self.cassette.add(request.method, request.url, response.status_code, response.headers, content,
+                          time.perf_counter() - start, request.body)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+# -------------------------
+# httpx
+# -------------------------
+def _httpx():
+    import httpx
+    return httpx
+
+
+class ReplayTransport:
+    """
+    An httpx async transport answering from a cassette.
+    """
+
+    def __init__(self, cassette, latency):
+        self.cassette = cassette
+        self.latency = latency
+
+    async def handle_async_request(self, request):
+        httpx = _httpx()
+        body = await request.aread()
+        matched = self.cassette.match(request.method, str(request.url), body)
+        if matched is None:
+            raise httpx.ConnectError(f"No recorded response for {request.method} {request.url}", request=request)
+        interaction, status, headers, content = matched
+        await asyncio.sleep(self.latency.delay(interaction))
+        return httpx.Response(status, headers=headers, content=content, request=request)
+
+    async def aclose(self):
+        pass
+
+
+class RecordingTransport:
+    """
+    An httpx async transport that sends requests through another transport
+    and records the responses.
+    """
+
+    def __init__(self, transport, cassette):
+        self.transport = transport
+        self.cassette = cassette
+
+    async def handle_async_request(self, request):
+        httpx = _httpx()
+        start = time.perf_counter()
+        body = await request.aread()
+        response = await self.transport.handle_async_request(request)
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
+        interaction = self.cassette.add(request.method, str(request.url), response.status_code, response.headers,
+                                        content, time.perf_counter() - start, body)
+        return httpx.Response(response.status_code, headers=interaction["headers"], content=content,
+                              request=request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+# -------------------------
+# Google API client (httplib2)
+# -------------------------
+class ReplayHttp:
+    """
+    An httplib2.Http stand-in answering Google API calls from a cassette.
+    """
+
+    def __init__(self, cassette, latency):
+        self.cassette = cassette
+        self.latency = latency
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        matched = self.cassette.match(method, uri, body)
+        if matched is None:
+            raise httplib2.HttpLib2Error(f"No recorded response for {method} {uri}")
+        interaction, status, headers, content = matched
+        time.sleep(self.latency.delay(interaction))
+        return httplib2.Response(dict(headers, status=str(status))), content
+
+    def close(self):
+        pass
+
+
+class RecordingHttp:
+    """
+    Sends Google API calls through an authorized httplib2.Http and records
+    the responses.
+    """
+
+    def __init__(self, http, cassette):
+        self.http = http
+        self.cassette = cassette
+
+    @property
+    def credentials(self):
+        # Batch requests read the credentials off the http object.
+        return self.http.credentials
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        start = time.perf_counter()
+        response, content = self.http.request(uri, method=method, body=body, headers=headers,
+                                              redirections=redirections, connection_type=connection_type)
+        self.cassette.add(method, uri, response.status, dict(response), content, time.perf_counter() - start, body)
+        return response, content
+
+    def close(self):
+        self.http.close()
+
+
+@contextlib.contextmanager
+def use_cassette(cassette, record=False, latency=None):
+    """
+    Sends all of Agent.py's HTTP traffic through a cassette while active.
+
+    Args:
+        cassette (Cassette): Where responses are recorded to or replayed from.
+        record (bool): Record real responses instead of replaying.
+        latency (Latency): Replay delays; none by default.
+    """
+    import Agent
+
+    latency = latency or Latency(0)
+    if record:
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.http import build_http
+        hooks = {
+            "requests": lambda adapter: RecordingAdapter(adapter, cassette),
+            "httpx": lambda transport: RecordingTransport(transport, cassette),
+            "google": lambda creds: RecordingHttp(AuthorizedHttp(creds, http=build_http()), cassette),
+        }
+    else:
+        hooks = {
+            "requests": lambda adapter: ReplayAdapter(cassette, latency),
+            "httpx": lambda transport: ReplayTransport(cassette, latency),
+            "google": lambda creds: ReplayHttp(cassette, latency),
+        }
+    saved_hooks = dict(Agent.TRANSPORT_HOOKS)
+    get_credentials = Agent.get_credentials
+    Agent.close_sessions()
+    Agent.TRANSPORT_HOOKS.update(hooks)
+    if not record:
+        Agent.get_credentials = lambda: None  # Replayed Google calls need no token.
+    try:
+        yield cassette
+    finally:
+        Agent.close_sessions()
+        Agent.TRANSPORT_HOOKS.update(saved_hooks)
+        Agent.get_credentials = get_credentials
+
+
+@contextlib.contextmanager
+def fresh_state():
+    """
+    Points Agent.py's state and cache at a new temporary directory while
+    active, so a run starts cold: full syncs, no cached articles or
+    completions, and full rate-limit buckets.
+    """
+    import Agent
+
+    directory = tempfile.mkdtemp(prefix="agent-bench-")
+    saved = Agent.STATE_DIR, Agent.CACHE_DIR
+    with Agent._cache_lock:
+        if Agent._cache_conn is not None:
+            Agent._cache_conn.close()
+        Agent._cache_conn = None
+        Agent.STATE_DIR = os.path.join(directory, "state")
+        Agent.CACHE_DIR = os.path.join(directory, "cache")
+    with Agent._buckets_lock:
+        Agent._buckets.clear()
+    try:
+        yield directory
+    finally:
+        with Agent._cache_lock:
+            if Agent._cache_conn is not None:
+                Agent._cache_conn.close()
+            Agent._cache_conn = None
+            Agent.STATE_DIR, Agent.CACHE_DIR = saved
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def set_offline_environment():
+    """
+    Sets placeholder keys, so Agent.py can be imported and every integration
+    runs, without a .env file.
+    """
+    for name, value in (("NEWSAPI_KEY", "replay"), ("OPENAI_API_KEY", "replay"),
+                        ("TELEGRAM_BOT_TOKEN", "replay"), ("TELEGRAM_CHAT_ID", "1"),
+                        ("TODOIST_API_KEY", "replay"), ("ALERT_SENDERS", "alerts@example.com")):
+        os.environ.setdefault(name, value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=("record", "replay"))
+    parser.add_argument("fixtures", help="Fixture directory.")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Run Agent.py with --async.")
+    parser.add_argument("--latency", type=float, help="Fixed replay latency in seconds (default: as recorded).")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Latency variation, e.g. 0.2 for +/-20%%.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the jitter.")
+    args = parser.parse_args()
+
+    if args.mode == "replay":
+        set_offline_environment()
+    import Agent
+
+    argv = ["--async"] if args.use_async else []
+    if args.mode == "record":
+        cassette = Cassette(args.fixtures)
+        with fresh_state(), use_cassette(cassette, record=True):
+            Agent.main(argv)
+        cassette.save()
+        print(f"Recorded {len(cassette.interactions)} responses to {args.fixtures}")
+        return
+
+    cassette = Cassette.load(args.fixtures)
+    latency = Latency(args.latency, args.jitter, args.seed)
+    start = time.perf_counter()
+    with fresh_state(), use_cassette(cassette, latency=latency):
+        Agent.main(argv)
+    print(f"Replayed {len(cassette.interactions)} recorded responses in {time.perf_counter() - start:.2f} s")
+    for miss in cassette.misses:
+        print(f"No recorded response: {miss}")
+
+
+if __name__ == "__main__":
+    main()
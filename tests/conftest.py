@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("NEWSAPI_KEY", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import Agent  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def agent_dirs(tmp_path, monkeypatch):
+    """
+    Gives each test its own state and cache directories and full rate-limit
+    buckets.
+    """
+    with Agent._cache_lock:
+        if Agent._cache_conn is not None:
+            Agent._cache_conn.close()
+        Agent._cache_conn = None
+    monkeypatch.setattr(Agent, "STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.setattr(Agent, "CACHE_DIR", str(tmp_path / "cache"))
+    with Agent._buckets_lock:
+        Agent._buckets.clear()
+    yield tmp_path
+    with Agent._cache_lock:
+        if Agent._cache_conn is not None:
+            Agent._cache_conn.close()
+        Agent._cache_conn = None
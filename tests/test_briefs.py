@@ -0,0 +1,42 @@
+import json
+
+import Agent
+
+
+def brief_reply(summary="Summary.", digest="Digest.", tasks=("Reply to Ann",)):
+    return json.dumps({"summary": summary, "digest": digest, "tasks": list(tasks)})
+
+
+def test_parse_brief():
+    brief = Agent.parse_brief(brief_reply(summary=" Summary. ", tasks=["- Reply to Ann", "Reply to Ann", "Pay rent"]))
+    assert brief == {"summary": "Summary.", "digest": "Digest.", "tasks": ["Reply to Ann", "Pay rent"],
+                     "structured": True}
+
+
+def test_parse_brief_rejects_other_replies():
+    assert Agent.parse_brief("") is None
+    assert Agent.parse_brief("Just a summary.") is None
+    assert Agent.parse_brief(json.dumps({"digest": "No summary"})) is None
+    assert Agent.parse_brief(json.dumps(["summary"])) is None
+
+
+def test_brief_tasks_and_digest():
+    briefs = [Agent.parse_brief(brief_reply(digest="One.", tasks=["A", "B"])),
+              Agent.parse_brief(brief_reply(digest="Two.", tasks=["B", "C"]))]
+    assert Agent.brief_tasks(briefs) == ["A", "B", "C"]
+    assert Agent.brief_digest(briefs) == "One.\n\nTwo."
+
+
+def test_text_briefs_fall_back():
+    briefs = [Agent.parse_brief(brief_reply()), Agent.text_brief("Plain summary.")]
+    assert Agent.brief_tasks(briefs) is None
+    assert Agent.brief_digest(briefs) == ""
+    assert Agent.brief_tasks([Agent.parse_brief(brief_reply()), None]) is None
+
+
+def test_summarize_brief_falls_back_to_text(monkeypatch):
+    monkeypatch.setattr(Agent, "chat_completion", lambda prompt, **params: "not json")
+    monkeypatch.setattr(Agent, "summarize_text", lambda text, prompt, budget=None: "Plain summary.")
+    brief = Agent.summarize_brief("Some emails.", "Summarize:")
+    assert brief == Agent.text_brief("Plain summary.")
+    assert Agent.brief_tasks([brief]) is None
@@ -0,0 +1,61 @@
+import itertools
+
+import pytest
+
+import Agent
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Replaces time.time with a clock that ticks one second per call, so
+    entries never share an access time.
+    """
+    ticks = itertools.count(1_000_000)
+    monkeypatch.setattr(Agent.time, "time", lambda: float(next(ticks)))
+
+
+def test_put_and_get_round_trip():
+    Agent.cache_put("article", "https://example.com/a", {"text": "body"}, etag='"v1"')
+    entry = Agent.cache_get("article", "https://example.com/a")
+    assert entry["value"] == {"text": "body"}
+    assert entry["etag"] == '"v1"'
+    assert Agent.cache_get("news", "https://example.com/a") is None
+
+
+def test_ttl_treats_old_entries_as_missing(clock):
+    Agent.cache_put("news", "q", [1, 2])
+    assert Agent.cache_get("news", "q", ttl=0.5) is None
+    assert Agent.cache_get("news", "q", ttl=60)["value"] == [1, 2]
+
+
+def test_touch_refreshes_stored_at(clock):
+    Agent.cache_put("article", "a", "old")
+    stored_at = Agent.cache_get("article", "a")["stored_at"]
+    Agent.cache_touch("article", "a")
+    assert Agent.cache_get("article", "a")["stored_at"] > stored_at
+
+
+def test_evicts_least_recently_used(clock, monkeypatch):
+    monkeypatch.setattr(Agent, "CACHE_MAX_ENTRIES", 2)
+    Agent.cache_put("article", "a", 1)
+    Agent.cache_put("article", "b", 2)
+    Agent.cache_get("article", "a")  # "b" is now the least recently used.
+    Agent.cache_put("article", "c", 3)
+    assert Agent.cache_get("article", "b") is None
+    assert Agent.cache_get("article", "a")["value"] == 1
+    assert Agent.cache_get("article", "c")["value"] == 3
+
+
+def test_evicts_by_size(clock, monkeypatch):
+    monkeypatch.setattr(Agent, "CACHE_MAX_BYTES", 20)
+    Agent.cache_put("article", "a", "x" * 10)
+    Agent.cache_put("article", "b", "y" * 10)
+    assert Agent.cache_get("article", "a") is None
+    assert Agent.cache_get("article", "b") is not None
+
+
+def test_disabled_cache_stores_nothing(monkeypatch):
+    monkeypatch.setattr(Agent, "CACHE_ENABLED", False)
+    Agent.cache_put("article", "a", 1)
+    assert Agent.cache_get("article", "a") is None
@@ -0,0 +1,116 @@
+import datetime
+import threading
+
+import pytest
+
+import Agent
+
+NOW = datetime.datetime.now(datetime.timezone.utc)
+
+
+def utc(delta):
+    return (NOW + delta).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def event(event_id, start_hours, hours=1):
+    return {"id": event_id, "summary": event_id,
+            "start": {"dateTime": utc(datetime.timedelta(hours=start_hours))},
+            "end": {"dateTime": utc(datetime.timedelta(hours=start_hours + hours))}}
+
+
+class FakeCalendar:
+    """
+    Answers events().list() with full or incremental pages and records the
+    parameters and the thread of each call.
+    """
+
+    def __init__(self, full, changes=()):
+        self.full = full
+        self.changes = list(changes)
+        self.calls = []
+
+    def events(self):
+        return self
+
+    def list(self, **params):
+        self.calls.append((params, threading.current_thread().name))
+        return self
+
+    def execute(self):
+        params = self.calls[-1][0]
+        if params.get("syncToken") == "expired":
+            import httplib2
+            from googleapiclient.errors import HttpError
+            raise HttpError(httplib2.Response({"status": 410}), b"")
+        if params.get("syncToken"):
+            return {"items": self.changes, "nextSyncToken": "next"}
+        return {"items": self.full, "nextSyncToken": "first"}
+
+
+@pytest.fixture(autouse=True)
+def needs_google():
+    pytest.importorskip("googleapiclient")
+
+
+def test_full_sync_is_bounded_by_the_horizon():
+    service = FakeCalendar([event("soon", 2), event("far", 24 * 40)])
+    state = Agent.sync_calendar(service, "primary", {})
+    params = service.calls[0][0]
+    assert params["maxResults"] == 2500
+    assert params["timeMax"] == state["horizon"]
+    assert sorted(state["events"]) == ["soon"]
+
+
+def test_incremental_sync_applies_changes():
+    service = FakeCalendar([event("a", 2), event("b", 3)],
+                           changes=[{"id": "a", "status": "cancelled"}, event("c", 4)])
+    state = Agent.sync_calendar(service, "primary", {})
+    state = Agent.sync_calendar(service, "primary", state)
+    assert service.calls[-1][0]["syncToken"] == "first"
+    assert sorted(state["events"]) == ["b", "c"]
+    assert state["sync_token"] == "next"
+
+
+def test_expired_sync_token_falls_back_to_a_full_sync():
+    service = FakeCalendar([event("a", 2)])
+    state = Agent.sync_calendar(service, "primary", {})
+    state = Agent.sync_calendar(service, "primary", dict(state, sync_token="expired"))
+    assert "syncToken" not in service.calls[-1][0]
+    assert sorted(state["events"]) == ["a"] and state["sync_token"] == "first"
+
+
+def test_full_sync_is_redone_when_the_horizon_runs_out():
+    service = FakeCalendar([event("a", 2)])
+    state = Agent.sync_calendar(service, "primary", {})
+    state["horizon"] = utc(datetime.timedelta(days=3))
+    Agent.sync_calendar(service, "primary", state)
+    assert "syncToken" not in service.calls[-1][0]
+
+
+def test_all_day_events_start_at_local_midnight():
+    local_midnight = datetime.datetime(2026, 3, 1).astimezone()
+    expected = local_midnight.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    assert Agent._event_time_utc({"date": "2026-03-01"}) == expected
+    assert Agent._event_time_utc({"dateTime": "2026-03-01T10:00:00+02:00"}) == "2026-03-01T08:00:00Z"
+
+
+def test_events_in_window():
+    events = {entry["summary"]: entry for entry in (Agent.calendar_index_entry(event(name, start))
+                                                    for name, start in (("past", -5), ("now", -0.5),
+                                                                        ("today", 3), ("tomorrow", 30)))}
+    window = Agent.events_in_window(events, utc(datetime.timedelta()), utc(datetime.timedelta(days=1)))
+    assert [entry["summary"] for entry in window] == ["now", "today"]
+
+
+def test_calendars_reuse_long_lived_threads(monkeypatch):
+    service = FakeCalendar([event("a", 2)])
+    monkeypatch.setattr(Agent, "google_service", lambda name, version, creds: service)
+    Agent.fetch_calendar_events(None, ["primary"], utc(datetime.timedelta()), utc(datetime.timedelta(days=1)))
+    assert service.calls[-1][1] == threading.current_thread().name
+
+    for _ in range(3):
+        Agent.fetch_calendar_events(None, ["primary", "work"], utc(datetime.timedelta()),
+                                    utc(datetime.timedelta(days=1)))
+    threads = {thread for _, thread in service.calls[1:]}
+    assert all(thread.startswith("calendar") for thread in threads)
+    assert len(threads) <= Agent.CALENDAR_MAX_WORKERS
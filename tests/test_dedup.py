@@ -0,0 +1,41 @@
+import Agent
+
+
+def article(title, url, source="Wire", description=""):
+    return {"title": f"{title} - {source}", "url": url, "source": {"name": source}, "description": description}
+
+
+def test_canonical_url_ignores_tracking_and_mobile_variants():
+    expected = "example.com/news/story?id=7"
+    assert Agent.canonical_url("https://www.example.com/news/story/?id=7&utm_source=x#top") == expected
+    assert Agent.canonical_url("http://m.EXAMPLE.com/news/story/amp?fbclid=1&id=7") == expected
+    assert Agent.canonical_url("") == ""
+
+
+def test_simhash_distance_reflects_similarity():
+    base = Agent.simhash("Central bank raises interest rates by half a point to fight inflation")
+    close = Agent.simhash("Central bank raises interest rates by half a point to fight rising inflation")
+    far = Agent.simhash("Local team wins the championship after dramatic overtime final")
+    assert bin(base ^ close).count("1") <= Agent.NEWS_DEDUP_DISTANCE
+    assert bin(base ^ far).count("1") > Agent.NEWS_DEDUP_DISTANCE
+
+
+def test_dedupe_keeps_first_copy_and_records_alternates():
+    story = "Central bank raises interest rates by half a point to fight inflation"
+    sections = {
+        "topic": [article(story, "https://www.example.com/a?utm_medium=rss", "Example")],
+        "general": [
+            article(story, "https://example.com/a", "Example"),
+            article(story + " again", "https://other.org/b", "Other"),
+            article("Local team wins the championship", "https://sport.net/c", "Sport"),
+        ],
+    }
+    deduped = Agent.dedupe_articles(sections)
+    assert [a["url"] for a in deduped["topic"]] == ["https://www.example.com/a?utm_medium=rss"]
+    assert [a["url"] for a in deduped["general"]] == ["https://sport.net/c"]
+    assert deduped["topic"][0]["alternates"] == [{"source": "Other", "url": "https://other.org/b"}]
+
+
+def test_articles_without_text_are_not_clustered():
+    sections = {"general": [{"title": None, "url": "https://a.com/1"}, {"title": "", "url": "https://b.com/2"}]}
+    assert len(Agent.dedupe_articles(sections)["general"]) == 2
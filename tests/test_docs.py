@@ -0,0 +1,106 @@
+import Agent
+
+
+def builder(markdown):
+    result = Agent.DocRequestBuilder()
+    result.feed(markdown)
+    result.close()
+    return result
+
+
+class FakeDocs:
+    """
+    Stands in for the Docs service: documents().get() returns document and
+    batchUpdate bodies are recorded.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.updates = []
+
+    def documents(self):
+        return self
+
+    def get(self, documentId, fields):
+        return Request(self.document)
+
+    def batchUpdate(self, documentId, body):
+        self.updates.append(body["requests"])
+        return Request({})
+
+
+class Request:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        return self.result
+
+
+def named_range(start, end):
+    return {"namedRanges": [{"ranges": [{"startIndex": start, "endIndex": end}]}]}
+
+
+def test_publish_keeps_other_named_ranges(monkeypatch):
+    sections = [("top", builder("# Top\n")), ("emails", builder("Emails\n"))]
+    docs = FakeDocs({
+        "namedRanges": {"briefing:top": named_range(1, 5), "briefing:emails": named_range(5, 12),
+                        "user bookmark": named_range(2, 4)},
+        "body": {"content": [{"endIndex": 13}]},
+    })
+    monkeypatch.setattr(Agent, "google_service", lambda name, version, creds: docs)
+    Agent.save_state(Agent.DOC_STATE_FILE, {"document_id": "doc", "sections": {"top": "old", "emails": "old"}})
+
+    Agent.publish_sections(None, "doc", sections)
+
+    requests_body = docs.updates[0]
+    deleted = {request["deleteNamedRange"]["name"] for request in requests_body if "deleteNamedRange" in request}
+    created = [request["createNamedRange"] for request in requests_body if "createNamedRange" in request]
+    assert deleted == {"briefing:top", "briefing:emails"}
+    assert [(named["name"], named["range"]) for named in created] == [
+        ("briefing:top", {"startIndex": 1, "endIndex": 5}),
+        ("briefing:emails", {"startIndex": 5, "endIndex": 12}),
+    ]
+
+
+def test_publish_rewrites_without_own_ranges(monkeypatch):
+    docs = FakeDocs({"namedRanges": {"user bookmark": named_range(2, 4)}, "body": {"content": [{"endIndex": 9}]}})
+    monkeypatch.setattr(Agent, "google_service", lambda name, version, creds: docs)
+    Agent.save_state(Agent.DOC_STATE_FILE, {"document_id": "doc", "sections": {"top": "old"}})
+
+    Agent.publish_sections(None, "doc", [("top", builder("Top\n"))])
+
+    requests_body = docs.updates[0]
+    assert requests_body[0] == {"deleteContentRange": {"range": {"startIndex": 1, "endIndex": 8}}}
+    assert not any("deleteNamedRange" in request for request in requests_body)
+
+
+def test_requests_use_utf16_indexes_and_inline_styles():
+    requests_body = Agent.markdown_to_requests("# Title 😀\n**Bold** and [a link](https://example.com)\n")
+    assert requests_body[0] == {"insertText": {"location": {"index": 1},
+                                               "text": "Title 😀\nBold and a link\n"}}
+    assert requests_body[1]["updateParagraphStyle"]["range"] == {"startIndex": 1, "endIndex": 10}
+    styles = [(request["updateTextStyle"]["range"], request["updateTextStyle"]["textStyle"])
+              for request in requests_body[2:]]
+    assert styles == [({"startIndex": 10, "endIndex": 14}, {"bold": True}),
+                      ({"startIndex": 19, "endIndex": 25}, {"link": {"url": "https://example.com"}})]
+
+
+def test_adjacent_headings_share_one_request():
+    requests_body = Agent.markdown_to_requests("### One\n### Two\nText\n### Three\n")
+    headings = [request["updateParagraphStyle"]["range"] for request in requests_body
+                if "updateParagraphStyle" in request]
+    assert headings == [{"startIndex": 1, "endIndex": 9}, {"startIndex": 14, "endIndex": 20}]
+
+
+def test_merge_ranges():
+    ranges = [(0, 4, "a"), (2, 6, "b"), (4, 8, "a"), (10, 12, "a"), (6, 7, "b")]
+    assert Agent._merge_ranges(ranges) == [(0, 8, "a"), (2, 7, "b"), (10, 12, "a")]
+
+
+def test_sections_assemble_at_an_offset():
+    sections = [builder("## One\n"), builder("**two**\n")]
+    requests_body = Agent.assemble_requests(sections, 5)
+    assert requests_body[0]["insertText"] == {"location": {"index": 5}, "text": "One\ntwo\n"}
+    assert requests_body[1]["updateParagraphStyle"]["range"] == {"startIndex": 5, "endIndex": 9}
+    assert requests_body[2]["updateTextStyle"]["range"] == {"startIndex": 9, "endIndex": 12}
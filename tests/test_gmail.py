@@ -0,0 +1,130 @@
+import time
+
+import pytest
+
+import Agent
+
+NOW_MS = int(time.time() * 1000)
+
+
+class HttpError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = type("Response", (), {"status": status})()
+
+
+class Request:
+    def __init__(self, func):
+        self.func = func
+
+    def execute(self):
+        return self.func()
+
+
+class Batch:
+    def __init__(self, callback):
+        self.callback = callback
+        self.items = []
+
+    def add(self, request, request_id):
+        self.items.append((request_id, request))
+
+    def execute(self):
+        for request_id, request in self.items:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except Exception as e:
+                self.callback(request_id, None, e)
+
+
+class FakeGmail:
+    """
+    A mailbox whose first listing holds "m1"; history pages are taken from
+    self.history in order, and messages in self.errors fail with that status.
+    """
+
+    def __init__(self, history=()):
+        self.history_pages = list(history)
+        self.errors = {}
+        self.history_types = None
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def history(self):
+        return self
+
+    def getProfile(self, userId):
+        return Request(lambda: {"historyId": "100"})
+
+    def list(self, userId, **params):
+        if "startHistoryId" in params:
+            self.history_types = params["historyTypes"]
+            page = self.history_pages.pop(0) if self.history_pages else []
+            return Request(lambda: {"history": page, "historyId": "200"})
+        return Request(lambda: {"messages": [{"id": "m1"}]})
+
+    def get(self, userId, id, format, metadataHeaders):
+        def fetch():
+            if id in self.errors:
+                raise HttpError(self.errors[id])
+            return {"id": id, "internalDate": str(NOW_MS), "snippet": id,
+                    "payload": {"headers": [{"name": "Subject", "value": id}]}}
+        return Request(fetch)
+
+    def new_batch_http_request(self, callback):
+        return Batch(callback)
+
+
+def added(*ids, labels=("INBOX",)):
+    return {"messagesAdded": [{"message": {"id": msg_id, "labelIds": list(labels)}} for msg_id in ids]}
+
+
+@pytest.fixture(autouse=True)
+def gmail_setup(monkeypatch):
+    pytest.importorskip("googleapiclient")
+    monkeypatch.setattr(Agent, "GMAIL_BATCH_ATTEMPTS", 1)
+
+
+def ids(messages):
+    return [message["id"] for message in messages]
+
+
+def test_history_adds_and_removes_messages():
+    service = FakeGmail([[added("m2", "m3"), added("d1", labels=["DRAFT"]),
+                          {"labelsAdded": [{"message": {"id": "m1"}, "labelIds": ["TRASH"]}]},
+                          {"messagesDeleted": [{"message": {"id": "m3"}}]}]])
+    assert ids(Agent.sync_gmail(service)) == ["m1"]
+    assert sorted(ids(Agent.sync_gmail(service))) == ["m2"]
+    assert "labelAdded" in service.history_types
+
+
+def test_unfetched_messages_are_retried():
+    service = FakeGmail([[added("m2")]])
+    service.errors["m2"] = 503
+    Agent.sync_gmail(service)
+    Agent.sync_gmail(service)
+    assert list(Agent.load_state(Agent.GMAIL_STATE_FILE)["pending"]) == ["m2"]
+    del service.errors["m2"]
+    assert sorted(ids(Agent.sync_gmail(service))) == ["m1", "m2"]
+    assert Agent.load_state(Agent.GMAIL_STATE_FILE)["pending"] == {}
+
+
+def test_missing_messages_are_not_retried():
+    service = FakeGmail([[added("m2")]])
+    Agent.sync_gmail(service)
+    service.errors["m2"] = 404
+    assert ids(Agent.sync_gmail(service)) == ["m1"]
+    assert Agent.load_state(Agent.GMAIL_STATE_FILE)["pending"] == {}
+
+
+def test_format_emails_section_flags_alert_senders():
+    message = {"snippet": "Hi", "payload": {"headers": [{"name": "From", "value": "Ann <ANN@example.com>"},
+                                                        {"name": "Subject", "value": "Lunch"}]}}
+    text = Agent.format_emails_section([message], ["ann@example.com"], omitted=2)
+    assert "Lunch" in text and "ALERT" in text.upper()
+    assert "2 less relevant emails are not listed." in text
+    assert Agent.extract_email_address("Ann <ann@example.com>") == "ann@example.com"
@@ -0,0 +1,60 @@
+import pytest
+
+import Agent
+
+# A slow refill (one token per 50s) keeps the elapsed test time negligible.
+LIMIT, PERIOD = 2, 100
+
+
+def test_bucket_spreads_a_burst():
+    bucket = Agent.TokenBucket(LIMIT, PERIOD)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(50, abs=0.1)
+    assert bucket.reserve() == pytest.approx(100, abs=0.1)
+
+
+def test_oversized_request_waits_for_a_full_bucket():
+    bucket = Agent.TokenBucket(LIMIT, PERIOD)
+    assert bucket.reserve(10) == 0.0
+    assert bucket.reserve(10) == pytest.approx(100, abs=0.1)
+
+
+def test_observe_trusts_a_lower_remaining_count():
+    bucket = Agent.TokenBucket(LIMIT, PERIOD)
+    bucket.observe(remaining=0, reset=30)
+    assert bucket.reserve() == pytest.approx(50, abs=0.1)
+    bucket.observe(remaining=5)  # Higher than our own count: ignored.
+    assert bucket.tokens < 0
+
+
+def test_observe_rescales_to_the_upstream_limit():
+    bucket = Agent.TokenBucket(LIMIT, PERIOD)
+    bucket.observe(limit=4)
+    assert bucket.capacity == 4
+    assert bucket.rate == pytest.approx(4 / PERIOD)
+
+
+def test_pause_holds_every_request():
+    bucket = Agent.TokenBucket(LIMIT, PERIOD)
+    bucket.pause(20)
+    assert bucket.reserve() == pytest.approx(20, abs=0.1)
+
+
+def test_buckets_are_per_profile_for_per_user_quotas():
+    shared = Agent.rate_limit_buckets("newsapi.org")
+    assert Agent.rate_limit_buckets("newsapi.org") is shared
+    first = Agent.rate_limit_buckets(Agent.GMAIL_HOST)
+    token = Agent._current_profile.set({"path": "profiles/other.json", "settings": {}})
+    try:
+        assert Agent.rate_limit_buckets(Agent.GMAIL_HOST) is not first
+    finally:
+        Agent._current_profile.reset(token)
+    assert Agent.rate_limit_buckets("unknown.example") == {}
+
+
+def test_reserve_takes_the_longest_delay():
+    host = "api.openai.com"
+    Agent.rate_limit_buckets(host)["tokens"].pause(5)
+    assert Agent.reserve_rate_limit(host, {"requests": 1, "tokens": 10}) == pytest.approx(5, abs=0.1)
+    assert Agent.reserve_rate_limit(host, {"requests": 1}) == 0.0
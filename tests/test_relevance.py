@@ -0,0 +1,49 @@
+import pytest
+
+import Agent
+
+np = pytest.importorskip("numpy")
+
+
+def article(title, alternates=0):
+    return {"title": title, "description": "", "source": {"name": "Wire"},
+            "alternates": [{"source": "Other", "url": ""}] * alternates}
+
+
+def email(subject, sender="someone@example.com"):
+    return {"snippet": "", "payload": {"headers": [{"name": "Subject", "value": subject},
+                                                   {"name": "From", "value": sender}]}}
+
+
+def test_scores_favour_matching_texts():
+    scores = Agent.relevance_scores(["rust compiler release", "football results", ""], ["rust"], np)
+    assert scores[0] > 0 and scores[1] == 0 and scores[2] == 0
+    assert Agent.relevance_scores(["anything"], [], np).tolist() == [0.0]
+
+
+def test_top_k_keeps_original_order_and_prefers_earlier_ties():
+    assert Agent.top_k(["a", "b", "c", "d"], [0.1, 0.9, 0.1, 0.5], 2, np) == ["b", "d"]
+    assert Agent.top_k(["a", "b", "c"], [0.0, 0.0, 0.0], 2, np) == ["a", "b"]
+    assert Agent.top_k(["a", "b"], [0.0, 1.0], 0, np) == ["a", "b"]
+
+
+def test_rank_news_sections_keeps_everything_without_interests():
+    sections = {"general": [article("one"), article("two"), article("three")]}
+    assert Agent.rank_news_sections(sections, [], k=1) is sections
+
+
+def test_rank_news_sections_keeps_top_k_per_section():
+    sections = {
+        "tech": [article("football scores"), article("new rust compiler"), article("rust borrow checker")],
+        "general": [article("weather today"), article("election news", alternates=3)],
+    }
+    ranked = Agent.rank_news_sections(sections, ["rust compiler"], k=1)
+    assert [a["title"] for a in ranked["tech"]] == ["new rust compiler"]
+    assert [a["title"] for a in ranked["general"]] == ["election news"]
+
+
+def test_rank_emails_boosts_alert_senders():
+    messages = [email("rust meetup"), email("invoice", "Boss <boss@example.com>"), email("newsletter")]
+    kept = Agent.rank_emails(messages, ["rust"], ["BOSS@example.com"], k=2)
+    assert [Agent.email_ranking_text(message).split()[0] for message in kept] == ["rust", "invoice"]
+    assert Agent.rank_emails(messages, [], [], k=1) is messages
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import Agent
+
+
+def sse_event(content):
+    return f"data: {json.dumps({'choices': [{'delta': {'content': content}}]})}\n\n".encode()
+
+
+@pytest.fixture
+def slow_openai(monkeypatch):
+    """
+    Serves a chat completion stream that sends "partial" and then stalls,
+    or trickles a space every 0.2s, for 5 seconds.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        trickle = False
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def chunk(data):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            try:
+                chunk(sse_event("partial"))
+                for _ in range(25):
+                    time.sleep(0.2)
+                    if Handler.trickle:
+                        chunk(sse_event(" "))
+                chunk(b"data: [DONE]\n\n")
+                chunk(b"")
+            except OSError:
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(Agent, "OPENAI_URL", f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions")
+    yield Handler
+    server.shutdown()
+
+
+@pytest.mark.parametrize("trickle", [False, True])
+def test_stream_stops_at_deadline(slow_openai, trickle, capsys):
+    slow_openai.trickle = trickle
+    start = time.monotonic()
+    content, complete = Agent._stream_chat_completion({"messages": []}, deadline=start + 1)
+    elapsed = time.monotonic() - start
+    assert content == "partial"
+    assert not complete
+    assert elapsed < 1.5
+    assert "Summary deadline reached" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("trickle", [False, True])
+def test_async_stream_stops_at_deadline(slow_openai, trickle, capsys):
+    pytest.importorskip("httpx")
+    slow_openai.trickle = trickle
+    start = time.monotonic()
+    content, complete = asyncio.run(Agent._async_stream_chat_completion({"messages": []}, deadline=start + 1))
+    elapsed = time.monotonic() - start
+    assert content == "partial"
+    assert not complete
+    assert elapsed < 1.5
+    assert "Summary deadline reached" in capsys.readouterr().out
+
+
+def test_parse_sse_line():
+    assert Agent.parse_sse_line("data: [DONE]") == (True, None, None)
+    assert Agent.parse_sse_line(sse_event("hi").decode().strip()) == (False, "hi", None)
+    usage = {"prompt_tokens": 3, "completion_tokens": 1}
+    assert Agent.parse_sse_line("data: " + json.dumps({"choices": [], "usage": usage})) == (False, None, usage)
+
+
+def test_report_stream_timeout(capsys):
+    Agent.report_stream_timeout(None, "read timed out")
+    Agent.report_stream_timeout(time.monotonic() + 30, "connect timed out")
+    Agent.report_stream_timeout(time.monotonic() - 1, "read timed out")
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith("OpenAI request timed out")
+    assert lines[1].startswith("OpenAI request timed out")
+    assert lines[2].startswith("Summary deadline reached")
@@ -0,0 +1,41 @@
+import Agent
+
+
+def test_split_short_message_is_one_part():
+    assert Agent.split_telegram_message("hello") == ["hello"]
+    assert Agent.split_telegram_message("") == [""]
+
+
+def test_split_prefers_paragraph_breaks():
+    text = "a" * 60 + "\n\n" + "b" * 30 + "\n" + "c" * 30
+    parts = Agent.split_telegram_message(text, limit=100)
+    assert parts == ["a" * 60, "b" * 30 + "\n" + "c" * 30]
+
+
+def test_split_counts_utf16_code_units():
+    text = "\U0001F600" * 60  # Each emoji is two UTF-16 code units.
+    parts = Agent.split_telegram_message(text, limit=50)
+    assert all(Agent.utf16_len(part) <= 50 for part in parts)
+    assert "".join(parts) == text
+
+
+def test_split_long_word_is_cut_at_the_limit():
+    parts = Agent.split_telegram_message("x" * 250, limit=100)
+    assert parts == ["x" * 100, "x" * 100, "x" * 50]
+
+
+def test_post_keeps_profile_and_span(monkeypatch):
+    seen = []
+
+    def send(token, chat_id, text):
+        seen.append((chat_id, Agent._current_profile.get(), Agent._current_span.get()))
+        return True
+
+    monkeypatch.setattr(Agent, "send_telegram_message", send)
+    profile = {"name": "amy", "path": "/tmp/amy",
+               "settings": {"TELEGRAM_BOT_TOKEN": "t", "TELEGRAM_CHAT_ID": [1, 2, 3]}}
+    with Agent.use_profile(profile), Agent.span("briefing") as root:
+        Agent.post_telegram_summary("summary", None)
+    assert sorted(str(chat_id) for chat_id, _, _ in seen) == ["1", "2", "3"]
+    assert all(active is profile for _, active, _ in seen)
+    assert all(current is not None and current["trace_id"] == root["trace_id"] for _, _, current in seen)